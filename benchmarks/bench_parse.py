@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of the parsing of Alpha Vantage daily payloads.
+
+Compares the former dict-per-row parse (json decode, one dict per day with float()/int() calls,
+DataFrame from records, pd.to_datetime) with the columnar `parse_time_series` path, on
+synthetic full-history payloads. No API or database access is needed.
+
+Usage:
+    python -m benchmarks.bench_parse --payloads 20 --days 6000
+"""
+import argparse
+import json
+import os
+import time
+import pandas as pd
+from benchmarks.synthetic import make_time_series_payload
+
+# `src.ingestion_stock` requires API settings at import time, none are used here
+os.environ.setdefault("ALPHA_VANTAGE_API_KEY", "benchmark")
+os.environ.setdefault("ALPHA_VANTAGE_BASE_URL", "http://127.0.0.1")
+
+from src.ingestion_stock import parse_time_series, json_loads  # noqa: E402
+
+
+def legacy_parse(content, ticker):
+    """
+    The dict-per-row parse used before `parse_time_series`.
+    """
+    time_series = json.loads(content).get('Time Series (Daily)', {})
+    records = []
+    for date, stats in time_series.items():
+        records.append({
+            "Date": date,
+            "Ticker": str(ticker),
+            "Open": float(stats['1. open']),
+            "High": float(stats['2. high']),
+            "Low": float(stats['3. low']),
+            "Close": float(stats['4. close']),
+            "Volume": int(stats['5. volume'])
+        })
+    df = pd.DataFrame(records)
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def columnar_parse(content, ticker):
+    """
+    The current parse: fast JSON decode when available, then typed columns.
+    """
+    return parse_time_series(json_loads(content).get('Time Series (Daily)', {}), ticker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payloads', type=int, default=20)
+    parser.add_argument('--days', type=int, default=6000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    payloads = [
+        (f"T{i:05d}", json.dumps(make_time_series_payload(f"T{i:05d}", args.days, seed=i)).encode())
+        for i in range(args.payloads)
+    ]
+    total_rows = args.payloads * args.days
+
+    # Both paths must produce the same frame
+    expected = legacy_parse(payloads[0][1], payloads[0][0])
+    pd.testing.assert_frame_equal(columnar_parse(payloads[0][1], payloads[0][0]), expected)
+
+    print(f"{'path':<10} {'rows':>10} {'best (s)':>10} {'rows/sec':>12}")
+    for name, parse in [('legacy', legacy_parse), ('columnar', columnar_parse)]:
+        timings = []
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            for ticker, content in payloads:
+                parse(content, ticker)
+            timings.append(time.perf_counter() - start_time)
+        best = min(timings)
+        print(f"{name:<10} {total_rows:>10} {best:>10.2f} {total_rows / best:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+End-to-end benchmark of the pipeline against the local API stub and a local PostgreSQL database.
+
+Runs three scenarios in order, each in a fresh process so that its peak memory can be measured:
+- full_backfill: empty database, every ticker is fetched with its full history.
+- compact_refresh: two new sessions are available, every ticker is fetched compact.
+- no_change_rerun: the same compact payloads are fetched again, the merge changes no row.
+
+The stub (`benchmarks/stub_api.py`) serves consistent synthetic bars ending one session before the
+last trading session, so every scenario goes through fetch, validation, merge and aggregation.
+The database `--db-name` (created if needed, on the server configured in the .env file) is
+reset by the backfill, and the local store and run metrics go to a temporary directory.
+
+Per-stage throughput is rows per second of stage time. Fetches run concurrently, so the fetch
+stage time is summed over the workers and the run duration is reported separately.
+
+Usage:
+    python -m benchmarks.bench_pipeline --tickers 50 --days 5000 --save-baseline baseline.json
+    python -m benchmarks.bench_pipeline --tickers 50 --days 5000 --baseline baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sqlalchemy import create_engine, text
+
+SCENARIOS = [
+    # (name, sessions hidden by the stub before the run)
+    ('full_backfill', 2),
+    ('compact_refresh', 0),
+    ('no_change_rerun', 0),
+]
+BENCH_TABLES = ['raw_data', 'raw_data_changes', 'agg_stock_data', 'agg_stock_data_refreshes', 'quarantine_raw_data', 'stock_metrics']
+
+
+def session_offset(date, sessions):
+    return str(np.busday_offset(np.datetime64(date, 'D'), -sessions, roll='backward'))
+
+
+def create_database(db_name):
+    """
+    Creates the benchmark database on the configured server if it does not exist.
+    """
+    from src.db.db_operations import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+    engine = create_engine(f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/postgres",
+                           isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {'name': db_name}).scalar():
+            conn.execute(text(f'CREATE DATABASE "{db_name}"'))
+    engine.dispose()
+
+
+def start_stub(args, port, end_date, history_end):
+    """
+    Starts the API stub in a subprocess and waits until it accepts calls.
+    """
+    stub = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.stub_api', '--port', str(port), '--days', str(args.days),
+         '--history-end', history_end, '--end-date', end_date, '--latency', str(args.latency),
+         '--calls-per-minute', str(args.stub_calls_per_minute), '--warm', str(args.tickers)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    stub.stdout.readline()  # Printed once the payloads are generated and the server is listening
+    return stub
+
+
+def run_scenario(name, tickers, reset):
+    """
+    Runs the pipeline once in live mode and returns the summary of the run (executed in a child process).
+    """
+    from src.db.db_operations import init_db
+    from src.main import fetch_and_process_data
+
+    db_engine = init_db()
+    if reset:
+        with db_engine.connect() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {', '.join(BENCH_TABLES)}"))
+            conn.commit()
+
+    metrics = fetch_and_process_data(debug=False, streaming=False, db_engine=db_engine, profile=None, tickers=tickers)
+    return metrics.summary()
+
+
+def stage_throughput(summary):
+    """
+    Returns the rows per second of stage time of each stage of a run summary.
+    """
+    throughput = {}
+    for name, stage in summary['stages'].items():
+        rows = stage['rows_in'] or stage['rows_out']
+        throughput[name] = rows / stage['seconds'] if stage['seconds'] else 0.0
+    return throughput
+
+
+def report(results, baseline=None, tolerance=0.2):
+    """
+    Prints the per-stage results and their change against the baseline.
+
+    Returns:
+        int: The number of stages slower than the baseline by more than `tolerance`.
+    """
+    regressions = 0
+    print(f"{'scenario':<16} {'stage':<13} {'calls':>6} {'rows':>10} {'seconds':>9} {'rows/sec':>12} {'vs base':>8}")
+    for name, summary in results.items():
+        base = (baseline or {}).get(name)
+        base_throughput = stage_throughput(base) if base else {}
+        for stage_name, rows_per_sec in stage_throughput(summary).items():
+            stage = summary['stages'][stage_name]
+            change = ""
+            if base_throughput.get(stage_name):
+                ratio = rows_per_sec / base_throughput[stage_name] - 1
+                change = f"{ratio:+.0%}"
+                if ratio < -tolerance:
+                    regressions += 1
+                    change += " !"
+            print(f"{name:<16} {stage_name:<13} {stage['calls']:>6} {stage['rows_in'] or stage['rows_out']:>10} "
+                  f"{stage['seconds']:>9.2f} {rows_per_sec:>12.0f} {change:>8}")
+
+        duration_change = f" ({summary['duration_seconds'] / base['duration_seconds'] - 1:+.0%})" if base else ""
+        print(f"{name:<16} run duration {summary['duration_seconds']:.2f}s{duration_change}, "
+              f"peak RSS {summary['max_rss_bytes'] / 2**20:.0f} MiB, "
+              f"rows inserted {summary['counters'].get('rows_inserted', 0)}, "
+              f"updated {summary['counters'].get('rows_updated', 0)}, "
+              f"API calls {summary['counters'].get('api_calls', 0)}\n")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline end to end against the local API stub.")
+    parser.add_argument('--tickers', type=int, default=50)
+    parser.add_argument('--days', type=int, default=5000, help="History length served per ticker.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean simulated API latency, in seconds.")
+    parser.add_argument('--stub-calls-per-minute', type=int, default=0, help="Throttle the stub (0 disables).")
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--db-name', default='stock_bench')
+    parser.add_argument('--baseline', help="Compare the results with this baseline JSON file.")
+    parser.add_argument('--save-baseline', help="Write the results to this baseline JSON file.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed throughput drop against the baseline.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.environ.update({
+        'ALPHA_VANTAGE_API_KEY': 'benchmark',
+        'ALPHA_VANTAGE_BASE_URL': f"http://127.0.0.1:{args.port}/query",
+        'DB_NAME': args.db_name,
+        'LOCAL_STORE_PATH': os.path.join(work_dir, 'stock_store'),
+        'METRICS_DIR': os.path.join(work_dir, 'metrics'),
+        'PIPELINE_PROFILE': '',
+    })
+    os.environ.setdefault('API_CALLS_PER_MINUTE', '100000')  # Only the stub throttles unless configured
+    os.environ.setdefault('API_BURST', '100')
+    create_database(args.db_name)
+
+    from src.fetch_planner import last_trading_session
+    history_end = session_offset(last_trading_session(), 1)
+    tickers = [f"T{i:05d}" for i in range(args.tickers)]
+
+    results = {}
+    for name, hidden_sessions in SCENARIOS:
+        stub = start_stub(args, args.port, session_offset(history_end, hidden_sessions), history_end)
+        try:
+            start_time = time.monotonic()
+            # A fresh process per scenario, so that its peak RSS is its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results[name] = executor.submit(run_scenario, name, tickers, name == 'full_backfill').result()
+            print(f"{name} finished in {time.monotonic() - start_time:.1f} seconds.", file=sys.stderr)
+        finally:
+            stub.terminate()
+            stub.wait()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scenarios']
+
+    regressions = report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'parameters': vars(args), 'scenarios': results}, f, indent=2)
+        print(f"Baseline written to '{args.save_baseline}'.")
+
+    if baseline and regressions:
+        print(f"{regressions} stages are more than {args.tolerance:.0%} slower than the baseline.")
+    sys.exit(1 if baseline and regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
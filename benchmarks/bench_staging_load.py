@@ -0,0 +1,68 @@
+"""
+Compares the throughput of the CDC staging load paths of `insert_raw_data_with_cdc`.
+
+Each method loads the same synthetic frame into an empty copy of the raw data table, so
+every row goes through the staging table and the ON CONFLICT merge.
+
+Usage:
+    python -m benchmarks.bench_staging_load --tickers 200 --days 1000
+"""
+import argparse
+import time
+from sqlalchemy import text
+from src.db.db_operations import init_db, insert_raw_data_with_cdc
+from src.db.schema import reset_schema_cache
+from benchmarks.synthetic import make_stock_frame
+
+BENCH_TABLE = 'bench_raw_data'
+
+
+def run_load(db_engine, df, load_method):
+    """
+    Loads `df` into an empty benchmark table and returns the elapsed seconds.
+    """
+    with db_engine.connect() as conn:
+        conn.execute(text(f"TRUNCATE {BENCH_TABLE}, {BENCH_TABLE}_changes"))
+        conn.commit()
+
+    start_time = time.perf_counter()
+    insert_raw_data_with_cdc(db_engine, df.copy(), table_name=BENCH_TABLE, load_method=load_method)
+    elapsed = time.perf_counter() - start_time
+
+    with db_engine.connect() as conn:
+        loaded_rows = conn.execute(text(f"SELECT COUNT(*) FROM {BENCH_TABLE}")).scalar()
+    if loaded_rows != len(df):
+        raise RuntimeError(f"The '{load_method}' load merged {loaded_rows} of {len(df)} rows. Check db_operations.log.")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=100)
+    parser.add_argument('--days', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db_engine = init_db()
+    df = make_stock_frame(args.tickers, args.days)
+
+    # Create the benchmark table through the regular load path
+    with db_engine.connect() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}, {BENCH_TABLE}_changes"))
+        conn.commit()
+    reset_schema_cache()
+    insert_raw_data_with_cdc(db_engine, df.head(1).copy(), table_name=BENCH_TABLE)
+
+    print(f"{'method':<8} {'rows':>10} {'best (s)':>10} {'rows/sec':>12}")
+    for load_method in ['to_sql', 'copy']:
+        best = min(run_load(db_engine, df, load_method) for _ in range(args.repeat))
+        print(f"{load_method:<8} {len(df):>10} {best:>10.2f} {len(df) / best:>12.0f}")
+
+    with db_engine.connect() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}, {BENCH_TABLE}_changes"))
+        conn.commit()
+    reset_schema_cache()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Checks that every aggregation path produces the same metrics as the full SQL rebuild.
+
+A reference table is built with a full rebuild using the SQL backend. For each candidate
+(backend, mode), a second table is built with a full rebuild of that backend; in incremental
+mode it is then made stale by deleting its latest rows and a scattering of older rows per
+ticker, and brought back up to date with an incremental refresh. In changeset mode the refresh
+is given the first deleted date per ticker as the change set of a merge instead of detecting
+the changes. Both tables must then hold the same rows, with metrics equal within a relative
+tolerance and identical NULLs.
+
+Usage:
+    python -m benchmarks.check_agg_parity
+"""
+import sys
+from sqlalchemy import text
+from src.db.db_operations import init_db, aggregate_stock_data, AGG_METRIC_COLUMNS
+from src.db.schema import reset_schema_cache
+
+REFERENCE_TABLE = 'bench_agg_reference'
+CANDIDATE_TABLE = 'bench_agg_candidate'
+CANDIDATES = [('sql', 'incremental'), ('sql', 'changeset'), ('pandas', 'full'), ('pandas', 'incremental'),
+              ('pandas', 'changeset')]
+RELATIVE_TOLERANCE = 1e-8
+ABSOLUTE_TOLERANCE = 1e-12
+
+
+def drop_tables(db_engine):
+    with db_engine.connect() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {REFERENCE_TABLE}, {CANDIDATE_TABLE}, "
+                          f"{REFERENCE_TABLE}_refreshes, {CANDIDATE_TABLE}_refreshes"))
+        conn.commit()
+    reset_schema_cache()
+
+
+def count_mismatches(db_engine):
+    """
+    Returns the number of rows that differ between the reference and the candidate table.
+    """
+    diff_sql = " OR ".join(
+        ["f.curr_timestamp IS DISTINCT FROM i.curr_timestamp"] +
+        [f"(f.{col} IS NULL) <> (i.{col} IS NULL) OR "
+         f"ABS(f.{col} - i.{col}) > GREATEST({ABSOLUTE_TOLERANCE}, {RELATIVE_TOLERANCE} * ABS(f.{col}))"
+         for col in AGG_METRIC_COLUMNS]
+    )
+    with db_engine.connect() as conn:
+        return conn.execute(text(f"""
+            SELECT COUNT(*)
+            FROM {REFERENCE_TABLE} f
+            FULL JOIN {CANDIDATE_TABLE} i ON f.ticker = i.ticker AND f.date = i.date
+            WHERE f.ticker IS NULL OR i.ticker IS NULL OR {diff_sql}
+        """)).scalar()
+
+
+def main():
+    db_engine = init_db()
+    drop_tables(db_engine)
+    aggregate_stock_data(db_engine, table_name=REFERENCE_TABLE, mode='full', backend='sql')
+    with db_engine.connect() as conn:
+        total = conn.execute(text(f"SELECT COUNT(*) FROM {REFERENCE_TABLE}")).scalar()
+
+    failed = False
+    for backend, mode in CANDIDATES:
+        with db_engine.connect() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {CANDIDATE_TABLE}"))
+            conn.commit()
+        reset_schema_cache(CANDIDATE_TABLE)
+        aggregate_stock_data(db_engine, table_name=CANDIDATE_TABLE, mode='full', backend=backend)
+
+        if mode in ('incremental', 'changeset'):
+            with db_engine.connect() as conn:
+                # Drop the last 5 rows and every 37th row of each ticker to simulate changes
+                conn.execute(text(f"""
+                    DELETE FROM {CANDIDATE_TABLE} a
+                    USING (
+                        SELECT ticker, date,
+                            ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY date DESC) AS rn
+                        FROM {CANDIDATE_TABLE}
+                    ) s
+                    WHERE a.ticker = s.ticker AND a.date = s.date AND (s.rn <= 5 OR s.rn % 37 = 0)
+                """))
+                changes = dict(conn.execute(text(f"""
+                    SELECT f.ticker, MIN(f.date)
+                    FROM {REFERENCE_TABLE} f
+                    LEFT JOIN {CANDIDATE_TABLE} i ON f.ticker = i.ticker AND f.date = i.date
+                    WHERE i.ticker IS NULL
+                    GROUP BY f.ticker
+                """)).all())
+                conn.commit()
+            aggregate_stock_data(db_engine, table_name=CANDIDATE_TABLE, mode='incremental', backend=backend,
+                                 changes=changes if mode == 'changeset' else None)
+
+        mismatches = count_mismatches(db_engine)
+        failed = failed or mismatches > 0
+        print(f"{backend:<7} {mode:<12} compared {total} rows: {mismatches} mismatches.")
+
+    drop_tables(db_engine)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
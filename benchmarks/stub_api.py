@@ -0,0 +1,173 @@
+"""
+Local stand-in for the Alpha Vantage TIME_SERIES_DAILY and TIME_SERIES_INTRADAY endpoints.
+
+Serves synthetic payloads (see `make_time_series_payload`) for any requested symbol, so the
+pipeline can be run end to end without an API key. Point `ALPHA_VANTAGE_BASE_URL` at it:
+
+    python -m benchmarks.stub_api --port 8765 --days 5000 --latency 0.05 --calls-per-minute 75
+    ALPHA_VANTAGE_BASE_URL=http://127.0.0.1:8765/query python -m src.main --live
+
+The history of a symbol always ends at `--history-end`; `--end-date` hides the bars after it, so
+stubs started with different end dates serve consistent bars (e.g. to simulate a daily refresh).
+Intraday calls get the regular-session bars of the last INTRADAY_DAYS sessions up to `--end-date`.
+Calls over `--calls-per-minute` get the 'Note' body Alpha Vantage sends to throttled callers.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from benchmarks.synthetic import make_time_series_payload, make_intraday_payload
+
+COMPACT_DAYS = 100
+COMPACT_BARS = 100
+INTRADAY_DAYS = 20
+THROTTLE_NOTE = ("Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute "
+                 "and 500 calls per day.")
+
+
+class StubState:
+    """
+    Payload cache and quota of a stub server.
+    """
+
+    def __init__(self, days, history_end, end_date=None, latency=0.0, calls_per_minute=0):
+        self.days = days
+        self.history_end = history_end
+        self.end_date = end_date or history_end
+        self.latency = latency
+        self.calls_per_minute = calls_per_minute
+        self.calls = 0
+        self.throttled_calls = 0
+        self._bodies = {}
+        self._call_times = []
+        self._lock = threading.Lock()
+
+    def body(self, symbol, outputsize):
+        """
+        Returns the encoded response for a symbol, generating its history on first use.
+        """
+        key = (symbol, outputsize)
+        with self._lock:
+            if key in self._bodies:
+                return self._bodies[key]
+
+        payload = make_time_series_payload(symbol, self.days, end_date=self.history_end, seed=zlib.crc32(symbol.encode()))
+        bars = [(date, bar) for date, bar in payload['Time Series (Daily)'].items() if date <= self.end_date]
+        if outputsize != 'full':
+            bars = bars[:COMPACT_DAYS]
+        payload['Meta Data']['3. Last Refreshed'] = bars[0][0] if bars else self.end_date
+        payload['Time Series (Daily)'] = dict(bars)
+        body = json.dumps(payload).encode()
+
+        with self._lock:
+            self._bodies[key] = body
+        return body
+
+    def intraday_body(self, symbol, interval, outputsize):
+        """
+        Returns the encoded intraday response for a symbol, generating its bars on first use.
+        """
+        key = (symbol, interval, outputsize)
+        with self._lock:
+            if key in self._bodies:
+                return self._bodies[key]
+
+        payload = make_intraday_payload(symbol, INTRADAY_DAYS, interval, end_date=self.end_date,
+                                        seed=zlib.crc32(symbol.encode()))
+        series_key = f'Time Series ({interval})'
+        if outputsize != 'full':
+            payload[series_key] = dict(list(payload[series_key].items())[:COMPACT_BARS])
+        body = json.dumps(payload).encode()
+
+        with self._lock:
+            self._bodies[key] = body
+        return body
+
+    def is_throttled(self):
+        """
+        Counts a call against the per-minute quota and returns True if it exceeds it.
+        """
+        with self._lock:
+            self.calls += 1
+            if not self.calls_per_minute:
+                return False
+            now = time.monotonic()
+            self._call_times = [t for t in self._call_times if now - t < 60]
+            if len(self._call_times) >= self.calls_per_minute:
+                self.throttled_calls += 1
+                return True
+            self._call_times.append(now)
+            return False
+
+
+def make_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, as the pipeline reuses its connections
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            symbol = query.get('symbol', [''])[0]
+            if state.latency:
+                time.sleep(random.uniform(0.5, 1.5) * state.latency)
+
+            if not symbol:
+                body = json.dumps({'Error Message': 'Invalid API call.'}).encode()
+            elif state.is_throttled():
+                body = json.dumps({'Note': THROTTLE_NOTE}).encode()
+            elif query.get('function', [''])[0] == 'TIME_SERIES_INTRADAY':
+                body = state.intraday_body(symbol, query.get('interval', ['5min'])[0], query.get('outputsize', ['compact'])[0])
+            else:
+                body = state.body(symbol, query.get('outputsize', ['compact'])[0])
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def make_server(state, host='127.0.0.1', port=8765):
+    """
+    Creates the stub HTTP server. Call `serve_forever` to start it.
+    """
+    return ThreadingHTTPServer((host, port), make_handler(state))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic Alpha Vantage daily and intraday payloads.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--days', type=int, default=5000, help="Length of the generated history per symbol.")
+    parser.add_argument('--history-end', default='2025-04-04', help="Date of the latest generated bar.")
+    parser.add_argument('--end-date', default=None, help="Hide the bars after this date. Defaults to --history-end.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean simulated latency per call, in seconds.")
+    parser.add_argument('--calls-per-minute', type=int, default=0, help="Throttle calls over this rate (0 disables).")
+    parser.add_argument('--warm', type=int, default=0, help="Pre-generate the payloads of symbols T00000 to T<n-1>.")
+    args = parser.parse_args()
+
+    state = StubState(args.days, args.history_end, args.end_date, args.latency, args.calls_per_minute)
+    for i in range(args.warm):
+        for outputsize in ['compact', 'full']:
+            state.body(f"T{i:05d}", outputsize)
+
+    server = make_server(state, args.host, args.port)
+    print(f"Serving synthetic payloads on http://{args.host}:{args.port}/query", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+
+def make_stock_frame(n_tickers, n_days, end_date='2025-04-04', seed=42):
+    """
+    Generates a synthetic stock DataFrame in the format produced by the ingestion step.
+
+    Prices follow a random walk per ticker and satisfy low <= open, close <= high.
+
+    Args:
+        n_tickers (int): The number of synthetic tickers.
+        n_days (int): The number of business days per ticker.
+        end_date (str): The date of the latest bar.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: Columns Date, Ticker, Open, High, Low, Close, Volume and curr_timestamp.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=end_date, periods=n_days)
+    n_rows = n_tickers * n_days
+
+    start_prices = rng.uniform(10, 500, size=(n_tickers, 1))
+    close = start_prices * np.cumprod(1 + rng.normal(0, 0.02, size=(n_tickers, n_days)), axis=1)
+    open_ = close * (1 + rng.normal(0, 0.005, size=close.shape))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, size=close.shape))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, size=close.shape))
+
+    df = pd.DataFrame({
+        'Date': np.tile(dates.values, n_tickers),
+        'Ticker': np.repeat([f"T{i:05d}" for i in range(n_tickers)], n_days).astype(object),
+        'Open': open_.ravel().round(4),
+        'High': high.ravel().round(4),
+        'Low': low.ravel().round(4),
+        'Close': close.ravel().round(4),
+        'Volume': rng.integers(10_000, 50_000_000, size=n_rows, dtype=np.int64),
+    })
+    df['curr_timestamp'] = pd.Timestamp.now().to_datetime64()
+    df['curr_timestamp'] = df['curr_timestamp'].astype('datetime64[ns]')
+    return df
+
+
+def make_time_series_payload(ticker, n_days, end_date='2025-04-04', seed=42):
+    """
+    Generates a synthetic Alpha Vantage TIME_SERIES_DAILY response body.
+
+    Args:
+        ticker (str): The ticker symbol reported in the metadata.
+        n_days (int): The number of daily bars.
+        end_date (str): The date of the latest bar.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: The decoded JSON payload, with the bars ordered from the latest to the oldest.
+    """
+    df = make_stock_frame(1, n_days, end_date=end_date, seed=seed).iloc[::-1]
+    time_series = {
+        date: {
+            '1. open': f"{open_:.4f}",
+            '2. high': f"{high:.4f}",
+            '3. low': f"{low:.4f}",
+            '4. close': f"{close:.4f}",
+            '5. volume': str(volume),
+        }
+        for date, open_, high, low, close, volume in zip(
+            df['Date'].dt.strftime('%Y-%m-%d'), df['Open'], df['High'], df['Low'], df['Close'], df['Volume'])
+    }
+    return {
+        'Meta Data': {
+            '1. Information': 'Daily Prices (open, high, low, close) and Volumes',
+            '2. Symbol': ticker,
+            '3. Last Refreshed': end_date,
+            '4. Output Size': 'Full size',
+            '5. Time Zone': 'US/Eastern',
+        },
+        'Time Series (Daily)': time_series,
+    }
+
+
+def make_intraday_payload(ticker, n_days, interval='5min', end_date='2025-04-04', seed=42):
+    """
+    Generates a synthetic Alpha Vantage TIME_SERIES_INTRADAY response body.
+
+    Bars cover the regular session (09:30 to 16:00, US/Eastern) of the last `n_days` business days.
+
+    Args:
+        ticker (str): The ticker symbol reported in the metadata.
+        n_days (int): The number of business days of bars.
+        interval (str): The bar size, e.g. '5min'.
+        end_date (str): The date of the latest session.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: The decoded JSON payload, with the bars ordered from the latest to the oldest.
+    """
+    rng = np.random.default_rng(seed)
+    minutes = int(interval.removesuffix('min'))
+    session_offsets = pd.timedelta_range('09:30:00', '15:59:00', freq=f'{minutes}min')
+    times = (pd.bdate_range(end=end_date, periods=n_days).values[:, None] + session_offsets.values[None, :]).ravel()
+    n_bars = len(times)
+
+    close = rng.uniform(10, 500) * np.cumprod(1 + rng.normal(0, 0.001, size=n_bars))
+    open_ = close * (1 + rng.normal(0, 0.0005, size=n_bars))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.001, size=n_bars))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.001, size=n_bars))
+    volume = rng.integers(100, 500_000, size=n_bars)
+
+    time_series = {
+        timestamp: {
+            '1. open': f"{o:.4f}",
+            '2. high': f"{h:.4f}",
+            '3. low': f"{l:.4f}",
+            '4. close': f"{c:.4f}",
+            '5. volume': str(v),
+        }
+        for timestamp, o, h, l, c, v in zip(pd.DatetimeIndex(times[::-1]).strftime('%Y-%m-%d %H:%M:%S'),
+                                              open_[::-1], high[::-1], low[::-1], close[::-1], volume[::-1])
+    }
+    return {
+        'Meta Data': {
+            '1. Information': f'Intraday ({interval}) open, high, low, close prices and volume',
+            '2. Symbol': ticker,
+            '3. Last Refreshed': next(iter(time_series)),
+            '4. Interval': interval,
+            '5. Output Size': 'Full size',
+            '6. Time Zone': 'US/Eastern',
+        },
+        f'Time Series ({interval})': time_series,
+    }
@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+
+# Output columns, in the order of the agg_stock_data table
+METRIC_COLUMNS = [
+    'avg_daily_price', 'daily_return', 'avg_return_7d', 'avg_return_10d',
+    'price_volatility_7d', 'return_volatility_7d', 'return_volatility_10d'
+]
+
+# Catalog of the indicators of the stock_metrics table: (name, input column, window in rows, statistic).
+# Inputs are the raw price and volume columns or the derived 'daily_return', 'avg_daily_price' and
+# 'true_range' columns. Statistics:
+#   'mean', 'std': trailing mean and sample standard deviation over `window` rows
+#   'zscore': current value against the trailing mean and standard deviation of its window
+#   'ewm': exponentially weighted mean with a span of `window` rows
+#   'ewm_vol': square root of the exponentially weighted mean square (RiskMetrics volatility)
+#   'wilder': Wilder's smoothing (exponentially weighted mean with alpha = 1 / window), e.g. for the ATR
+# A metric is null until its ticker has `window` values of its input.
+METRIC_CATALOG = [
+    ('sma_20', 'close', 20, 'mean'),
+    ('sma_50', 'close', 50, 'mean'),
+    ('sma_200', 'close', 200, 'mean'),
+    ('ema_20', 'close', 20, 'ewm'),
+    ('close_zscore_20', 'close', 20, 'zscore'),
+    ('return_volatility_20d', 'daily_return', 20, 'std'),
+    ('ewma_volatility_20d', 'daily_return', 20, 'ewm_vol'),
+    ('atr_14', 'true_range', 14, 'wilder'),
+    ('volume_sma_20', 'volume', 20, 'mean'),
+    ('volume_zscore_20', 'volume', 20, 'zscore'),
+]
+
+CATALOG_INPUTS = ['open', 'high', 'low', 'close', 'volume', 'daily_return', 'avg_daily_price', 'true_range']
+CATALOG_STATISTICS = ['mean', 'std', 'zscore', 'ewm', 'ewm_vol', 'wilder']
+
+# Columns of the long frames returned by `compute_catalog_metrics`, in the order of the stock_metrics table
+CATALOG_COLUMNS = ['date', 'ticker', 'metric', 'value']
+
+
+def sort_by_ticker_and_date(df):
+    """
+    Sorts raw stock data so that every ticker occupies a contiguous, date-ordered block.
+
+    Args:
+        df (pd.DataFrame): Raw stock data with lowercase 'ticker' and 'date' columns.
+
+    Returns:
+        tuple: The sorted DataFrame, a boolean array marking the first row of each ticker,
+            and an int array with the index of the first row of each row's ticker.
+    """
+    df = df.sort_values(['ticker', 'date'], kind='stable').reset_index(drop=True)
+    tickers = df['ticker'].to_numpy()
+    group_start = np.ones(len(df), dtype=bool)
+    group_start[1:] = tickers[1:] != tickers[:-1]
+    start_index = np.maximum.accumulate(np.where(group_start, np.arange(len(df)), 0))
+    return df, group_start, start_index
+
+
+def previous_row_values(values, group_start):
+    """
+    Returns the value of the previous row of the same ticker for every row, NaN for the first row of a ticker.
+    """
+    previous = np.empty_like(values)
+    previous[:1] = np.nan
+    previous[1:] = values[:-1]
+    previous[group_start] = np.nan
+    return previous
+
+
+def _centered_cumsums(values, group_start):
+    """
+    Returns prefix sums of the count, sum and sum of squares of the non-null `values`.
+
+    Values are centered on their ticker's mean before summing, and the squares on their
+    ticker's mean square, so that the prefix sums stay small and window sums taken as their
+    differences keep full precision. Sums are accumulated in extended precision.
+    """
+    valid = ~np.isnan(values)
+    group_id = np.cumsum(group_start) - 1
+    n_groups = group_id[-1] + 1
+
+    counts = np.bincount(group_id, weights=valid, minlength=n_groups)
+    safe_counts = np.maximum(counts, 1)
+    filled = np.where(valid, values, 0.0)
+    group_mean = np.bincount(group_id, weights=filled, minlength=n_groups) / safe_counts
+    centered = np.where(valid, values - group_mean[group_id], 0.0)
+    group_mean_square = np.bincount(group_id, weights=centered ** 2, minlength=n_groups) / safe_counts
+
+    def prefix(x):
+        out = np.zeros(len(x) + 1, dtype=np.longdouble)
+        np.cumsum(x, dtype=np.longdouble, out=out[1:])
+        return out
+
+    return (
+        prefix(valid.astype(np.float64)),
+        prefix(centered),
+        prefix(np.where(valid, centered ** 2 - group_mean_square[group_id], 0.0)),
+        group_mean[group_id],
+        group_mean_square[group_id],
+    )
+
+
+def rolling_mean_std(values, group_start, start_index, window, sums=None):
+    """
+    Computes the trailing `window`-row mean and sample standard deviation of each row.
+
+    Windows never cross into the previous ticker and skip nulls, mirroring
+    `AVG`/`STDDEV(...) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN window-1 PRECEDING AND CURRENT ROW)`:
+    the mean is null when the window holds no value and the standard deviation when it holds fewer than two.
+
+    Args:
+        values (np.ndarray): float64 values sorted by ticker and date, NaN for nulls.
+        group_start (np.ndarray): Marks the first row of each ticker.
+        start_index (np.ndarray): Index of the first row of each row's ticker.
+        window (int): The number of rows in the window, including the current row.
+        sums (tuple): Precomputed `_centered_cumsums(values, group_start)`, to share across windows.
+
+    Returns:
+        tuple: float64 arrays with the rolling mean and the rolling standard deviation.
+    """
+    count_cs, sum_cs, square_cs, mean, mean_square = sums or _centered_cumsums(values, group_start)
+    end = np.arange(1, len(values) + 1)
+    begin = np.maximum(end - window, start_index)
+
+    n = (count_cs[end] - count_cs[begin]).astype(np.float64)
+    total = sum_cs[end] - sum_cs[begin]
+    total_square = square_cs[end] - square_cs[begin] + n * mean_square
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rolling_mean = np.where(n > 0, (total / n).astype(np.float64) + mean, np.nan)
+        variance = ((total_square - total * total / n) / (n - 1)).astype(np.float64)
+        rolling_std = np.where(n > 1, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+    return rolling_mean, rolling_std
+
+
+def compute_stock_metrics(df):
+    """
+    Computes the agg_stock_data metrics in process, without a database.
+
+    This is the vectorized counterpart of the `metrics_query` SQL in `src.db.db_operations`:
+    the rows are sorted into contiguous per-ticker blocks and every rolling statistic is derived
+    in O(n) from prefix sums and sums of squares.
+
+    Args:
+        df (pd.DataFrame): Raw stock data with date, ticker, open, high, low, close and
+            curr_timestamp columns (any capitalization).
+
+    Returns:
+        pd.DataFrame: One row per input row, sorted by ticker and date, with the columns
+            curr_timestamp, date, ticker and METRIC_COLUMNS.
+    """
+    df = df.rename(columns=str.lower)
+    if df.empty:
+        return pd.DataFrame(columns=['curr_timestamp', 'date', 'ticker'] + METRIC_COLUMNS)
+
+    df, group_start, start_index = sort_by_ticker_and_date(df)
+    open_, high, low, close = (df[col].to_numpy(dtype=np.float64) for col in ['open', 'high', 'low', 'close'])
+
+    previous_close = previous_row_values(close, group_start)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_return = (close - previous_close) / previous_close
+    avg_daily_price = (open_ + high + low + close) / 4
+
+    return_sums = _centered_cumsums(daily_return, group_start)
+    avg_return_7d, return_volatility_7d = rolling_mean_std(daily_return, group_start, start_index, 7, return_sums)
+    avg_return_10d, return_volatility_10d = rolling_mean_std(daily_return, group_start, start_index, 10, return_sums)
+    _, price_volatility_7d = rolling_mean_std(avg_daily_price, group_start, start_index, 7)
+
+    return pd.DataFrame({
+        'curr_timestamp': df['curr_timestamp'].to_numpy(),
+        'date': pd.to_datetime(df['date']).dt.normalize().to_numpy(),
+        'ticker': df['ticker'].to_numpy(),
+        'avg_daily_price': avg_daily_price,
+        'daily_return': daily_return,
+        'avg_return_7d': avg_return_7d,
+        'avg_return_10d': avg_return_10d,
+        'price_volatility_7d': price_volatility_7d,
+        'return_volatility_7d': return_volatility_7d,
+        'return_volatility_10d': return_volatility_10d,
+    })
+
+
+def select_catalog(names=None, catalog=METRIC_CATALOG):
+    """
+    Returns the catalog entries of the requested metrics.
+
+    Args:
+        names (str or list): Metric names, as a list or a comma-separated string. None or 'all'
+            selects the whole catalog.
+        catalog (list): The catalog to select from. Defaults to METRIC_CATALOG.
+
+    Returns:
+        list: The selected (name, input column, window, statistic) entries, in catalog order.
+
+    Raises:
+        ValueError: If a name is not in the catalog, or an entry has an unknown input or statistic.
+    """
+    for name, column, window, statistic in catalog:
+        if column not in CATALOG_INPUTS or statistic not in CATALOG_STATISTICS or int(window) < 1:
+            raise ValueError(f"Invalid catalog entry '{name}': input must be one of {CATALOG_INPUTS}, "
+                             f"statistic one of {CATALOG_STATISTICS} and window at least 1.")
+    if names is None or names == 'all':
+        return list(catalog)
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = sorted(set(names) - {entry[0] for entry in catalog})
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}. Must be in {[entry[0] for entry in catalog]}.")
+    return [entry for entry in catalog if entry[0] in names]
+
+
+def _catalog_input(df, column, group_start):
+    """
+    Returns the float64 values of a catalog input column of data sorted by ticker and date.
+    """
+    if column == 'daily_return':
+        close = df['close'].to_numpy(dtype=np.float64)
+        previous_close = previous_row_values(close, group_start)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (close - previous_close) / previous_close
+    if column == 'avg_daily_price':
+        return sum(df[col].to_numpy(dtype=np.float64) for col in ['open', 'high', 'low', 'close']) / 4
+    if column == 'true_range':
+        high, low, close = (df[col].to_numpy(dtype=np.float64) for col in ['high', 'low', 'close'])
+        previous_close = previous_row_values(close, group_start)
+        # The first row of a ticker has no previous close: its range is high - low
+        return np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+    return df[column].to_numpy(dtype=np.float64)
+
+
+def _grouped_ewm_mean(values, group_start, alpha, min_periods):
+    """
+    Returns the exponentially weighted mean of `values` within each ticker, seeded with its first value.
+    """
+    ewm = pd.Series(values).groupby(np.cumsum(group_start)).ewm(alpha=alpha, adjust=False, min_periods=min_periods)
+    # The tickers are contiguous blocks in ascending order, so the grouped result keeps the row order
+    return ewm.mean().to_numpy()
+
+
+def compute_catalog_metrics(df, catalog=METRIC_CATALOG):
+    """
+    Computes the metrics of a catalog in a single sorted pass over raw stock data.
+
+    The rows are sorted into contiguous per-ticker blocks once, every input column is derived
+    once, and the prefix sums of an input are shared by all the windowed statistics over it, so
+    adding a metric costs one O(n) vectorized step over data already in memory rather than
+    another scan and sort. The exponentially weighted statistics run over each ticker's whole
+    history, so `df` must hold the full history of its tickers for them to be exact.
+
+    Args:
+        df (pd.DataFrame): Raw stock data with date, ticker and the price and volume columns the
+            catalog needs (any capitalization).
+        catalog (list): The (name, input column, window, statistic) entries to compute, see
+            METRIC_CATALOG and `select_catalog`.
+
+    Returns:
+        pd.DataFrame: Long format with the columns CATALOG_COLUMNS, one row per non-null metric
+            value, grouped by metric in catalog order and sorted by ticker and date within a metric.
+    """
+    df = df.rename(columns=str.lower)
+    if df.empty or not catalog:
+        return pd.DataFrame(columns=CATALOG_COLUMNS)
+
+    df, group_start, start_index = sort_by_ticker_and_date(df)
+    end = np.arange(1, len(df) + 1)
+    inputs, sums, metric_values = {}, {}, []
+    for name, column, window, statistic in catalog:
+        if column not in inputs:
+            inputs[column] = _catalog_input(df, column, group_start)
+        values = inputs[column]
+
+        if statistic in ('mean', 'std', 'zscore'):
+            if column not in sums:
+                sums[column] = _centered_cumsums(values, group_start)
+            mean, std = rolling_mean_std(values, group_start, start_index, window, sums[column])
+            count_cs = sums[column][0]
+            full_window = (count_cs[end] - count_cs[np.maximum(end - window, start_index)]) >= window
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = {'mean': mean, 'std': std, 'zscore': (values - mean) / std}[statistic]
+            result = np.where(full_window, result, np.nan)
+        elif statistic == 'ewm':
+            result = _grouped_ewm_mean(values, group_start, 2 / (window + 1), window)
+        elif statistic == 'ewm_vol':
+            result = np.sqrt(_grouped_ewm_mean(values * values, group_start, 2 / (window + 1), window))
+        else:
+            result = _grouped_ewm_mean(values, group_start, 1 / window, window)
+        metric_values.append(np.where(np.isfinite(result), result, np.nan))
+
+    values = np.concatenate(metric_values)
+    valid = ~np.isnan(values)
+    n_metrics = len(catalog)
+    return pd.DataFrame({
+        'date': np.tile(pd.to_datetime(df['date']).dt.normalize().to_numpy(), n_metrics)[valid],
+        'ticker': np.tile(df['ticker'].to_numpy(), n_metrics)[valid],
+        'metric': np.repeat(np.array([entry[0] for entry in catalog], dtype=object), len(df))[valid],
+        'value': values[valid],
+    })
@@ -0,0 +1,203 @@
+from src.fetch_engine import iter_fetch_results
+from src.db.db_operations import create_db_engine, aggregate_stock_data, drop_secondary_indexes, recreate_indexes
+from src.db.stock_metrics import refresh_stock_metrics
+from src.db.schema import ensure_schema
+from src.config.constants import TICKERS
+from src.main import build_stock_frame, merge_stock_data
+from src.monitoring.instrumentation import instrumented_run, increment, write_atomically
+from sqlalchemy import text
+from datetime import datetime
+import argparse
+import json
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler("backfill.log", mode="a")
+    ]
+)
+
+# Backfill configuration
+BACKFILL_CHECKPOINT = os.getenv("BACKFILL_CHECKPOINT", "backfill_checkpoint.json")  # Progress of the backfill, to resume it
+BACKFILL_BATCH_ROWS = int(os.getenv("BACKFILL_BATCH_ROWS", 500000))  # Fetched rows merged per transaction
+
+# Tables whose secondary indexes are dropped during the load and rebuilt at the end
+BACKFILL_RELAXED_TABLES = ['raw_data', 'agg_stock_data']
+
+
+def new_checkpoint():
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'completed': [],  # Tickers whose full history is merged
+        'failed': {},  # Ticker -> reason of the last failure
+        'rows_loaded': 0,
+        'aggregated': True,  # False while merged rows wait for the final aggregation
+        'dropped_indexes': {},  # Table -> CREATE INDEX statements to run when the backfill ends
+    }
+
+
+def load_checkpoint(path):
+    """
+    Reads the checkpoint of a previous backfill, or starts a new one if there is none.
+    """
+    if not os.path.exists(path):
+        return new_checkpoint()
+    with open(path) as f:
+        checkpoint = json.load(f)
+    logging.info(f"Resuming the backfill started at {checkpoint['started_at']}: "
+                 f"{len(checkpoint['completed'])} tickers already loaded.")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    write_atomically(path, json.dumps(checkpoint, indent=2))
+
+
+def relax_indexes(db_engine, checkpoint, checkpoint_path):
+    """
+    Drops the secondary indexes of BACKFILL_RELAXED_TABLES, recording them in the checkpoint first
+    so that an interrupted backfill still rebuilds them when it resumes.
+    """
+    with db_engine.connect() as conn:
+        for table_name in BACKFILL_RELAXED_TABLES:
+            definitions = drop_secondary_indexes(conn, table_name)
+            known = checkpoint['dropped_indexes'].setdefault(table_name, [])
+            known.extend(definition for definition in definitions if definition not in known)
+        save_checkpoint(checkpoint_path, checkpoint)
+        conn.commit()
+
+
+def restore_indexes(db_engine, checkpoint, checkpoint_path):
+    """
+    Recreates the indexes dropped by `relax_indexes` and refreshes the planner statistics.
+    """
+    with db_engine.connect() as conn:
+        for table_name, definitions in checkpoint['dropped_indexes'].items():
+            recreate_indexes(conn, definitions)
+        conn.commit()
+        for table_name in BACKFILL_RELAXED_TABLES:
+            conn.execute(text(f"ANALYZE {table_name}"))
+        conn.commit()
+    checkpoint['dropped_indexes'] = {}
+    save_checkpoint(checkpoint_path, checkpoint)
+
+
+def load_batch(db_engine, frames, tickers, checkpoint, checkpoint_path):
+    """
+    Merges a batch of fetched histories and records its tickers as completed.
+    """
+    df = build_stock_frame(frames)
+    logging.info(f"Merging {len(df)} rows of {len(tickers)} tickers...")
+    # The backfill ends with a full rebuild of the aggregates, so the changed keys are not logged
+    if merge_stock_data(db_engine, df, log_changes=False) is None:
+        checkpoint['failed'].update({ticker: "Load failed" for ticker in tickers})
+        increment('tickers_failed', len(tickers))
+    else:
+        checkpoint['completed'].extend(tickers)
+        for ticker in tickers:
+            checkpoint['failed'].pop(ticker, None)
+        checkpoint['rows_loaded'] += len(df)
+        checkpoint['aggregated'] = False
+        increment('tickers_succeeded', len(tickers))
+    save_checkpoint(checkpoint_path, checkpoint)
+
+
+def backfill(tickers, checkpoint_path=BACKFILL_CHECKPOINT, batch_rows=BACKFILL_BATCH_ROWS, relax=True, restart=False):
+    """
+    Loads the full history of every ticker, resuming from the checkpoint of an interrupted run.
+
+    The histories are fetched concurrently (paced by the shared rate limiter) and merged in
+    batches of about `batch_rows` rows through the COPY staging path, while the next ones are
+    being fetched. A ticker is checkpointed once its batch is committed, so a resumed backfill
+    only fetches the tickers not loaded yet. For speed, the load runs with
+    `synchronous_commit=off` and without the secondary indexes of BACKFILL_RELAXED_TABLES, and
+    `agg_stock_data` is rebuilt once at the end instead of after every batch. The unique
+    constraints the merge relies on are never dropped.
+
+    Args:
+        tickers (list): The tickers to backfill.
+        checkpoint_path (str): The checkpoint file. Defaults to BACKFILL_CHECKPOINT.
+        batch_rows (int): The number of fetched rows merged per transaction. Defaults to BACKFILL_BATCH_ROWS.
+        relax (bool): Drop the secondary indexes during the load. Defaults to True.
+        restart (bool): Ignore the tickers completed by a previous backfill. Defaults to False.
+
+    Returns:
+        dict: The checkpoint at the end of the backfill.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    if restart:
+        checkpoint.update({key: value for key, value in new_checkpoint().items() if key != 'dropped_indexes'})
+    completed = set(checkpoint['completed'])
+    pending = [ticker for ticker in dict.fromkeys(tickers) if ticker not in completed]
+    logging.info(f"Backfilling {len(pending)} tickers ({len(tickers) - len(pending)} already loaded).")
+
+    # Durability of every single commit is not needed: an interrupted backfill is resumed from the checkpoint
+    db_engine = create_db_engine(connect_args={'options': '-c synchronous_commit=off'})
+    try:
+        ensure_schema(db_engine)
+        with instrumented_run(job='backfill'):
+            try:
+                if relax and pending:
+                    relax_indexes(db_engine, checkpoint, checkpoint_path)
+
+                frames, batch_tickers, batch_size = [], [], 0
+                for ticker, df in iter_fetch_results(pending, outputsizes=dict.fromkeys(pending, 'full')):
+                    if df.empty:
+                        checkpoint['failed'][ticker] = "No data fetched"
+                        increment('tickers_failed')
+                        continue
+                    frames.append(df)
+                    batch_tickers.append(ticker)
+                    batch_size += len(df)
+                    if batch_size >= batch_rows:
+                        load_batch(db_engine, frames, batch_tickers, checkpoint, checkpoint_path)
+                        frames, batch_tickers, batch_size = [], [], 0
+                if frames:
+                    load_batch(db_engine, frames, batch_tickers, checkpoint, checkpoint_path)
+
+                if not checkpoint['aggregated']:
+                    logging.info("Rebuilding the aggregated metrics of the backfilled data...")
+                    checkpoint['aggregated'] = (aggregate_stock_data(db_engine, mode='full')
+                                                and refresh_stock_metrics(db_engine, mode='full'))
+                    save_checkpoint(checkpoint_path, checkpoint)
+            finally:
+                if checkpoint['dropped_indexes']:
+                    restore_indexes(db_engine, checkpoint, checkpoint_path)
+    finally:
+        db_engine.dispose()
+
+    logging.info(f"Backfill finished: {len(checkpoint['completed'])} tickers loaded ({checkpoint['rows_loaded']} rows), "
+                 f"{len(checkpoint['failed'])} failed.")
+    if checkpoint['failed']:
+        logging.warning(f"Failed tickers, retried by the next backfill: {', '.join(checkpoint['failed'])}")
+    return checkpoint
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the full history of a list of tickers.")
+    parser.add_argument('tickers', nargs='*', help="Ticker symbols. Defaults to the tickers of constants.py.")
+    parser.add_argument('--file', help="File with one ticker symbol per line.")
+    parser.add_argument('--checkpoint', default=BACKFILL_CHECKPOINT, help="Checkpoint file used to resume the backfill.")
+    parser.add_argument('--batch-rows', type=int, default=BACKFILL_BATCH_ROWS, help="Fetched rows merged per transaction.")
+    parser.add_argument('--keep-indexes', action='store_true', help="Do not drop the secondary indexes during the load.")
+    parser.add_argument('--restart', action='store_true', help="Ignore the progress recorded in the checkpoint.")
+    args = parser.parse_args()
+
+    tickers = list(args.tickers)
+    if args.file:
+        with open(args.file) as f:
+            tickers += [line.strip() for line in f if line.strip()]
+
+    checkpoint = backfill(tickers or TICKERS, args.checkpoint, args.batch_rows, relax=not args.keep_indexes,
+                          restart=args.restart)
+    sys.exit(1 if checkpoint['failed'] or not checkpoint['aggregated'] else 0)
@@ -1,6 +1,13 @@
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import create_engine, text
 from sqlalchemy.exc import OperationalError
+from src.db.schema import (ensure_raw_table, ensure_agg_table, ensure_quarantine_table, ensure_change_log, ensure_refresh_log,
+                           ensure_pending_aggregation, ensure_year_partitions, partition_years, reset_schema_cache)
+from src.monitoring.instrumentation import stage, increment, get_run_metrics, mark_run_failed
+from src.aggregation.metrics_engine import compute_stock_metrics, METRIC_COLUMNS
+import pandas as pd
+import threading
 import time
+import io
 import os
 import logging
 from dotenv import load_dotenv
@@ -25,19 +32,93 @@ DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "stock_db")
 
+# Connection pool configuration
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # Check connections before use
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # Seconds before a connection is replaced
 
-def create_db_engine():
+# Staging load configuration
+STAGING_LOAD_METHOD = os.getenv("STAGING_LOAD_METHOD", "copy")  # 'copy' (COPY FROM STDIN) or 'to_sql'
+COPY_CHUNK_ROWS = int(os.getenv("COPY_CHUNK_ROWS", 100000))  # Rows serialized per COPY statement
+
+VALID_LOAD_METHODS = ['copy', 'to_sql']
+
+# Change logs of the CDC merge and of the aggregation
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", 30))  # Days of changes and refreshes kept (0 keeps everything)
+
+# Aggregation configuration
+AGGREGATION_MODE = os.getenv("AGGREGATION_MODE", "incremental")  # 'incremental' or 'full'
+AGGREGATION_BACKEND = os.getenv("AGGREGATION_BACKEND", "sql")  # 'sql' (window functions) or 'pandas' (in process)
+
+# Derived tables (agg_stock_data, stock_metrics) whose last refresh failed without its change set being
+# recorded: their next refresh in this process recomputes every changed row (see `record_failed_aggregation`)
+_unrecorded_failures = set()
+
+# Columns of the raw data table, in load order
+RAW_DATA_COLUMNS = ['date', 'ticker', 'open', 'high', 'low', 'close', 'volume', 'curr_timestamp']
+
+# Staging table with fixed column types. It only lives until the merge transaction commits.
+STAGING_TABLE_DDL = """
+CREATE TEMP TABLE {staging_table_name} (
+    date DATE,
+    ticker TEXT,
+    open NUMERIC(18, 6),
+    high NUMERIC(18, 6),
+    low NUMERIC(18, 6),
+    close NUMERIC(18, 6),
+    volume BIGINT,
+    curr_timestamp TIMESTAMP
+) ON COMMIT DROP
+"""
+
+
+def create_db_engine(connect_args=None):
     """
     Creates and returns a SQLAlchemy engine for the PostgreSQL database.
+
+    connect_args: Optional psycopg2 connection arguments, e.g. {'options': '-c synchronous_commit=off'}
+    """
+    return create_engine(
+        f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,
+        connect_args=connect_args or {},
+    )
+
+# Long-lived engine shared by every run of the process
+_db_engine = None
+_db_engine_verified = False
+_db_engine_lock = threading.Lock()
+
+
+def get_db_engine():
+    """
+    Returns the process-wide database engine, creating it on first use.
+
+    The engine and its connection pool are reused across pipeline runs instead of being
+    rebuilt by every run.
     """
-    return create_engine(f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+    global _db_engine
+    with _db_engine_lock:
+        if _db_engine is None:
+            _db_engine = create_db_engine()
+        return _db_engine
 
 def init_db(max_retries=5, retry_interval=5):
     """
     Initializes the database by retrying the connection a limited number of times.
     Returns the database engine if successful.
+
+    The connection is only probed until it succeeds once; later calls return the shared
+    engine straight away and rely on the pool's pre-ping to replace stale connections.
     """
-    db_engine = create_db_engine()
+    global _db_engine_verified
+    db_engine = get_db_engine()
+    if _db_engine_verified:
+        return db_engine
     attempt = 0
 
     while attempt < max_retries:
@@ -45,6 +126,7 @@ def init_db(max_retries=5, retry_interval=5):
             # Test the connection to ensure the database is reachable
             with db_engine.connect() as conn:
                 logging.info("Successfully connected to the database.")
+            _db_engine_verified = True
             return db_engine  # Return the engine, not the connection
         except OperationalError as e:
             attempt += 1
@@ -55,6 +137,30 @@ def init_db(max_retries=5, retry_interval=5):
                 logging.error("Max retry attempts reached. Could not establish connection.")
                 raise Exception("Failed to connect to the database after multiple retries.")
 
+def get_latest_dates(db_engine, table_name='raw_data', tickers=None):
+    """
+    Reads the latest stored date for every ticker in a single query.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        table_name (str): The name of the raw data table. Defaults to 'raw_data'.
+        tickers (list): Optional tickers to limit the query to.
+
+    Returns:
+        dict: Maps each stored ticker to the `datetime.date` of its latest row.
+            Empty if nothing is stored yet.
+    """
+    with db_engine.connect() as conn:
+        ensure_raw_table(conn, table_name)
+        conn.commit()
+        if tickers is None:
+            result = conn.execute(text(f"SELECT ticker, MAX(date)::DATE FROM {table_name} GROUP BY ticker"))
+        else:
+            result = conn.execute(text(f"""
+                SELECT ticker, MAX(date)::DATE FROM {table_name} WHERE ticker = ANY(:tickers) GROUP BY ticker
+            """), {'tickers': list(tickers)})
+        return {ticker: latest_date for ticker, latest_date in result}
+
 def insert_raw_data(db_engine, raw_df, table_name='raw_data'):
     """
     Insert raw data from a pandas DataFrame into the database table
@@ -69,49 +175,130 @@ def insert_raw_data(db_engine, raw_df, table_name='raw_data'):
     except Exception as e:
         logging.error(f"Error inserting raw data: {e}")
     
-def insert_raw_data_with_cdc(db_engine, raw_df, table_name='raw_data'):
+def copy_dataframe_to_table(conn, df, table_name, columns, float_format=None):
+    """
+    Bulk loads a DataFrame into an existing table with PostgreSQL `COPY FROM STDIN`.
+
+    The rows are serialized to CSV in chunks of COPY_CHUNK_ROWS and streamed through the
+    psycopg2 cursor of `conn`, so the load is part of the transaction open on `conn`.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the target transaction.
+        df (pd.DataFrame): The data to load. Must contain every column in `columns`.
+        table_name (str): The name of the target table.
+        columns (list): The columns to load, in table order.
+        float_format (str): Optional format of the float columns, e.g. '%.4f'. Defaults to the shortest
+            representation that round-trips the dtype of each column.
+    """
+    copy_sql = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    cursor = conn.connection.cursor()
+    try:
+        for start in range(0, len(df), COPY_CHUNK_ROWS):
+            buffer = io.StringIO()
+            df[columns].iloc[start:start + COPY_CHUNK_ROWS].to_csv(buffer, index=False, header=False, float_format=float_format)
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+    finally:
+        cursor.close()
+
+def insert_quarantine_rows(db_engine, rejected_df, table_name='quarantine_raw_data'):
+    """
+    Appends rows rejected by validation to the quarantine table.
+
+    The table keeps the raw values as fetched (volume as DOUBLE PRECISION so that missing
+    values fit) together with the failure reasons, for inspection and replay.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        rejected_df (pd.DataFrame): Rejected rows with a 'reasons' column, as returned by `split_valid_rows`.
+        table_name (str): The name of the quarantine table. Defaults to 'quarantine_raw_data'.
+    """
+    if rejected_df.empty:
+        return
+
+    quarantine_df = rejected_df.rename(columns=str.lower)
+    try:
+        with db_engine.connect() as conn:
+            ensure_quarantine_table(conn, table_name)
+            copy_dataframe_to_table(conn, quarantine_df, table_name, RAW_DATA_COLUMNS + ['reasons'])
+            conn.commit()
+            logging.warning(f"{len(quarantine_df)} rejected rows written to quarantine table '{table_name}'.")
+    except Exception as e:
+        reset_schema_cache(table_name)
+        logging.error(f"Error writing rows to quarantine table '{table_name}': {e}")
+
+def insert_raw_data_with_cdc(db_engine, raw_df, table_name='raw_data', load_method=STAGING_LOAD_METHOD, run_id=None,
+                             log_changes=True):
     """
     Insert raw data into a temporary staging table and merge it into the main table.
 
     db_engine: SQLAlchemy engine object
     raw_df: Pandas DataFrame containing raw stock data
     table_name: Name of the main database table
+    load_method: 'copy' streams the rows into a TEMP staging table with `COPY FROM STDIN`,
+        'to_sql' writes a regular staging table with `DataFrame.to_sql`
+    run_id: Id of the run the changes are logged under. Defaults to the id of the current run.
+    log_changes: Whether to log the changed keys. A bulk load that rebuilds the aggregates in full
+        afterwards (see `src.backfill`) skips the log, which would otherwise hold every loaded row.
+
+    The keys inserted or actually updated by the merge are appended to the change log table
+    `<table_name>_changes` in the same transaction (see `read_change_set`).
+
+    Returns the change set of the merge, a dict of the first changed date per changed ticker
+    (empty if no row changed), or None if the load failed.
     """
+    if load_method not in VALID_LOAD_METHODS:
+        logging.error(f"Invalid STAGING_LOAD_METHOD: {load_method}. Must be one of {VALID_LOAD_METHODS}.")
+        raise ValueError(f"Invalid STAGING_LOAD_METHOD: {load_method}. Must be one of {VALID_LOAD_METHODS}.")
+
     staging_table_name = f"staging_{table_name}"
+    change_table_name = f"{table_name}_changes"
+    run_id = run_id or get_run_metrics().run_id
 
     try:
         with db_engine.connect() as conn:
-            # Step 1: Check if the main table exists
-            inspector = inspect(db_engine)
-            if table_name not in inspector.get_table_names():
-                logging.info(f"Table '{table_name}' does not exist. Creating it...")
-                raw_df.columns = raw_df.columns.str.lower() 
-                raw_df.to_sql(table_name, conn, if_exists='replace', index=False)  # Create the table schema
-                logging.info(f"Table '{table_name}' created successfully.")
-                # Create the unique constraint / primary key to allow for CDC
-                pk_query = (f"""
-                ALTER TABLE {table_name}
-                ADD CONSTRAINT unique_date_ticker UNIQUE (date, ticker);
-                """)
-                conn.execute(text(pk_query))
-                conn.commit()
-                logging.info(f"Unique constraint added to main table: {table_name}")
+            # Step 1: Make sure the main table, the partitions of the loaded years and the change log
+            # exist (only checked once per process). Committed apart so that the partitions are only
+            # locked briefly.
+            raw_df = raw_df.rename(columns=str.lower) # Ensure column names are lowercase (without changing the caller's frame)
+            ensure_raw_table(conn, table_name)
+            ensure_year_partitions(conn, table_name, pd.to_datetime(raw_df['date']).dt.year.dropna().unique())
+            if log_changes:
+                ensure_change_log(conn, change_table_name)
+            conn.commit()
+
+            # Step 2: Create the staging table
+            logging.info(f"Creating staging table: {staging_table_name}")
+            with stage('staging_load', rows_in=len(raw_df)) as record:
+                if load_method == 'copy':
+                    conn.execute(text(STAGING_TABLE_DDL.format(staging_table_name=staging_table_name)))
+                    copy_dataframe_to_table(conn, raw_df, staging_table_name, RAW_DATA_COLUMNS)
+                else:
+                    raw_df.to_sql(staging_table_name, conn, if_exists='replace', index=False)
+                record.rows_out = len(raw_df)
+            logging.info(f"Data inserted into staging table: {staging_table_name}")
+
 
+            # Step 3: Merge data from the staging table into the main table and log the changed keys (unless
+            # `log_changes` is off).
+            # Only inserted rows and rows whose values differ come out of RETURNING. The statement
+            # reads the main table as it was before the merge, so the returned keys found in it are
+            # the updated ones (xmax cannot be returned from a partitioned table).
+            logging.info(f"Merging data into main table: {table_name}")
+            if log_changes:
+                log_sql = f"""
+                INSERT INTO {change_table_name} (run_id, ticker, date, operation)
+                SELECT :run_id, ticker, date, operation FROM changed
+                RETURNING ticker, date, operation
+                """
             else:
-                # Step 2: As main _table already exists, create the staging table
-                logging.info(f"Creating staging table: {staging_table_name}")
-                raw_df.columns = raw_df.columns.str.lower() # Ensure column names are lowercase
-                raw_df.to_sql(staging_table_name, conn, if_exists='replace', index=False)
-                logging.info(f"Data inserted into staging table: {staging_table_name}")
-                
-
-                # Step 3: Merge data from the staging table into the main table
-                logging.info(f"Merging data into main table: {table_name}")
-                merge_query = text(f"""
+                log_sql = "SELECT ticker, date, operation FROM changed"
+            merge_query = text(f"""
+            WITH merged AS (
                 INSERT INTO {table_name} (date, ticker, open, high, low, close, volume, curr_timestamp)
                 SELECT date, ticker, open, high, low, close, volume, curr_timestamp
                 FROM {staging_table_name}
-                ON CONFLICT (date, ticker) DO UPDATE
+                ON CONFLICT (ticker, date) DO UPDATE
                 SET
                     open = EXCLUDED.open,
                     high = EXCLUDED.high,
@@ -124,85 +311,521 @@ def insert_raw_data_with_cdc(db_engine, raw_df, table_name='raw_data'):
                     {table_name}.high <> EXCLUDED.high OR
                     {table_name}.low <> EXCLUDED.low OR
                     {table_name}.close <> EXCLUDED.close OR
-                    {table_name}.volume <> EXCLUDED.volume;
-                """)
-                try:
-                    conn.execute(merge_query)
+                    {table_name}.volume <> EXCLUDED.volume
+                RETURNING ticker, date
+            ),
+            changed AS (
+                SELECT m.ticker, m.date, CASE WHEN r.ticker IS NULL THEN 'insert' ELSE 'update' END AS operation
+                FROM merged m
+                LEFT JOIN {table_name} r ON r.ticker = m.ticker AND r.date = m.date
+            ),
+            logged AS ({log_sql})
+            SELECT
+                ticker,
+                MIN(date) AS first_changed,
+                COUNT(*) FILTER (WHERE operation = 'insert') AS inserted,
+                COUNT(*) FILTER (WHERE operation = 'update') AS updated
+            FROM logged
+            GROUP BY ticker
+            """)
+            try:
+                with stage('merge', rows_in=len(raw_df)) as record:
+                    changes = conn.execute(merge_query, {'run_id': run_id} if log_changes else {}).all()
+                    if log_changes and CHANGE_LOG_RETENTION_DAYS > 0:
+                        conn.execute(text(f"DELETE FROM {change_table_name} WHERE changed_at < now() - make_interval(days => :days)"),
+                                     {'days': CHANGE_LOG_RETENTION_DAYS})
                     conn.commit()
-                    logging.info(f"Data merged into main table: {table_name}")
-                except Exception as e:
-                    logging.error(f"Error during merge operation: {e}")
-                    raise Exception("Merge operation failed. Exiting...") from e
+                    inserted = sum(row.inserted for row in changes)
+                    updated = sum(row.updated for row in changes)
+                    record.rows_out = inserted + updated  # Rows inserted or actually changed
+                increment('rows_changed', record.rows_out)
+                increment('rows_inserted', inserted)
+                increment('rows_updated', updated)
+                logging.info(f"Data merged into main table: {table_name} ({inserted} rows inserted, {updated} updated "
+                             f"in {len(changes)} tickers)")
+            except Exception as e:
+                logging.error(f"Error during merge operation: {e}")
+                raise Exception("Merge operation failed. Exiting...") from e
 
-                # Step 4: Drop the staging table
+            # Step 4: Drop the staging table (the TEMP table of the COPY path is dropped on commit)
+            if load_method != 'copy':
                 logging.info(f"Dropping staging table: {staging_table_name}")
                 conn.execute(text(f"DROP TABLE IF EXISTS {staging_table_name}"))
+                conn.commit()
                 logging.info(f"Staging table dropped: {staging_table_name}")
+            return {row.ticker: row.first_changed for row in changes}
 
     except Exception as e:
+        reset_schema_cache(table_name)  # The table or its partitions may not have been created if the transaction rolled back
         logging.error(f"Error during CDC operation: {e}")
+        mark_run_failed(f"CDC merge into '{table_name}' failed")
+        if load_method != 'copy':
+            drop_staging_table(db_engine, staging_table_name)
+        return None
+
+def read_change_set(db_engine, run_id, table_name='raw_data'):
+    """
+    Reads the change set logged by the merges of a run.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        run_id (str): The id of the run.
+        table_name (str): The name of the raw data table whose change log is read.
 
-def aggregate_stock_data(db_engine, table_name='agg_stock_data'):
+    Returns:
+        dict: The first changed date per changed ticker, as returned by `insert_raw_data_with_cdc`.
     """
-    Recalculates and recreates the aggregated stock data table with calculated metrics.
+    with db_engine.connect() as conn:
+        result = conn.execute(text(f"""
+            SELECT ticker, MIN(date) FROM {table_name}_changes WHERE run_id = :run_id GROUP BY ticker
+        """), {'run_id': run_id})
+        return {ticker: first_changed for ticker, first_changed in result}
 
-    This function drops the existing `agg_stock_data` table (if it exists) and recreates it
-    with recalculated metrics for all rows in the `raw_data` table.
+def drop_staging_table(db_engine, staging_table_name):
+    """
+    Drops a regular staging table left by a failed `to_sql` load.
+
+    The TEMP staging table of the COPY path needs no cleanup: it is dropped when its transaction ends.
+    """
+    try:
+        with db_engine.connect() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {staging_table_name}"))
+            conn.commit()
+    except Exception as e:
+        logging.error(f"Could not drop staging table '{staging_table_name}': {e}")
+
+def drop_secondary_indexes(conn, table_name):
+    """
+    Drops the non-unique indexes of a table that do not back a constraint, to speed up bulk loads.
+
+    Primary key, unique constraint and standalone unique indexes are kept: the merge relies on them
+    and dropping them would let duplicates in during the load.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the transaction.
+        table_name (str): The name of the table.
+
+    Returns:
+        list: The `CREATE INDEX` statements of the dropped indexes, for `recreate_indexes`.
+    """
+    indexes = conn.execute(text("""
+        SELECT i.indexname, i.indexdef
+        FROM pg_indexes i
+        WHERE i.schemaname = current_schema()
+          AND i.tablename = :table_name
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c
+              WHERE c.conindid = format('%I.%I', i.schemaname, i.indexname)::regclass
+          )
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_index x
+              WHERE x.indexrelid = format('%I.%I', i.schemaname, i.indexname)::regclass AND x.indisunique
+          )
+    """), {'table_name': table_name}).all()
+    for index_name, _ in indexes:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index_name}"'))
+    if indexes:
+        logging.info(f"Dropped {len(indexes)} indexes of '{table_name}': {', '.join(name for name, _ in indexes)}")
+    return [definition for _, definition in indexes]
+
+def recreate_indexes(conn, definitions):
+    """
+    Recreates indexes dropped by `drop_secondary_indexes`. Indexes that already exist are skipped.
+    """
+    for definition in definitions:
+        # pg_indexes shows the index of a partitioned table as `ON ONLY`, which would not cascade to its partitions
+        conn.execute(text(definition.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1)
+                          .replace("CREATE UNIQUE INDEX ", "CREATE UNIQUE INDEX IF NOT EXISTS ", 1)
+                          .replace(" ON ONLY ", " ON ", 1)))
+    if definitions:
+        logging.info(f"Recreated {len(definitions)} indexes.")
+
+AGG_METRIC_COLUMNS = METRIC_COLUMNS
+
+AGG_COLUMNS = ['curr_timestamp', 'date', 'ticker'] + AGG_METRIC_COLUMNS
+AGG_UPDATE_SQL = ", ".join(f"{col} = EXCLUDED.{col}" for col in ['curr_timestamp'] + AGG_METRIC_COLUMNS)
+
+# Rows preceding a changed row that feed its metrics: 9 earlier returns plus the close before them
+AGG_LOOKBACK_ROWS = 10
+
+
+def metrics_query(source, extra_columns=()):
+    """
+    Returns the window-function query computing the aggregated metrics of `source`.
+
+    The NUMERIC prices of the raw data are cast to DOUBLE PRECISION, the type of the metrics.
+
+    Args:
+        source (str): A table name or parenthesized subquery with the raw data columns.
+        extra_columns (tuple): Additional columns of `source` to pass through to the output.
+
+    Returns:
+        str: A SELECT statement producing the columns of the aggregated table.
+    """
+    return f"""
+        WITH with_returns AS (
+            SELECT
+                *,
+                (close::DOUBLE PRECISION - LAG(close::DOUBLE PRECISION) OVER (PARTITION BY ticker ORDER BY date))
+                    / LAG(close::DOUBLE PRECISION) OVER (PARTITION BY ticker ORDER BY date) AS daily_return,
+                (open::DOUBLE PRECISION + high::DOUBLE PRECISION + low::DOUBLE PRECISION + close::DOUBLE PRECISION) / 4 AS avg_daily_price
+            FROM {source} rd
+        ),
+        rolling_metrics AS (
+            SELECT *,
+                AVG(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS avg_return_7d,
+                AVG(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 9 PRECEDING AND CURRENT ROW) AS avg_return_10d,
+                STDDEV(avg_daily_price) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS price_volatility_7d,
+                STDDEV(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS return_volatility_7d,
+                STDDEV(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 9 PRECEDING AND CURRENT ROW) AS return_volatility_10d
+            FROM with_returns
+        )
+        SELECT
+            curr_timestamp,
+            date::DATE AS date,
+            ticker,{''.join(f" {col}," for col in extra_columns)}
+            avg_daily_price,
+            daily_return,
+            avg_return_7d,
+            avg_return_10d,
+            price_volatility_7d,
+            return_volatility_7d,
+            return_volatility_10d
+        FROM rolling_metrics
+    """
+
+def rebuild_agg_table(conn, table_name='agg_stock_data', source_table='raw_data', backend=AGGREGATION_BACKEND):
+    """
+    Recomputes the metrics of every row of `source_table` into the aggregated table.
+
+    The delete and the insert run in the caller's transaction, so readers keep seeing
+    the previous contents until it commits.
+
+    Returns:
+        int: The number of rows written.
+    """
+    conn.execute(text(f"DELETE FROM {table_name}"))
+    if backend == 'pandas':
+        metrics_df = compute_stock_metrics(pd.read_sql(text(f"SELECT * FROM {source_table}"), conn))
+        copy_dataframe_to_table(conn, metrics_df, table_name, AGG_COLUMNS)
+        rowcount = len(metrics_df)
+    else:
+        rowcount = conn.execute(text(f"INSERT INTO {table_name} {metrics_query(source_table)}")).rowcount
+    logging.info(f"Full rebuild of '{table_name}' wrote {rowcount} rows.")
+    return rowcount
+
+def changed_rows_query(table_name='agg_stock_data', source_table='raw_data', tickers=None, since_date=None, changes=None):
+    """
+    Returns a subquery selecting the raw rows whose metrics must be recomputed.
+
+    With a change set from `insert_raw_data_with_cdc`, the changed tickers and their first changed
+    dates are taken from it. Otherwise a raw row counts as changed when the aggregated table has no
+    row for it or holds a different `curr_timestamp` (the merge refreshes it whenever a row is
+    inserted or updated), which scans the raw rows selected by `tickers` and `since_date`.
+    For every changed ticker, the subquery yields its rows from AGG_LOOKBACK_ROWS rows before
+    the first changed date onwards, with that date in an extra `first_changed` column.
+
+    Args:
+        table_name (str): The name of the aggregated table.
+        source_table (str): The name of the raw data table.
+        tickers (list): Optional tickers to limit the change detection to.
+        since_date (datetime): Optional earliest raw date to limit the change detection to.
+        changes (dict): Optional first changed date per ticker. Replaces the change detection.
+
+    Returns:
+        tuple: The parenthesized subquery and its bind parameters.
+    """
+    params = {'lookback': AGG_LOOKBACK_ROWS}
+    if changes is not None:
+        params.update({'changed_tickers': list(changes), 'first_changed': list(changes.values())})
+        changed_sql = """
+            SELECT ticker, first_changed
+            FROM unnest(CAST(:changed_tickers AS TEXT[]), CAST(:first_changed AS DATE[])) AS c(ticker, first_changed)
+        """
+    else:
+        filters = []
+        if tickers is not None:
+            filters.append("r.ticker = ANY(:tickers)")
+            params['tickers'] = list(tickers)
+        if since_date is not None:
+            filters.append("r.date >= :since_date")
+            params['since_date'] = since_date
+        where_sql = " AND ".join(filters + ["(a.ticker IS NULL OR a.curr_timestamp IS DISTINCT FROM r.curr_timestamp)"])
+        changed_sql = f"""
+            SELECT r.ticker, MIN(r.date) AS first_changed
+            FROM {source_table} r
+            LEFT JOIN {table_name} a ON a.ticker = r.ticker AND a.date = r.date::DATE
+            WHERE {where_sql}
+            GROUP BY r.ticker
+        """
+
+    source = f"""(
+        WITH changed AS ({changed_sql}),
+        bounds AS (
+            SELECT
+                c.ticker,
+                c.first_changed,
+                COALESCE((
+                    SELECT MIN(p.date)
+                    FROM (
+                        SELECT date FROM {source_table}
+                        WHERE ticker = c.ticker AND date < c.first_changed
+                        ORDER BY date DESC
+                        LIMIT :lookback
+                    ) p
+                ), c.first_changed) AS window_start
+            FROM changed c
+        )
+        SELECT r.*, b.first_changed
+        FROM {source_table} r
+        JOIN bounds b ON b.ticker = r.ticker AND r.date >= b.window_start
+    )"""
+    return source, params
+
+def upsert_agg_rows(conn, metrics_df, table_name='agg_stock_data'):
+    """
+    Upserts computed metrics into the aggregated table through a TEMP staging table.
+
+    Returns:
+        int: The number of upserted rows.
+    """
+    staging_table_name = f"staging_{table_name}"
+    conn.execute(text(f"CREATE TEMP TABLE {staging_table_name} (LIKE {table_name}) ON COMMIT DROP"))
+    copy_dataframe_to_table(conn, metrics_df, staging_table_name, AGG_COLUMNS)
+    return conn.execute(text(f"""
+        INSERT INTO {table_name} ({', '.join(AGG_COLUMNS)})
+        SELECT {', '.join(AGG_COLUMNS)} FROM {staging_table_name}
+        ON CONFLICT (ticker, date) DO UPDATE
+        SET
+            {AGG_UPDATE_SQL}
+    """)).rowcount
+
+def refresh_agg_table(conn, table_name='agg_stock_data', source_table='raw_data', tickers=None, since_date=None,
+                      backend=AGGREGATION_BACKEND, changes=None):
+    """
+    Recomputes the metrics of the raw rows that changed since they were last aggregated.
+
+    The rows selected by `changed_rows_query` are recomputed and the ones from each ticker's
+    first changed date onwards are upserted.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the transaction.
+        table_name (str): The name of the aggregated table.
+        source_table (str): The name of the raw data table.
+        tickers (list): Optional tickers to limit the change detection to.
+        since_date (datetime): Optional earliest raw date to limit the change detection to.
+        backend (str): 'sql' computes the metrics in PostgreSQL, 'pandas' in process.
+        changes (dict): Optional change set of the merges to recompute, see `changed_rows_query`.
+
+    Returns:
+        int: The number of rows upserted.
+    """
+    source, params = changed_rows_query(table_name, source_table, tickers, since_date, changes)
+
+    if backend == 'pandas':
+        changed_df = pd.read_sql(text(f"SELECT * FROM {source} s"), conn, params=params)
+        metrics_df = compute_stock_metrics(changed_df)
+        first_changed = pd.to_datetime(metrics_df['ticker'].map(changed_df.groupby('ticker')['first_changed'].min()))
+        rowcount = upsert_agg_rows(conn, metrics_df[metrics_df['date'] >= first_changed.dt.normalize()], table_name)
+    else:
+        rowcount = conn.execute(text(f"""
+            WITH metrics AS ({metrics_query(source, extra_columns=('first_changed',))})
+            INSERT INTO {table_name} ({', '.join(AGG_COLUMNS)})
+            SELECT {', '.join(AGG_COLUMNS)}
+            FROM metrics
+            WHERE date >= first_changed::DATE
+            ON CONFLICT (ticker, date) DO UPDATE
+            SET
+                {AGG_UPDATE_SQL}
+        """), params).rowcount
+    logging.info(f"Incremental refresh of '{table_name}' upserted {rowcount} rows.")
+    return rowcount
+
+def log_agg_refresh(conn, table_name, tickers):
+    """
+    Records a refresh of the aggregated table in its refresh log, in the caller's transaction.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the transaction of the refresh.
+        table_name (str): The name of the refresh log table.
+        tickers (list): The refreshed tickers, or None if any ticker may have changed.
+    """
+    conn.execute(text(f"INSERT INTO {table_name} (run_id, tickers) VALUES (:run_id, :tickers)"),
+                 {'run_id': get_run_metrics().run_id, 'tickers': None if tickers is None else list(tickers)})
+    if CHANGE_LOG_RETENTION_DAYS > 0:
+        conn.execute(text(f"DELETE FROM {table_name} WHERE refreshed_at < now() - make_interval(days => :days)"),
+                     {'days': CHANGE_LOG_RETENTION_DAYS})
+
+def read_pending_aggregation(conn, table_name):
+    """
+    Reads the change sets of the failed aggregations recorded by `record_failed_aggregation`.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection to read with.
+        table_name (str): The name of the pending aggregation table.
+
+    Returns:
+        dict: The first changed date per ticker still to aggregate.
+    """
+    result = conn.execute(text(f"SELECT ticker, first_changed FROM {table_name}"))
+    return {ticker: first_changed for ticker, first_changed in result}
+
+def record_failed_aggregation(db_engine, table_name, changes):
+    """
+    Records the change set of a failed refresh of a derived table, so that the next refresh recomputes it.
+
+    The change set is upserted into `<table_name>_pending`, keeping the earliest changed date of
+    each ticker. Without a change set, or if it cannot be written, the next refresh of the table in
+    this process recomputes every changed row instead (see `pending_changes`).
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        table_name (str): The name of the derived table, e.g. 'agg_stock_data' or 'stock_metrics'.
+        changes (dict): The first changed date per ticker of the failed refresh, or None.
+    """
+    if changes is not None:
+        pending_table_name = f"{table_name}_pending"
+        try:
+            with db_engine.connect() as conn:
+                ensure_pending_aggregation(conn, pending_table_name)
+                conn.execute(text(f"""
+                    INSERT INTO {pending_table_name} (ticker, first_changed)
+                    SELECT * FROM unnest(CAST(:changed_tickers AS TEXT[]), CAST(:first_changed AS DATE[]))
+                    ON CONFLICT (ticker) DO UPDATE SET first_changed = LEAST({pending_table_name}.first_changed, EXCLUDED.first_changed)
+                """), {'changed_tickers': list(changes), 'first_changed': list(changes.values())})
+                conn.commit()
+            logging.info(f"Recorded {len(changes)} tickers in '{pending_table_name}' for the next refresh.")
+            return
+        except Exception as e:
+            reset_schema_cache(pending_table_name)
+            logging.error(f"Could not record the failed refresh in '{pending_table_name}': {e}")
+    _unrecorded_failures.add(table_name)
+
+def pending_changes(table_name, changes, pending):
+    """
+    Adds the change sets of the failed refreshes of a derived table to the change set of the next one.
+
+    Args:
+        table_name (str): The name of the derived table.
+        changes (dict): The first changed date per ticker of the refresh, or None if unknown.
+        pending (dict): The failed change sets, as returned by `read_pending_aggregation`.
+
+    Returns:
+        dict: The first changed date per ticker to recompute, or None if every changed row must be
+            recomputed because a failed change set could not be recorded.
+    """
+    if table_name in _unrecorded_failures:
+        return None
+    if changes is None or not pending:
+        return changes
+    logging.info(f"Adding {len(pending)} tickers of failed refreshes of '{table_name}' to the refresh.")
+    return {ticker: min(first_changed, changes.get(ticker, first_changed))
+            for ticker, first_changed in {**changes, **pending}.items()}
+
+def clear_pending_aggregation(conn, table_name, changes, covers_all):
+    """
+    Forgets the failed change sets recomputed by a refresh of a derived table, in the caller's transaction.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the transaction of the refresh.
+        table_name (str): The name of the derived table.
+        changes (dict): The first changed date per ticker recomputed by the refresh.
+        covers_all (bool): Whether the refresh recomputed every changed row (a full rebuild).
+    """
+    pending_table_name = f"{table_name}_pending"
+    if covers_all:
+        conn.execute(text(f"DELETE FROM {pending_table_name}"))
+        # If the refresh fails to commit after all, its failure is recorded again
+        _unrecorded_failures.discard(table_name)
+    elif changes:
+        # A failure recorded meanwhile with an earlier date is kept for the next refresh
+        conn.execute(text(f"""
+            DELETE FROM {pending_table_name} p
+            USING unnest(CAST(:changed_tickers AS TEXT[]), CAST(:first_changed AS DATE[])) AS c(ticker, first_changed)
+            WHERE p.ticker = c.ticker AND p.first_changed >= c.first_changed
+        """), {'changed_tickers': list(changes), 'first_changed': list(changes.values())})
+
+def aggregate_stock_data(db_engine, table_name='agg_stock_data', mode=AGGREGATION_MODE, tickers=None, since_date=None,
+                         backend=AGGREGATION_BACKEND, changes=None):
+    """
+    Brings the aggregated stock data table up to date with calculated metrics.
+
+    In 'incremental' mode only the rows of `raw_data` that changed since the last aggregation
+    (plus the lookback rows their 7d/10d windows need) are recomputed and upserted into the
+    keyed `agg_stock_data` table. In 'full' mode every row is recomputed. Both run in a single
+    transaction, so readers always see a complete table.
+
+    Given the change set of the merges (see `insert_raw_data_with_cdc`), the incremental mode
+    recomputes exactly the changed tickers from their first changed date, and an empty change
+    set skips the aggregation altogether.
+
+    Every committed aggregation is recorded in `<table_name>_refreshes` with the tickers it
+    refreshed, for the readers caching the metrics (see `src.service.metrics_service`).
+
+    A failed aggregation leaves its rows stale, so its change set is recorded in `<table_name>_pending`
+    (see `record_failed_aggregation`) and added to the change set of the next aggregation, which
+    clears it once committed.
 
     Args:
         db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
-        table_name (str): The name of the table to be created in the database. Defaults to 'agg_stock_data'.
+        table_name (str): The name of the aggregated table. Defaults to 'agg_stock_data'.
+        mode (str): 'incremental' or 'full'. Defaults to AGGREGATION_MODE.
+        tickers (list): Optional tickers to limit the incremental change detection to.
+        since_date (datetime): Optional earliest raw date to limit the incremental change detection to.
+        backend (str): 'sql' computes the metrics with window functions in PostgreSQL, 'pandas' with the
+            vectorized in-process engine of `src.aggregation.metrics_engine`. Defaults to AGGREGATION_BACKEND.
+        changes (dict): Optional first changed date per ticker, as returned by `insert_raw_data_with_cdc`
+            or `read_change_set`. Replaces the change detection of the incremental mode.
+
+    Returns:
+        bool: True if the table was brought up to date, False if the aggregation failed.
     """
+    refresh_table_name = f"{table_name}_refreshes"
+    pending_table_name = f"{table_name}_pending"
+    created = False
     try:
         with db_engine.connect() as conn:
-            # Drop the existing table if it exists
-            logging.info(f"Checking if table '{table_name}' exists...")
-            inspector = inspect(db_engine)
-            if table_name in inspector.get_table_names():
-                logging.info(f"Table '{table_name}' exists. Dropping it...")
-                conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
-                logging.info(f"Table '{table_name}' has been dropped.")
-
-            # Recreate the table with recalculated metrics
-            logging.info(f"Recreating table '{table_name}' with recalculated metrics...")
-            agg_query_str = f"""
-                CREATE TABLE {table_name} AS
-                WITH with_returns AS (
-                    SELECT
-                        *,
-                        (close - LAG(close) OVER (PARTITION BY ticker ORDER BY date)) / LAG(close) OVER (PARTITION BY ticker ORDER BY date) AS daily_return,
-                        (open + high + low + close) / 4 AS avg_daily_price
-                    FROM raw_data rd
-                ),
-                rolling_metrics AS (
-                    SELECT *,
-                        AVG(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS avg_return_7d,
-                        AVG(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 9 PRECEDING AND CURRENT ROW) AS avg_return_10d,
-                        STDDEV(avg_daily_price) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS price_volatility_7d,
-                        STDDEV(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS return_volatility_7d,
-                        STDDEV(daily_return) OVER (PARTITION BY ticker ORDER BY date ROWS BETWEEN 9 PRECEDING AND CURRENT ROW) AS return_volatility_10d
-                    FROM with_returns
-                )
-                SELECT
-                    curr_timestamp,
-                    date::DATE AS date,
-                    ticker,
-                    avg_daily_price,
-                    daily_return,
-                    avg_return_7d,
-                    avg_return_10d,
-                    price_volatility_7d,
-                    return_volatility_7d,
-                    return_volatility_10d
-                FROM rolling_metrics
-                ORDER BY ticker, date DESC;
-            """
-            conn.execute(text(agg_query_str))
+            # The aggregated table gets the yearly partitions of the raw data, in a short transaction of its
+            # own. An empty table (just migrated, or left empty by a failed rebuild) is rebuilt in full.
+            created = (ensure_agg_table(conn, table_name)
+                       or conn.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {table_name})")).scalar())
+            ensure_year_partitions(conn, table_name, partition_years(conn, 'raw_data'))
+            ensure_refresh_log(conn, refresh_table_name)
+            ensure_pending_aggregation(conn, pending_table_name)
+            pending = read_pending_aggregation(conn, pending_table_name)
+            conn.commit()
+
+        # Recompute the rows left stale by the failed aggregations as well
+        changes = pending_changes(table_name, changes, pending)
+        detects_all = changes is None and tickers is None and since_date is None
+
+        if changes is not None and not changes and mode != 'full' and not created:
+            logging.info(f"No raw rows changed. Table '{table_name}' is already up to date.")
+            return True
+
+        with db_engine.connect() as conn, stage('aggregate') as record:
+            if mode == 'full' or created:
+                logging.info(f"Rebuilding table '{table_name}' with recalculated metrics...")
+                record.rows_out = rebuild_agg_table(conn, table_name, backend=backend)
+                refreshed_tickers = None
+            else:
+                logging.info(f"Refreshing table '{table_name}' incrementally...")
+                record.rows_out = refresh_agg_table(conn, table_name, tickers=tickers, since_date=since_date, backend=backend,
+                                                    changes=changes)
+                refreshed_tickers = list(changes) if changes is not None else tickers
+
+            log_agg_refresh(conn, refresh_table_name, refreshed_tickers)
+            clear_pending_aggregation(conn, table_name, changes, covers_all=mode == 'full' or created or detects_all)
             conn.commit()
-            logging.info(f"Table '{table_name}' has been recreated successfully with recalculated metrics.")
+            logging.info(f"Table '{table_name}' is up to date with recalculated metrics.")
+            return True
 
     except Exception as e:
+        reset_schema_cache(table_name)
         logging.error(f"Error during aggregation: {e}")
+        mark_run_failed(f"Aggregation of '{table_name}' failed")
+        record_failed_aggregation(db_engine, table_name, None if mode == 'full' or created else changes)
+        return False
 
 
 if __name__ == "__main__":
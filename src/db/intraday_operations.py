@@ -0,0 +1,217 @@
+from sqlalchemy import text
+from src.db.schema import ensure_intraday_tables, ensure_month_partitions, reset_schema_cache
+from src.db.db_operations import copy_dataframe_to_table
+from src.fetch_planner import MARKET_TIMEZONE
+from src.monitoring.instrumentation import stage, increment, mark_run_failed
+import pandas as pd
+import numpy as np
+import logging
+
+INTRADAY_TABLE = 'intraday_bars'
+ROLLUP_TABLE = 'intraday_rollups'
+
+# Columns of the compact intraday frames, in load order (see `src.ingestion_intraday`)
+INTRADAY_STAGING_COLUMNS = ['ts', 'ticker', 'open', 'high', 'low', 'close', 'volume']
+
+# The API quotes prices with 4 decimals. Writing exactly 4 loads the same price whether the batch holds it
+# as float32 or upcast to float64 (see `compact_prices`), so an unchanged bar never compares as changed.
+INTRADAY_PRICE_FORMAT = '%.4f'
+
+# Staging table of the intraday merge. Timestamps are loaded as epoch seconds and converted by the merge.
+INTRADAY_STAGING_DDL = """
+CREATE TEMP TABLE {staging_table_name} (
+    ts BIGINT,
+    ticker TEXT,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    volume BIGINT
+) ON COMMIT DROP
+"""
+
+# Rollup buckets, from the finest to the coarsest: (name, expression truncating the timestamp `{ts}` to
+# the start of its bucket, finer bucket it is computed from). Daily buckets follow the market time zone.
+ROLLUP_BUCKETS = [
+    ('5m', "date_bin('5 minutes', {ts}, TIMESTAMPTZ '2000-01-01 00:00:00+00')", None),
+    ('1h', "date_trunc('hour', {ts})", '5m'),
+    ('1d', f"date_trunc('day', {{ts}}, '{MARKET_TIMEZONE.key}')", '1h'),
+]
+
+
+def bar_months(df):
+    """
+    Returns the (year, month) pairs of the UTC timestamps of intraday bars, i.e. the partitions they go to.
+    """
+    months = np.unique(df['ts'].to_numpy().astype('datetime64[s]').astype('datetime64[M]').astype(np.int64))
+    return [(1970 + month // 12, month % 12 + 1) for month in months]
+
+def refresh_intraday_rollups(conn, changes, table_name=INTRADAY_TABLE, rollup_table_name=ROLLUP_TABLE):
+    """
+    Recomputes the rollup buckets touched by a merge of intraday bars, in the caller's transaction.
+
+    For every changed ticker, the buckets from the one holding its first changed bar onwards are
+    recomputed: the 5m buckets from the bars, then the 1h buckets from the 5m ones and the 1d
+    buckets from the 1h ones, so only the new bars are scanned and the coarser levels read a few
+    rows per bucket.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the transaction of the merge.
+        changes (dict): The first changed bar timestamp per ticker, as returned by the merge.
+        table_name (str): The name of the intraday bar table.
+        rollup_table_name (str): The name of the rollup table.
+
+    Returns:
+        int: The number of buckets written.
+    """
+    params = {'changed_tickers': list(changes), 'first_changed': list(changes.values())}
+    rowcount = 0
+    for bucket, bucket_sql, source_bucket in ROLLUP_BUCKETS:
+        if source_bucket is None:
+            source_sql = f"SELECT ticker, ts, open, high, low, close, volume, 1 AS bar_count FROM {table_name}"
+        else:
+            source_sql = f"""
+                SELECT ticker, bucket_start AS ts, open, high, low, close, volume, bar_count
+                FROM {rollup_table_name}
+                WHERE bucket = '{source_bucket}'
+            """
+        rowcount += conn.execute(text(f"""
+            WITH changed AS (
+                SELECT ticker, {bucket_sql.format(ts='first_changed')} AS since
+                FROM unnest(CAST(:changed_tickers AS TEXT[]), CAST(:first_changed AS TIMESTAMPTZ[])) AS c(ticker, first_changed)
+            ),
+            buckets AS (
+                SELECT
+                    s.ticker,
+                    {bucket_sql.format(ts='s.ts')} AS bucket_start,
+                    (ARRAY_AGG(s.open ORDER BY s.ts))[1] AS open,
+                    MAX(s.high) AS high,
+                    MIN(s.low) AS low,
+                    (ARRAY_AGG(s.close ORDER BY s.ts DESC))[1] AS close,
+                    SUM(s.volume) AS volume,
+                    SUM(s.bar_count) AS bar_count
+                FROM ({source_sql}) s
+                JOIN changed c ON s.ticker = c.ticker AND s.ts >= c.since
+                GROUP BY 1, 2
+            )
+            INSERT INTO {rollup_table_name} (bucket, ticker, bucket_start, open, high, low, close, volume, bar_count)
+            SELECT '{bucket}', ticker, bucket_start, open, high, low, close, volume, bar_count
+            FROM buckets
+            ON CONFLICT (ticker, bucket, bucket_start) DO UPDATE
+            SET
+                open = EXCLUDED.open,
+                high = EXCLUDED.high,
+                low = EXCLUDED.low,
+                close = EXCLUDED.close,
+                volume = EXCLUDED.volume,
+                bar_count = EXCLUDED.bar_count,
+                updated_at = now()
+        """), params).rowcount
+    return rowcount
+
+def merge_intraday_bars(db_engine, bars_df, table_name=INTRADAY_TABLE, rollup_table_name=ROLLUP_TABLE):
+    """
+    Merges intraday bars into the partitioned bar table and updates their rollups.
+
+    The bars are streamed into a TEMP staging table with COPY and upserted on (ticker, ts); only
+    new bars and bars whose values changed are written. The rollups of the changed bars are
+    refreshed in the same transaction, so they always match the bars.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        bars_df (pd.DataFrame): Bars in the compact format of `src.ingestion_intraday`.
+        table_name (str): The name of the intraday bar table.
+        rollup_table_name (str): The name of the rollup table.
+
+    Returns:
+        dict: The first changed bar timestamp per changed ticker (empty if no bar changed), or None
+            if the merge failed.
+    """
+    staging_table_name = f"staging_{table_name}"
+    try:
+        with db_engine.connect() as conn:
+            # The monthly partitions are created in a short transaction of their own
+            ensure_intraday_tables(conn, table_name, rollup_table_name)
+            ensure_month_partitions(conn, table_name, bar_months(bars_df))
+            conn.commit()
+
+            with stage('staging_load', rows_in=len(bars_df)) as record:
+                conn.execute(text(INTRADAY_STAGING_DDL.format(staging_table_name=staging_table_name)))
+                copy_dataframe_to_table(conn, bars_df, staging_table_name, INTRADAY_STAGING_COLUMNS,
+                                        float_format=INTRADAY_PRICE_FORMAT)
+                record.rows_out = len(bars_df)
+
+            with stage('merge', rows_in=len(bars_df)) as record:
+                changes = conn.execute(text(f"""
+                    WITH merged AS (
+                        INSERT INTO {table_name} (ts, ticker, open, high, low, close, volume, curr_timestamp)
+                        SELECT DISTINCT ON (ticker, ts) to_timestamp(ts), ticker, open, high, low, close, volume, LOCALTIMESTAMP
+                        FROM {staging_table_name}
+                        ORDER BY ticker, ts
+                        ON CONFLICT (ticker, ts) DO UPDATE
+                        SET
+                            open = EXCLUDED.open,
+                            high = EXCLUDED.high,
+                            low = EXCLUDED.low,
+                            close = EXCLUDED.close,
+                            volume = EXCLUDED.volume,
+                            curr_timestamp = EXCLUDED.curr_timestamp
+                        WHERE
+                            {table_name}.open <> EXCLUDED.open OR
+                            {table_name}.high <> EXCLUDED.high OR
+                            {table_name}.low <> EXCLUDED.low OR
+                            {table_name}.close <> EXCLUDED.close OR
+                            {table_name}.volume <> EXCLUDED.volume
+                        RETURNING ticker, ts
+                    )
+                    SELECT ticker, MIN(ts) AS first_changed, COUNT(*) AS changed
+                    FROM merged
+                    GROUP BY ticker
+                """)).all()
+                record.rows_out = sum(row.changed for row in changes)
+            increment('rows_changed', record.rows_out)
+
+            changes = {row.ticker: row.first_changed for row in changes}
+            if changes:
+                with stage('rollup') as record:
+                    record.rows_out = refresh_intraday_rollups(conn, changes, table_name, rollup_table_name)
+            conn.commit()
+            logging.info(f"Intraday bars merged into '{table_name}': {len(changes)} tickers changed, "
+                         f"rollups of '{rollup_table_name}' updated.")
+            return changes
+
+    except Exception as e:
+        reset_schema_cache(table_name)  # The partitions may not have been created if the transaction rolled back
+        logging.error(f"Error during the intraday merge: {e}")
+        mark_run_failed(f"Intraday merge into '{table_name}' failed")
+        return None
+
+def read_intraday_rollups(db_engine, bucket='1d', tickers=None, since=None, rollup_table_name=ROLLUP_TABLE):
+    """
+    Reads rollup buckets, e.g. the daily bars of the intraday data, without scanning the bars.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        bucket (str): '5m', '1h' or '1d'. Defaults to '1d'.
+        tickers (list): Optional tickers to read. Defaults to every ticker.
+        since (datetime): Optional earliest bucket start to read.
+        rollup_table_name (str): The name of the rollup table.
+
+    Returns:
+        pd.DataFrame: Columns ticker, bucket_start, open, high, low, close, volume and bar_count,
+            sorted by ticker and bucket start.
+    """
+    filters, params = ["bucket = :bucket"], {'bucket': bucket}
+    if tickers is not None:
+        filters.append("ticker = ANY(:tickers)")
+        params['tickers'] = list(tickers)
+    if since is not None:
+        filters.append("bucket_start >= :since")
+        params['since'] = since
+    with db_engine.connect() as conn:
+        return pd.read_sql(text(f"""
+            SELECT ticker, bucket_start, open, high, low, close, volume, bar_count
+            FROM {rollup_table_name}
+            WHERE {' AND '.join(filters)}
+            ORDER BY ticker, bucket_start
+        """), conn, params=params)
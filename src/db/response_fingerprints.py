@@ -0,0 +1,137 @@
+from sqlalchemy import text
+from dotenv import load_dotenv
+from src.db.schema import ensure_fingerprint_table
+from src.db.db_operations import init_db
+from src.monitoring.instrumentation import increment
+import threading
+import os
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Drop API responses identical to the last one loaded for their ticker
+RESPONSE_FINGERPRINTS = os.getenv("RESPONSE_FINGERPRINTS", "true").lower() == "true"
+
+FINGERPRINT_TABLE = 'response_fingerprints'
+
+
+class ResponseFingerprints:
+    """
+    The response fingerprints of a run: the ones of the last loaded responses, and the new ones
+    seen by the run that are saved once their data is loaded.
+
+    Fetches check their response from the worker threads, so the lookups are thread-safe. Every
+    lookup counts as a hit or a miss of the 'response_cache' in the run metrics.
+    """
+
+    def __init__(self, known=None):
+        """
+        Args:
+            known (dict): (fingerprint, last bar date) of the last loaded response per ticker.
+        """
+        self.known = known or {}
+        self.pending = {}  # Ticker -> (fingerprint, last bar date) of changed responses not loaded yet
+        self.unchanged = set()  # Tickers whose response was dropped
+        self._lock = threading.Lock()
+
+    def is_unchanged(self, ticker, fingerprint, last_bar_date):
+        """
+        Checks a response against the last one loaded for its ticker, and remembers it if it changed.
+
+        Args:
+            ticker (str): The stock ticker symbol.
+            fingerprint (str): The fingerprint of the response, see `response_fingerprint`.
+            last_bar_date (str): The date of the latest bar of the response.
+
+        Returns:
+            bool: True if the response can be dropped.
+        """
+        with self._lock:
+            known = self.known.get(ticker)
+            if known is not None and known[0] == fingerprint:
+                self.unchanged.add(ticker)
+                increment('response_cache_hits')
+                return True
+            self.pending[ticker] = (fingerprint, last_bar_date)
+            increment('response_cache_misses')
+            return False
+
+    def last_bar_date(self, ticker):
+        """
+        Returns the latest bar date of the last loaded response of a ticker, or None if unknown.
+        """
+        known = self.known.get(ticker)
+        return known[1] if known else None
+
+    def take(self, tickers=None):
+        """
+        Removes and returns the pending fingerprints of `tickers` (all of them by default), to be
+        saved with `save_response_fingerprints` once their data is loaded.
+        """
+        with self._lock:
+            tickers = list(self.pending) if tickers is None else [ticker for ticker in tickers if ticker in self.pending]
+            return {ticker: self.pending.pop(ticker) for ticker in tickers}
+
+
+def load_response_fingerprints(db_engine, tickers, table_name=FINGERPRINT_TABLE):
+    """
+    Reads the fingerprints of the last loaded responses of `tickers`.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object, or None to create it.
+        tickers (list): The tickers about to be fetched.
+        table_name (str): The name of the fingerprint table.
+
+    Returns:
+        ResponseFingerprints: The fingerprints of the run, or None if RESPONSE_FINGERPRINTS is off or
+            they could not be read (every response is then loaded).
+    """
+    if not RESPONSE_FINGERPRINTS:
+        return None
+    try:
+        db_engine = db_engine or init_db()
+        with db_engine.connect() as conn:
+            ensure_fingerprint_table(conn, table_name)
+            conn.commit()
+            result = conn.execute(text(f"""
+                SELECT ticker, fingerprint, last_bar_date FROM {table_name} WHERE ticker = ANY(:tickers)
+            """), {'tickers': list(tickers)})
+            return ResponseFingerprints({ticker: (fingerprint, last_bar_date) for ticker, fingerprint, last_bar_date in result})
+    except Exception as e:
+        logging.warning(f"Could not read the response fingerprints: {e}. Every response is loaded.")
+        return None
+
+
+def save_response_fingerprints(db_engine, entries, table_name=FINGERPRINT_TABLE):
+    """
+    Records the fingerprints of responses whose data has been loaded successfully.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object, or None to create it.
+        entries (dict): (fingerprint, last bar date) per ticker, as returned by `ResponseFingerprints.take`.
+        table_name (str): The name of the fingerprint table.
+    """
+    if not entries:
+        return
+    try:
+        db_engine = db_engine or init_db()
+        with db_engine.connect() as conn:
+            ensure_fingerprint_table(conn, table_name)
+            conn.execute(text(f"""
+                INSERT INTO {table_name} (ticker, fingerprint, last_bar_date)
+                SELECT * FROM unnest(CAST(:tickers AS TEXT[]), CAST(:fingerprints AS TEXT[]), CAST(:dates AS DATE[]))
+                ON CONFLICT (ticker) DO UPDATE
+                SET
+                    fingerprint = EXCLUDED.fingerprint,
+                    last_bar_date = EXCLUDED.last_bar_date,
+                    updated_at = now()
+            """), {
+                'tickers': list(entries),
+                'fingerprints': [fingerprint for fingerprint, _ in entries.values()],
+                'dates': [last_bar_date for _, last_bar_date in entries.values()],
+            })
+            conn.commit()
+    except Exception as e:
+        # The responses are loaded again by the next run, which is safe
+        logging.warning(f"Could not save the response fingerprints: {e}")
@@ -0,0 +1,426 @@
+from sqlalchemy import text
+import threading
+import re
+import logging
+
+# The bar tables are partitioned by range of `date`, one partition per year (`<table>_y<year>`,
+# created on demand by `ensure_year_partitions`), plus a DEFAULT partition for any date no yearly
+# partition covers. The (ticker, date) primary key serves per-ticker range reads and is the
+# conflict target of the upserts; the BRIN index on date serves date range scans at almost no cost.
+
+# Main table of the fetched bars. Prices are exact decimals.
+RAW_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    date DATE NOT NULL,
+    ticker TEXT NOT NULL,
+    open NUMERIC(18, 6),
+    high NUMERIC(18, 6),
+    low NUMERIC(18, 6),
+    close NUMERIC(18, 6),
+    volume BIGINT,
+    curr_timestamp TIMESTAMP,
+    CONSTRAINT {table_name}_pkey PRIMARY KEY (ticker, date)
+) PARTITION BY RANGE (date);
+CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;
+CREATE INDEX IF NOT EXISTS {table_name}_date_brin ON {table_name} USING BRIN (date)
+"""
+
+AGG_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    curr_timestamp TIMESTAMP,
+    date DATE NOT NULL,
+    ticker TEXT NOT NULL,
+    avg_daily_price DOUBLE PRECISION,
+    daily_return DOUBLE PRECISION,
+    avg_return_7d DOUBLE PRECISION,
+    avg_return_10d DOUBLE PRECISION,
+    price_volatility_7d DOUBLE PRECISION,
+    return_volatility_7d DOUBLE PRECISION,
+    return_volatility_10d DOUBLE PRECISION,
+    CONSTRAINT {table_name}_pkey PRIMARY KEY (ticker, date)
+) PARTITION BY RANGE (date);
+CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;
+CREATE INDEX IF NOT EXISTS {table_name}_date_brin ON {table_name} USING BRIN (date)
+"""
+
+# Catalog metrics of the daily data (see METRIC_CATALOG in src/aggregation/metrics_engine.py), one row per
+# ticker, metric and date, so that a metric can be added to the catalog without changing the table.
+STOCK_METRICS_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    date DATE NOT NULL,
+    ticker TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    CONSTRAINT {table_name}_pkey PRIMARY KEY (ticker, metric, date)
+) PARTITION BY RANGE (date);
+CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;
+CREATE INDEX IF NOT EXISTS {table_name}_date_brin ON {table_name} USING BRIN (date)
+"""
+
+YEAR_PARTITION_DDL = """
+CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name}
+FOR VALUES FROM ('{year}-01-01') TO ('{next_year}-01-01')
+"""
+
+# Intraday bars (see src/db/intraday_operations.py) are 100-400 times more rows than the daily ones,
+# so they are partitioned by month of their UTC timestamp (`<table>_m<year><month>`).
+INTRADAY_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    ts TIMESTAMPTZ NOT NULL,
+    ticker TEXT NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    volume BIGINT,
+    curr_timestamp TIMESTAMP,
+    CONSTRAINT {table_name}_pkey PRIMARY KEY (ticker, ts)
+) PARTITION BY RANGE (ts);
+CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;
+CREATE INDEX IF NOT EXISTS {table_name}_ts_brin ON {table_name} USING BRIN (ts)
+"""
+
+MONTH_PARTITION_DDL = """
+CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name}
+FOR VALUES FROM ('{start}-01 00:00:00+00') TO ('{end}-01 00:00:00+00')
+"""
+
+# OHLCV of the intraday bars per bucket ('5m', '1h' and '1d'), maintained incrementally by every merge.
+INTRADAY_ROLLUP_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    bucket TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    volume BIGINT,
+    bar_count INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT {table_name}_pkey PRIMARY KEY (ticker, bucket, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS {table_name}_bucket_start_brin ON {table_name} USING BRIN (bucket_start)
+"""
+
+QUARANTINE_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    date TIMESTAMP,
+    ticker TEXT,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    volume DOUBLE PRECISION,
+    curr_timestamp TIMESTAMP,
+    reasons TEXT NOT NULL,
+    quarantined_at TIMESTAMP NOT NULL DEFAULT now()
+)
+"""
+
+# Keys inserted or updated by each CDC merge, tagged with the id of the run, so that the aggregation and
+# any other consumer only process what changed. Named after the raw data table (raw_data_changes).
+CHANGE_LOG_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    id BIGSERIAL PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    date DATE NOT NULL,
+    operation TEXT NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS {table_name}_run_id_idx ON {table_name} (run_id);
+CREATE INDEX IF NOT EXISTS {table_name}_changed_at_idx ON {table_name} USING BRIN (changed_at)
+"""
+
+# One row per committed aggregation, with the tickers it refreshed (NULL when every ticker may have
+# changed), so that readers caching the aggregated metrics know what to invalidate (see src/service).
+# Named after the aggregated table (agg_stock_data_refreshes).
+REFRESH_LOG_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    id BIGSERIAL PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    tickers TEXT[],
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+# First changed date of the tickers whose refresh of a derived table failed, so that the next refresh recomputes
+# them even if its own change set does not include them. Named after the derived table (agg_stock_data_pending,
+# stock_metrics_pending).
+PENDING_AGGREGATION_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    ticker TEXT PRIMARY KEY,
+    first_changed DATE NOT NULL
+)
+"""
+
+# Fingerprint of the last API response of each ticker that was loaded successfully, so that an
+# identical response can be dropped before it is parsed (see src/db/response_fingerprints.py).
+FINGERPRINT_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    ticker TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    last_bar_date DATE,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+# Ticker universe shared by the workers of the queue mode (see src/db/ticker_queue.py). A ticker is claimed
+# by one worker at a time for a lease, and becomes due again at `next_fetch_at`.
+TICKER_REGISTRY_DDL = """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    ticker TEXT PRIMARY KEY,
+    enabled BOOLEAN NOT NULL DEFAULT true,
+    next_fetch_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    claimed_by TEXT,
+    claimed_until TIMESTAMPTZ,
+    last_fetched_at TIMESTAMPTZ,
+    last_bar_date DATE,
+    last_status TEXT,
+    last_error TEXT,
+    failure_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS {table_name}_due_idx ON {table_name} (next_fetch_at) WHERE enabled
+"""
+
+# Tables known to exist, as (database URL, table name) pairs. Filled on first use so that
+# later runs in the same process skip both the DDL and the catalog lookups.
+_ensured_tables = set()
+_ensured_tables_lock = threading.Lock()
+
+
+def _cache_key(conn, table_name):
+    return (conn.engine.url.render_as_string(hide_password=True), table_name)
+
+
+def is_table_ensured(conn, table_name):
+    """
+    Returns True if the table was already ensured by this process.
+    """
+    with _ensured_tables_lock:
+        return _cache_key(conn, table_name) in _ensured_tables
+
+
+def mark_table_ensured(conn, table_name):
+    with _ensured_tables_lock:
+        _ensured_tables.add(_cache_key(conn, table_name))
+
+
+def reset_schema_cache(table_name=None):
+    """
+    Forgets which tables exist, e.g. after a table was dropped outside the pipeline.
+
+    Args:
+        table_name (str): The table to forget, with its yearly or monthly partitions. Defaults to every table.
+    """
+    with _ensured_tables_lock:
+        if table_name is None:
+            _ensured_tables.clear()
+        else:
+            partition_name = re.compile(rf"{re.escape(table_name)}_(y\d{{4}}|m\d{{6}})")
+            _ensured_tables.difference_update({key for key in _ensured_tables
+                                               if key[1] == table_name or partition_name.fullmatch(key[1])})
+
+
+def ensure_table(conn, table_name, ddl):
+    """
+    Runs the idempotent `CREATE TABLE IF NOT EXISTS` DDL of a table once per process.
+
+    The DDL runs in the caller's transaction and takes effect when it commits.
+    """
+    if is_table_ensured(conn, table_name):
+        return
+    conn.execute(text(ddl.format(table_name=table_name)))
+    mark_table_ensured(conn, table_name)
+
+
+def table_kind(conn, table_name):
+    """
+    Returns the kind of a table: 'p' if it is partitioned, 'r' for a plain table, None if it does not exist.
+    """
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table_name)"),
+                        {'table_name': table_name}).scalar()
+
+
+def ensure_year_partitions(conn, table_name, years):
+    """
+    Creates the yearly partitions of a partitioned table that do not exist yet.
+
+    Partitions are looked up once per process, and only missing ones are created: creating a
+    partition briefly locks the whole table, so it should run in a short transaction of its own.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the transaction.
+        table_name (str): The name of the partitioned table.
+        years (iterable): The years whose partitions must exist.
+    """
+    for year in sorted({int(year) for year in years}):
+        partition_name = f"{table_name}_y{year}"
+        if is_table_ensured(conn, partition_name):
+            continue
+        if table_kind(conn, partition_name) is None:
+            conn.execute(text(YEAR_PARTITION_DDL.format(partition_name=partition_name, table_name=table_name,
+                                                        year=year, next_year=year + 1)))
+            logging.info(f"Partition '{partition_name}' created.")
+        mark_table_ensured(conn, partition_name)
+
+
+def ensure_month_partitions(conn, table_name, months):
+    """
+    Creates the monthly partitions of a partitioned table that do not exist yet, see `ensure_year_partitions`.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): The connection holding the transaction.
+        table_name (str): The name of the partitioned table.
+        months (iterable): The (year, month) pairs whose partitions must exist.
+    """
+    for year, month in sorted({(int(year), int(month)) for year, month in months}):
+        partition_name = f"{table_name}_m{year}{month:02d}"
+        if is_table_ensured(conn, partition_name):
+            continue
+        if table_kind(conn, partition_name) is None:
+            next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            conn.execute(text(MONTH_PARTITION_DDL.format(partition_name=partition_name, table_name=table_name,
+                                                         start=f"{year}-{month:02d}", end=f"{next_year}-{next_month:02d}")))
+            logging.info(f"Partition '{partition_name}' created.")
+        mark_table_ensured(conn, partition_name)
+
+
+def partition_years(conn, table_name):
+    """
+    Returns the years of the yearly partitions of a table.
+    """
+    result = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table_name)
+    """), {'table_name': table_name})
+    partition_name = re.compile(rf"{re.escape(table_name)}_y(\d{{4}})")
+    return sorted(int(match.group(1)) for match in map(partition_name.fullmatch, result.scalars()) if match)
+
+
+def migrate_legacy_raw_table(conn, table_name='raw_data'):
+    """
+    Moves the rows of a raw data table created before the partitioned layout into a new partitioned table.
+
+    The legacy table is renamed to `<table>_legacy`, and its rows are copied with their dates cast
+    to DATE (keeping the latest fetched row if a day appears twice). The legacy table is kept so
+    that it can be checked before it is dropped by hand. Everything runs in the caller's transaction.
+    """
+    legacy_table_name = f"{table_name}_legacy"
+    logging.info(f"Table '{table_name}' is not partitioned. Migrating it (the old table is kept as '{legacy_table_name}')...")
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {legacy_table_name}"))
+    conn.execute(text(RAW_TABLE_DDL.format(table_name=table_name)))
+    years = conn.execute(text(f"""
+        SELECT DISTINCT date_part('year', date)::INTEGER FROM {legacy_table_name} WHERE date IS NOT NULL
+    """)).scalars().all()
+    ensure_year_partitions(conn, table_name, years)
+    rowcount = conn.execute(text(f"""
+        INSERT INTO {table_name} (date, ticker, open, high, low, close, volume, curr_timestamp)
+        SELECT DISTINCT ON (ticker, date::DATE)
+            date::DATE, ticker, open, high, low, close, volume, curr_timestamp
+        FROM {legacy_table_name}
+        WHERE date IS NOT NULL AND ticker IS NOT NULL
+        ORDER BY ticker, date::DATE, curr_timestamp DESC NULLS LAST
+    """)).rowcount
+    logging.info(f"{rowcount} rows migrated from '{legacy_table_name}' to '{table_name}'.")
+
+
+def ensure_raw_table(conn, table_name='raw_data'):
+    """
+    Creates the partitioned raw data table if needed, migrating a table of the former layout.
+    """
+    if is_table_ensured(conn, table_name):
+        return
+    if table_kind(conn, table_name) == 'r':
+        migrate_legacy_raw_table(conn, table_name)
+    else:
+        conn.execute(text(RAW_TABLE_DDL.format(table_name=table_name)))
+    mark_table_ensured(conn, table_name)
+
+
+def ensure_quarantine_table(conn, table_name='quarantine_raw_data'):
+    ensure_table(conn, table_name, QUARANTINE_TABLE_DDL)
+
+
+def ensure_change_log(conn, table_name='raw_data_changes'):
+    ensure_table(conn, table_name, CHANGE_LOG_DDL)
+
+
+def ensure_intraday_tables(conn, table_name='intraday_bars', rollup_table_name='intraday_rollups'):
+    ensure_table(conn, table_name, INTRADAY_TABLE_DDL)
+    ensure_table(conn, rollup_table_name, INTRADAY_ROLLUP_TABLE_DDL)
+
+
+def ensure_refresh_log(conn, table_name='agg_stock_data_refreshes'):
+    ensure_table(conn, table_name, REFRESH_LOG_DDL)
+
+
+def ensure_pending_aggregation(conn, table_name='agg_stock_data_pending'):
+    ensure_table(conn, table_name, PENDING_AGGREGATION_DDL)
+
+
+def ensure_stock_metrics_table(conn, table_name='stock_metrics'):
+    ensure_table(conn, table_name, STOCK_METRICS_TABLE_DDL)
+
+
+def ensure_fingerprint_table(conn, table_name='response_fingerprints'):
+    ensure_table(conn, table_name, FINGERPRINT_TABLE_DDL)
+
+
+def ensure_ticker_registry(conn, table_name='ticker_registry'):
+    ensure_table(conn, table_name, TICKER_REGISTRY_DDL)
+
+
+def ensure_agg_table(conn, table_name='agg_stock_data'):
+    """
+    Creates the keyed, partitioned aggregated table if needed.
+
+    A table left by a former implementation (without a primary key, or not partitioned) only
+    holds derived data, so it is dropped and recreated. The catalog is only inspected the first
+    time the table is ensured in this process.
+
+    Returns:
+        bool: True if the table was (re)created and therefore needs a full rebuild.
+    """
+    if is_table_ensured(conn, table_name):
+        return False
+
+    created = True
+    kind = table_kind(conn, table_name)
+    if kind == 'p':
+        created = False
+    elif kind is not None:
+        logging.info(f"Table '{table_name}' is not partitioned. Recreating it with the partitioned layout...")
+        conn.execute(text(f"DROP TABLE {table_name}"))
+
+    if created:
+        conn.execute(text(AGG_TABLE_DDL.format(table_name=table_name)))
+        logging.info(f"Table '{table_name}' created.")
+    mark_table_ensured(conn, table_name)
+    return created
+
+
+def ensure_schema(db_engine):
+    """
+    Creates every table of the pipeline that does not exist yet, with the yearly partitions of
+    the stored data, and migrates the tables of the former unpartitioned layout.
+    """
+    with db_engine.connect() as conn:
+        ensure_raw_table(conn)
+        ensure_change_log(conn)
+        ensure_quarantine_table(conn)
+        ensure_agg_table(conn)
+        ensure_year_partitions(conn, 'agg_stock_data', partition_years(conn, 'raw_data'))
+        ensure_refresh_log(conn)
+        conn.commit()
+
+
+if __name__ == "__main__":
+    from src.db.db_operations import init_db
+
+    # Create the missing tables and migrate the ones of the former layout
+    ensure_schema(init_db())
+    logging.info("Schema is up to date.")
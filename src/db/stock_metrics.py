@@ -0,0 +1,182 @@
+from sqlalchemy import text
+from dotenv import load_dotenv
+from src.db.schema import (ensure_stock_metrics_table, ensure_pending_aggregation, ensure_year_partitions, partition_years,
+                           reset_schema_cache)
+from src.db.db_operations import (init_db, copy_dataframe_to_table, read_pending_aggregation, record_failed_aggregation,
+                                  pending_changes, clear_pending_aggregation)
+from src.aggregation.metrics_engine import compute_catalog_metrics, select_catalog, CATALOG_COLUMNS
+from src.monitoring.instrumentation import stage, mark_run_failed
+import pandas as pd
+import argparse
+import os
+import sys
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Catalog metrics written to the stock_metrics table
+STOCK_METRICS = os.getenv("STOCK_METRICS", "")  # Comma-separated metric names, 'all' for the whole catalog (empty disables them)
+
+STOCK_METRICS_TABLE = 'stock_metrics'
+
+# Raw columns read for the catalog, with the NUMERIC prices cast to the type of the metrics
+CATALOG_SOURCE_SQL = """
+    SELECT date, ticker, open::DOUBLE PRECISION AS open, high::DOUBLE PRECISION AS high, low::DOUBLE PRECISION AS low,
+           close::DOUBLE PRECISION AS close, volume
+    FROM {source_table}
+"""
+
+
+def refresh_stock_metrics(db_engine, changes=None, mode='incremental', metrics=STOCK_METRICS,
+                          table_name=STOCK_METRICS_TABLE, source_table='raw_data'):
+    """
+    Brings the catalog metrics of the stock_metrics table up to date with the raw data.
+
+    The raw rows are read in one query and every selected metric is computed from them in a
+    single sorted pass (see `compute_catalog_metrics`). Given the change set of the merges, only
+    the changed tickers are read, in full because the exponentially weighted metrics depend on
+    their whole history, and their rows from the first changed date onwards are replaced. The
+    selected metrics without any row yet (newly added to STOCK_METRICS, or an empty table) are
+    computed for every ticker. In 'full' mode or without a change set, the selected metrics are
+    rebuilt and the other metrics of the table are left as they are. Either way it runs in a
+    single transaction.
+
+    A failed refresh records its change set in `<table_name>_pending` (see `record_failed_aggregation`),
+    which the next refresh adds to its own change set.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        changes (dict): Optional first changed date per ticker, as returned by `insert_raw_data_with_cdc`.
+        mode (str): 'incremental' or 'full'.
+        metrics (str or list): The metrics of METRIC_CATALOG to compute, see `select_catalog`.
+            Defaults to STOCK_METRICS. Nothing is computed if empty.
+        table_name (str): The name of the metrics table.
+        source_table (str): The name of the raw data table.
+
+    Returns:
+        bool: True if the metrics are up to date (or disabled), False if the refresh failed.
+    """
+    if not metrics:
+        return True
+    try:
+        catalog = select_catalog(metrics)
+    except ValueError as e:
+        logging.error(f"Invalid STOCK_METRICS: {e}")
+        mark_run_failed("Invalid STOCK_METRICS")
+        return False
+    metric_names = [entry[0] for entry in catalog]
+    pending_table_name = f"{table_name}_pending"
+    full = mode == 'full' or changes is None
+
+    try:
+        with db_engine.connect() as conn:
+            # The yearly partitions are created in a short transaction of their own
+            ensure_stock_metrics_table(conn, table_name)
+            new_metrics = set(conn.execute(text(f"""
+                SELECT name FROM unnest(CAST(:metrics AS TEXT[])) AS s(name)
+                WHERE NOT EXISTS (SELECT 1 FROM {table_name} WHERE metric = s.name)
+            """), {'metrics': metric_names}).scalars())
+            ensure_year_partitions(conn, table_name, partition_years(conn, source_table))
+            ensure_pending_aggregation(conn, pending_table_name)
+            pending = read_pending_aggregation(conn, pending_table_name)
+            conn.commit()
+
+        # Recompute the rows left stale by the failed refreshes as well
+        if not full:
+            changes = pending_changes(table_name, changes, pending)
+            full = changes is None
+        new_catalog = [entry for entry in catalog if entry[0] in new_metrics and not full]
+        changed_catalog = [entry for entry in catalog if entry not in new_catalog]
+        if not full and not new_catalog and not changes:
+            logging.info(f"No raw rows changed. Table '{table_name}' is already up to date.")
+            return True
+
+        with db_engine.connect() as conn, stage('stock_metrics') as record:
+            source_sql = CATALOG_SOURCE_SQL.format(source_table=source_table)
+            if full:
+                logging.info(f"Rebuilding {len(catalog)} catalog metrics of table '{table_name}'...")
+                conn.execute(text(f"DELETE FROM {table_name} WHERE metric = ANY(:metrics)"), {'metrics': metric_names})
+                raw_df = pd.read_sql(text(source_sql), conn)
+                metrics_df = compute_catalog_metrics(raw_df, catalog)
+            else:
+                frames = []
+                if new_catalog:
+                    # The metrics without any row yet are computed over the whole history of every ticker
+                    logging.info(f"Computing {len(new_catalog)} new catalog metrics of every ticker in '{table_name}'...")
+                    raw_df = pd.read_sql(text(source_sql), conn)
+                    frames.append(compute_catalog_metrics(raw_df, new_catalog))
+                if changed_catalog and changes:
+                    logging.info(f"Refreshing {len(changed_catalog)} catalog metrics of {len(changes)} tickers in '{table_name}'...")
+                    params = {'changed_tickers': list(changes), 'first_changed': list(changes.values()),
+                              'metrics': [entry[0] for entry in changed_catalog]}
+                    conn.execute(text(f"""
+                        DELETE FROM {table_name} m
+                        USING unnest(CAST(:changed_tickers AS TEXT[]), CAST(:first_changed AS DATE[])) AS c(ticker, first_changed)
+                        WHERE m.ticker = c.ticker AND m.date >= c.first_changed AND m.metric = ANY(:metrics)
+                    """), params)
+                    if new_catalog:
+                        changed_df = raw_df[raw_df['ticker'].isin(list(changes))]
+                    else:
+                        raw_df = changed_df = pd.read_sql(text(f"{source_sql} WHERE ticker = ANY(:changed_tickers)"), conn, params=params)
+                    changed_metrics_df = compute_catalog_metrics(changed_df, changed_catalog)
+                    first_changed = pd.to_datetime(changed_metrics_df['ticker'].map(changes))
+                    frames.append(changed_metrics_df[changed_metrics_df['date'] >= first_changed])
+                metrics_df = pd.concat(frames, ignore_index=True)
+            record.rows_in = len(raw_df)
+
+            copy_dataframe_to_table(conn, metrics_df, table_name, CATALOG_COLUMNS)
+            record.rows_out = len(metrics_df)
+            # Only a rebuild of the metrics maintained by the pipeline (STOCK_METRICS) repairs every failed refresh
+            clear_pending_aggregation(conn, table_name, changes, covers_all=full and metrics == STOCK_METRICS)
+            conn.commit()
+            logging.info(f"Table '{table_name}' is up to date: {len(metrics_df)} metric values written.")
+            return True
+
+    except Exception as e:
+        reset_schema_cache(table_name)
+        logging.error(f"Error during the refresh of the catalog metrics: {e}")
+        mark_run_failed(f"Refresh of '{table_name}' failed")
+        record_failed_aggregation(db_engine, table_name, None if full else changes)
+        return False
+
+def read_stock_metrics(db_engine, metrics=None, tickers=None, since_date=None, table_name=STOCK_METRICS_TABLE):
+    """
+    Reads catalog metrics in the wide format, one column per metric.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        metrics (list): Optional metric names to read. Defaults to every stored metric.
+        tickers (list): Optional tickers to read. Defaults to every ticker.
+        since_date (datetime): Optional earliest date to read.
+        table_name (str): The name of the metrics table.
+
+    Returns:
+        pd.DataFrame: Columns ticker, date and one per metric, sorted by ticker and date. A metric
+            is NaN on the dates where it is not defined yet.
+    """
+    filters, params = ["TRUE"], {}
+    if metrics is not None:
+        filters.append("metric = ANY(:metrics)")
+        params['metrics'] = list(metrics)
+    if tickers is not None:
+        filters.append("ticker = ANY(:tickers)")
+        params['tickers'] = list(tickers)
+    if since_date is not None:
+        filters.append("date >= :since_date")
+        params['since_date'] = since_date
+    with db_engine.connect() as conn:
+        long_df = pd.read_sql(text(f"""
+            SELECT ticker, date, metric, value FROM {table_name} WHERE {' AND '.join(filters)}
+        """), conn, params=params)
+    wide_df = long_df.pivot(index=['ticker', 'date'], columns='metric', values='value')
+    return wide_df.rename_axis(columns=None).reset_index().sort_values(['ticker', 'date'], ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the catalog metrics of the stock_metrics table.")
+    parser.add_argument('--metrics', default=STOCK_METRICS or 'all',
+                        help="Comma-separated metrics of the catalog, or 'all'. Defaults to STOCK_METRICS, or 'all' if unset.")
+    args = parser.parse_args()
+
+    sys.exit(0 if refresh_stock_metrics(init_db(), mode='full', metrics=args.metrics) else 1)
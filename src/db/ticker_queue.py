@@ -0,0 +1,227 @@
+from sqlalchemy import text
+from dotenv import load_dotenv
+from src.db.schema import ensure_ticker_registry
+from src.fetch_planner import next_session_close
+import argparse
+import socket
+import os
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler("ticker_queue.log", mode="a")
+    ]
+)
+
+# Queue configuration
+TICKER_SOURCE = os.getenv("TICKER_SOURCE", "constants").lower()  # 'constants' (TICKERS) or 'queue' (ticker_registry)
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+TICKER_BATCH_SIZE = int(os.getenv("TICKER_BATCH_SIZE", 25))  # Tickers claimed at a time
+TICKER_LEASE_SECONDS = int(os.getenv("TICKER_LEASE_SECONDS", 900))  # Time after which the claim of a crashed worker expires
+TICKER_RETRY_BASE_SECONDS = int(os.getenv("TICKER_RETRY_BASE_SECONDS", 300))  # First retry delay after a failure
+TICKER_RETRY_MAX_SECONDS = int(os.getenv("TICKER_RETRY_MAX_SECONDS", 86400))  # Longest retry delay
+
+REGISTRY_TABLE = 'ticker_registry'
+
+
+def register_tickers(db_engine, tickers, table_name=REGISTRY_TABLE):
+    """
+    Adds tickers to the registry. Tickers already registered are left unchanged.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        tickers (list): The ticker symbols to add.
+        table_name (str): The name of the registry table.
+
+    Returns:
+        int: The number of tickers added.
+    """
+    with db_engine.connect() as conn:
+        ensure_ticker_registry(conn, table_name)
+        added = conn.execute(text(f"""
+            INSERT INTO {table_name} (ticker)
+            SELECT DISTINCT unnest(CAST(:tickers AS TEXT[]))
+            ON CONFLICT (ticker) DO NOTHING
+        """), {'tickers': list(tickers)}).rowcount
+        conn.commit()
+    logging.info(f"{added} tickers added to '{table_name}'.")
+    return added
+
+
+def set_tickers_enabled(db_engine, tickers, enabled, table_name=REGISTRY_TABLE):
+    """
+    Enables or disables registered tickers. Disabled tickers are never claimed.
+    """
+    with db_engine.connect() as conn:
+        ensure_ticker_registry(conn, table_name)
+        updated = conn.execute(text(f"UPDATE {table_name} SET enabled = :enabled WHERE ticker = ANY(:tickers)"),
+                               {'enabled': enabled, 'tickers': list(tickers)}).rowcount
+        conn.commit()
+    return updated
+
+
+def claim_tickers(db_engine, worker_id=WORKER_ID, batch_size=TICKER_BATCH_SIZE, lease_seconds=TICKER_LEASE_SECONDS,
+                  table_name=REGISTRY_TABLE):
+    """
+    Claims a batch of due tickers for this worker.
+
+    `FOR UPDATE SKIP LOCKED` lets concurrent workers claim disjoint batches without waiting for
+    each other. A claim is a lease: if the worker dies, the tickers become claimable again once
+    `claimed_until` has passed.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        worker_id (str): The identifier of the claiming worker. Defaults to WORKER_ID.
+        batch_size (int): The maximum number of tickers to claim. Defaults to TICKER_BATCH_SIZE.
+        lease_seconds (int): The duration of the claim. Defaults to TICKER_LEASE_SECONDS.
+        table_name (str): The name of the registry table.
+
+    Returns:
+        list: The claimed tickers, the longest overdue first. Empty if no ticker is due.
+    """
+    with db_engine.connect() as conn:
+        ensure_ticker_registry(conn, table_name)
+        result = conn.execute(text(f"""
+            WITH due AS (
+                SELECT ticker
+                FROM {table_name}
+                WHERE enabled
+                  AND next_fetch_at <= now()
+                  AND (claimed_until IS NULL OR claimed_until < now())
+                ORDER BY next_fetch_at
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE {table_name} r
+            SET claimed_by = :worker_id,
+                claimed_until = now() + make_interval(secs => :lease_seconds)
+            FROM due
+            WHERE r.ticker = due.ticker
+            RETURNING r.ticker, r.next_fetch_at
+        """), {'worker_id': worker_id, 'batch_size': batch_size, 'lease_seconds': lease_seconds})
+        tickers = [ticker for ticker, _ in sorted(result, key=lambda row: row[1])]
+        conn.commit()
+    return tickers
+
+
+def complete_tickers(db_engine, succeeded, failed, worker_id=WORKER_ID, table_name=REGISTRY_TABLE):
+    """
+    Records the outcome of a claimed batch and releases its tickers.
+
+    Succeeded tickers are due again after the next session close. Failed tickers are retried
+    with an exponential backoff (TICKER_RETRY_BASE_SECONDS doubling up to TICKER_RETRY_MAX_SECONDS).
+    Only tickers still claimed by `worker_id` are updated, so a worker whose lease expired does
+    not overwrite the state written by the worker that claimed them next.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        succeeded (dict): Latest bar date (or None if unknown) per ticker processed successfully.
+        failed (dict): Error message per failed ticker.
+        worker_id (str): The identifier of the worker. Defaults to WORKER_ID.
+        table_name (str): The name of the registry table.
+    """
+    with db_engine.connect() as conn:
+        if succeeded:
+            conn.execute(text(f"""
+                UPDATE {table_name} r
+                SET last_status = 'success',
+                    last_error = NULL,
+                    failure_count = 0,
+                    last_fetched_at = now(),
+                    last_bar_date = COALESCE(s.last_bar_date, r.last_bar_date),
+                    next_fetch_at = :next_fetch_at,
+                    claimed_by = NULL,
+                    claimed_until = NULL
+                FROM unnest(CAST(:tickers AS TEXT[]), CAST(:dates AS DATE[])) AS s(ticker, last_bar_date)
+                WHERE r.ticker = s.ticker AND r.claimed_by = :worker_id
+            """), {
+                'tickers': list(succeeded), 'dates': list(succeeded.values()),
+                'next_fetch_at': next_session_close(), 'worker_id': worker_id,
+            })
+        if failed:
+            conn.execute(text(f"""
+                UPDATE {table_name} r
+                SET last_status = 'failure',
+                    last_error = f.error,
+                    failure_count = r.failure_count + 1,
+                    next_fetch_at = now() + make_interval(secs => LEAST(:max_delay, :base_delay * power(2, r.failure_count))),
+                    claimed_by = NULL,
+                    claimed_until = NULL
+                FROM unnest(CAST(:tickers AS TEXT[]), CAST(:errors AS TEXT[])) AS f(ticker, error)
+                WHERE r.ticker = f.ticker AND r.claimed_by = :worker_id
+            """), {
+                'tickers': list(failed), 'errors': list(failed.values()), 'worker_id': worker_id,
+                'base_delay': TICKER_RETRY_BASE_SECONDS, 'max_delay': TICKER_RETRY_MAX_SECONDS,
+            })
+        conn.commit()
+    if failed:
+        logging.warning(f"{len(failed)} tickers failed and will be retried: {', '.join(failed)}")
+
+
+def release_tickers(db_engine, tickers, worker_id=WORKER_ID, table_name=REGISTRY_TABLE):
+    """
+    Gives claimed tickers back without processing them, e.g. when the run is cancelled.
+    """
+    with db_engine.connect() as conn:
+        conn.execute(text(f"""
+            UPDATE {table_name}
+            SET claimed_by = NULL, claimed_until = NULL
+            WHERE ticker = ANY(:tickers) AND claimed_by = :worker_id
+        """), {'tickers': list(tickers), 'worker_id': worker_id})
+        conn.commit()
+
+
+def registry_status(db_engine, table_name=REGISTRY_TABLE):
+    """
+    Returns the number of enabled tickers per state: due, claimed, failing and up to date.
+    """
+    with db_engine.connect() as conn:
+        ensure_ticker_registry(conn, table_name)
+        conn.commit()
+        row = conn.execute(text(f"""
+            SELECT
+                COUNT(*) FILTER (WHERE claimed_until >= now()) AS claimed,
+                COUNT(*) FILTER (WHERE (claimed_until IS NULL OR claimed_until < now()) AND next_fetch_at <= now()) AS due,
+                COUNT(*) FILTER (WHERE last_status = 'failure') AS failing,
+                COUNT(*) FILTER (WHERE next_fetch_at > now() AND last_status = 'success') AS up_to_date
+            FROM {table_name}
+            WHERE enabled
+        """)).mappings().one()
+        return dict(row)
+
+
+if __name__ == "__main__":
+    from src.db.db_operations import init_db
+
+    parser = argparse.ArgumentParser(description="Manage the shared ticker registry of the queue mode.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in [('register', "Add tickers to the registry."),
+                               ('enable', "Enable registered tickers."),
+                               ('disable', "Stop fetching registered tickers.")]:
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument('tickers', nargs='*', help="Ticker symbols.")
+        subparser.add_argument('--file', help="File with one ticker symbol per line.")
+    subparsers.add_parser('status', help="Show the number of tickers per state.")
+    args = parser.parse_args()
+
+    db_engine = init_db()
+    if args.command == 'status':
+        for state, count in registry_status(db_engine).items():
+            print(f"{state:<11} {count}")
+    else:
+        tickers = list(args.tickers)
+        if args.file:
+            with open(args.file) as f:
+                tickers += [line.strip() for line in f if line.strip()]
+        if args.command == 'register':
+            register_tickers(db_engine, tickers)
+        else:
+            count = set_tickers_enabled(db_engine, tickers, args.command == 'enable')
+            print(f"{count} tickers {args.command}d.")
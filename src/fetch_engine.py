@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import contextvars
+from src.ingestion_stock import fetch_stock_data, empty_stock_frame, FETCH_MAX_WORKERS
+import pandas as pd
+import time
+import logging
+
+
+def iter_fetch_results(tickers, max_workers=FETCH_MAX_WORKERS, outputsizes=None, max_pending=None, cancel_event=None,
+                       fingerprints=None):
+    """
+    Fetches daily stock data for several tickers concurrently and yields each result as it arrives.
+
+    At most `max_workers + max_pending` fetches are submitted but not yet consumed. New fetches
+    are only submitted as the caller pulls results, so a slow consumer applies backpressure and
+    the number of payloads held in memory stays bounded.
+
+    Args:
+        tickers (list): The stock ticker symbols to fetch.
+        max_workers (int): The number of concurrent fetches. Defaults to FETCH_MAX_WORKERS.
+        outputsizes (dict): Optional output size per ticker, as returned by `plan_fetches`.
+            Tickers without an entry are fetched 'compact'.
+        max_pending (int): The number of completed results allowed to wait for the consumer.
+            Defaults to `max_workers`.
+        cancel_event (threading.Event): Optional event that stops the fetches once set. Queued fetches
+            are dropped and the ones already running are still yielded.
+        fingerprints (ResponseFingerprints): Optional fingerprints used to drop unchanged responses,
+            see `fetch_stock_data`.
+
+    Yields:
+        tuple: The ticker and its DataFrame of daily bars (empty if the fetch failed).
+    """
+    outputsizes = outputsizes or {}
+    max_in_flight = max_workers + (max_workers if max_pending is None else max_pending)
+    remaining = iter(tickers)
+    in_flight = {}
+
+    cancelled = False
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as executor:
+        while True:
+            if cancel_event is not None and cancel_event.is_set() and not cancelled:
+                cancelled, remaining = True, iter(())
+                dropped = [future for future in list(in_flight) if future.cancel()]
+                for future in dropped:
+                    in_flight.pop(future)
+                logging.warning(f"Fetch cancelled. {len(dropped)} queued fetches dropped, no more tickers are submitted.")
+
+            for ticker in remaining:
+                # Run the fetch in a copy of the caller's context, so that it is recorded in the caller's run
+                context = contextvars.copy_context()
+                in_flight[executor.submit(context.run, fetch_stock_data, ticker, outputsizes.get(ticker, 'compact'),
+                                          fingerprints)] = ticker
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                return
+
+            # With a cancel event, wake up regularly to check it
+            done, _ = wait(in_flight, timeout=1 if cancel_event is not None else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticker = in_flight.pop(future)
+                try:
+                    df = future.result()
+                except Exception as e:
+                    logging.error(f"Fetching ticker {ticker} failed: {e}")
+                    df = empty_stock_frame()
+                yield ticker, df
+
+
+def fetch_tickers_concurrently(tickers, max_workers=FETCH_MAX_WORKERS, outputsizes=None, cancel_event=None,
+                               fingerprints=None):
+    """
+    Fetches daily stock data for several tickers concurrently.
+
+    Requests are issued from a thread pool and paced by the shared token-bucket rate limiter
+    used inside `fetch_stock_data`, so the wall-clock time of a run tracks the API quota
+    rather than a fixed sleep per ticker.
+
+    Args:
+        tickers (list): The stock ticker symbols to fetch.
+        max_workers (int): The number of concurrent fetches. Defaults to FETCH_MAX_WORKERS.
+        outputsizes (dict): Optional output size per ticker, as returned by `plan_fetches`.
+            Tickers without an entry are fetched 'compact'.
+        cancel_event (threading.Event): Optional event that stops submitting new fetches once set.
+        fingerprints (ResponseFingerprints): Optional fingerprints used to drop unchanged responses,
+            see `fetch_stock_data`.
+
+    Returns:
+        pd.DataFrame: The daily bars of all tickers, in the order of `tickers`. Tickers not fetched
+            because of a cancellation are left out.
+    """
+    start_time = time.monotonic()
+    results = dict(iter_fetch_results(tickers, max_workers, outputsizes, max_pending=len(tickers), cancel_event=cancel_event,
+                                      fingerprints=fingerprints))
+    all_tickers = pd.concat([empty_stock_frame()] + [results[ticker] for ticker in tickers if ticker in results],
+                            ignore_index=True)
+
+    elapsed = time.monotonic() - start_time
+    logging.info(f"Fetched {len(all_tickers)} records for {len(tickers)} tickers in {elapsed:.1f} seconds.")
+    return all_tickers
@@ -0,0 +1,109 @@
+from datetime import datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+import logging
+
+# Trading calendar configuration (weekends are skipped, exchange holidays are not modelled)
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+MARKET_CLOSE = dt_time(16, 0)
+
+# 'compact' returns the last 100 data points, anything older needs 'full'
+COMPACT_MAX_SESSIONS = 100
+
+
+def last_trading_session(now=None):
+    """
+    Returns the date of the most recent trading session that has closed.
+
+    Args:
+        now (datetime): Timezone-aware reference time. Defaults to the current time.
+
+    Returns:
+        datetime.date: The date of the last closed weekday session in the market timezone.
+    """
+    now = (now or datetime.now(MARKET_TIMEZONE)).astimezone(MARKET_TIMEZONE)
+    session = now.date()
+    if now.time() < MARKET_CLOSE:
+        session -= timedelta(days=1)
+    while session.weekday() >= 5:  # Saturday or Sunday
+        session -= timedelta(days=1)
+    return session
+
+
+def next_session_close(now=None):
+    """
+    Returns the time at which the next trading session closes.
+
+    Args:
+        now (datetime): Timezone-aware reference time. Defaults to the current time.
+
+    Returns:
+        datetime: The close of the first weekday session ending after `now`, in the market timezone.
+    """
+    now = (now or datetime.now(MARKET_TIMEZONE)).astimezone(MARKET_TIMEZONE)
+    session = now.date()
+    if now.time() >= MARKET_CLOSE:
+        session += timedelta(days=1)
+    while session.weekday() >= 5:  # Saturday or Sunday
+        session += timedelta(days=1)
+    return datetime.combine(session, MARKET_CLOSE, tzinfo=MARKET_TIMEZONE)
+
+
+def plan_fetches(tickers, latest_dates, now=None):
+    """
+    Decides which tickers need fetching and with which output size.
+
+    Args:
+        tickers (list): The stock ticker symbols to consider.
+        latest_dates (dict): Latest stored date per ticker, as returned by `get_latest_dates`.
+            None means the stored state is unknown, in which case every ticker is fetched compact.
+        now (datetime): Timezone-aware reference time. Defaults to the current time.
+
+    Returns:
+        dict: Maps each ticker to fetch to its 'compact' or 'full' output size.
+            Tickers that are already current for the last trading session are left out.
+    """
+    if latest_dates is None:
+        return {ticker: 'compact' for ticker in tickers}
+
+    session = last_trading_session(now)
+    fetch_plan = {}
+
+    for ticker in tickers:
+        latest_date = latest_dates.get(ticker)
+        if latest_date is None:
+            fetch_plan[ticker] = 'full'
+            continue
+
+        # Number of sessions after the latest stored one, up to and including the last session
+        gap = int(np.busday_count(latest_date + timedelta(days=1), session + timedelta(days=1)))
+        if gap <= 0:
+            continue
+        fetch_plan[ticker] = 'compact' if gap <= COMPACT_MAX_SESSIONS else 'full'
+
+    skipped = len(tickers) - len(fetch_plan)
+    full = sum(1 for outputsize in fetch_plan.values() if outputsize == 'full')
+    logging.info(f"Fetch plan for session {session}: {len(fetch_plan) - full} compact, {full} full, {skipped} up to date.")
+    return fetch_plan
+
+
+def trim_to_new_rows(df, latest_dates):
+    """
+    Drops the rows of a fetched DataFrame that are older than the latest stored date of their ticker.
+
+    The latest stored date itself is kept so that a bar stored before the session closed is refreshed.
+
+    Args:
+        df (pd.DataFrame): Fetched stock data with 'Date' and 'Ticker' columns.
+        latest_dates (dict): Latest stored date per ticker. None keeps every row.
+
+    Returns:
+        pd.DataFrame: The rows that are new or may have changed.
+    """
+    if not latest_dates:
+        return df
+
+    cutoff = pd.to_datetime(df['Ticker'].map(latest_dates))
+    keep = cutoff.isna() | (df['Date'] >= cutoff)
+    return df[keep].reset_index(drop=True)
@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pandas.api.types import union_categoricals
+from dotenv import load_dotenv
+from src.config.constants import TICKERS
+from src.ingestion_stock import call_api, API_KEY, FETCH_MAX_WORKERS
+from src.db.db_operations import init_db
+from src.db.intraday_operations import merge_intraday_bars
+from src.monitoring.instrumentation import stage, instrumented_run
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+import contextvars
+import argparse
+import time
+import os
+import sys
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler("ingestion_intraday.log", mode="a")
+    ]
+)
+
+# Intraday ingestion configuration
+INTRADAY_INTERVAL = os.getenv("INTRADAY_INTERVAL", "5min")  # Bar size: 1min, 5min, 15min, 30min or 60min
+INTRADAY_OUTPUTSIZE = os.getenv("INTRADAY_OUTPUTSIZE", "compact")  # 'compact' (latest 100 bars) or 'full' (last 30 days)
+
+VALID_INTERVALS = ['1min', '5min', '15min', '30min', '60min']
+
+# Columns of the DataFrame returned by `fetch_intraday_data`, named after the intraday_bars columns
+INTRADAY_COLUMNS = ['ts', 'ticker', 'open', 'high', 'low', 'close', 'volume']
+
+# Fields of an intraday bar holding each price column
+PRICE_FIELDS = {'open': '1. open', 'high': '2. high', 'low': '3. low', 'close': '4. close'}
+
+# The API quotes prices with 4 decimals: float32 is enough as long as it keeps them within half a tick
+FLOAT32_PRICE_TOLERANCE = 0.00005
+
+
+def empty_intraday_frame():
+    """
+    Returns an empty DataFrame with the columns and dtypes of a parsed intraday time series.
+    """
+    return pd.DataFrame({
+        'ts': np.array([], dtype=np.int64),
+        'ticker': pd.Categorical([]),
+        **{column: np.array([], dtype=np.float32) for column in PRICE_FIELDS},
+        'volume': np.array([], dtype=np.int64),
+    })
+
+def compact_prices(prices):
+    """
+    Downcasts price arrays to float32 if every price survives the round trip within FLOAT32_PRICE_TOLERANCE.
+
+    Args:
+        prices (dict): float64 price array per column.
+
+    Returns:
+        dict: The same arrays, all float32 or all left as float64.
+    """
+    downcast = {column: values.astype(np.float32) for column, values in prices.items()}
+    for column, values in prices.items():
+        if not np.all(np.abs(downcast[column] - values) <= FLOAT32_PRICE_TOLERANCE, where=~np.isnan(values)):
+            return prices
+    return downcast
+
+def parse_intraday_series(time_series, ticker, time_zone='US/Eastern'):
+    """
+    Parses an Alpha Vantage intraday time series into compact typed columns.
+
+    The local timestamps of the response are converted to int64 epoch seconds (UTC), the ticker
+    is a categorical column and the prices are float32 when it keeps their precision (see
+    `compact_prices`), which takes about half the memory of the daily representation.
+
+    Args:
+        time_series (dict): The 'Time Series (<interval>)' object of the API response.
+        ticker (str): The stock ticker symbol.
+        time_zone (str): The time zone of the timestamps, from the metadata of the response.
+
+    Returns:
+        pd.DataFrame: INTRADAY_COLUMNS, one row per bar. Bars at a local time skipped or repeated
+            by a daylight saving change are dropped.
+    """
+    if not time_series:
+        return empty_intraday_frame()
+
+    local_times = pd.DatetimeIndex(np.array(list(time_series), dtype='datetime64[s]'))
+    timestamps = local_times.tz_localize(time_zone, ambiguous='NaT', nonexistent='NaT')
+    valid = ~timestamps.isna()
+
+    bars = list(time_series.values())
+    prices = compact_prices({
+        column: np.array(list(map(float, map(itemgetter(field), bars))), dtype=np.float64)
+        for column, field in PRICE_FIELDS.items()
+    })
+    df = pd.DataFrame({
+        'ts': timestamps.as_unit('s').asi8,
+        'ticker': pd.Categorical.from_codes(np.zeros(len(bars), dtype=np.int8), categories=[str(ticker)]),
+        **prices,
+        'volume': np.array(list(map(int, map(itemgetter('5. volume'), bars))), dtype=np.int64),
+    })
+    if not valid.all():
+        logging.warning(f"{(~valid).sum()} bars of {ticker} at an ambiguous local time dropped.")
+        df = df[valid].reset_index(drop=True)
+    return df
+
+def fetch_intraday_data(ticker, interval=INTRADAY_INTERVAL, outputsize=INTRADAY_OUTPUTSIZE):
+    """
+    Fetches the intraday bars of a ticker from the Alpha Vantage API.
+
+    The call is recorded as the 'fetch' stage of the current run (see `src.monitoring.instrumentation`).
+
+    Args:
+        ticker (str): The stock ticker symbol.
+        interval (str): The bar size, one of VALID_INTERVALS. Defaults to INTRADAY_INTERVAL.
+        outputsize (str): 'compact' for the latest 100 bars or 'full' for the last 30 days.
+
+    Returns:
+        pd.DataFrame: The bars of the ticker (see `parse_intraday_series`). Empty if no data could be fetched.
+    """
+    with stage('fetch') as record:
+        logging.info(f"Fetching {outputsize} {interval} bars for ticker: {ticker}")
+        data = call_api({
+            'function': 'TIME_SERIES_INTRADAY',
+            'symbol': ticker,
+            'interval': interval,
+            'apikey': API_KEY,
+            'outputsize': outputsize,
+        }, ticker)
+        if data is None:
+            return empty_intraday_frame()
+
+        time_series = data.get(f'Time Series ({interval})', {})
+        if not time_series:
+            logging.warning(f"No intraday time series found for ticker: {ticker}.")
+            return empty_intraday_frame()
+
+        df = parse_intraday_series(time_series, ticker, data.get('Meta Data', {}).get('6. Time Zone', 'US/Eastern'))
+        record.rows_out = len(df)
+        return df
+
+def fetch_intraday_concurrently(tickers, interval=INTRADAY_INTERVAL, outputsize=INTRADAY_OUTPUTSIZE,
+                                max_workers=FETCH_MAX_WORKERS, cancel_event=None):
+    """
+    Fetches the intraday bars of several tickers concurrently, paced by the shared rate limiter.
+
+    Args:
+        tickers (list): The stock ticker symbols to fetch.
+        interval (str): The bar size. Defaults to INTRADAY_INTERVAL.
+        outputsize (str): 'compact' or 'full'. Defaults to INTRADAY_OUTPUTSIZE.
+        max_workers (int): The number of concurrent fetches. Defaults to FETCH_MAX_WORKERS.
+        cancel_event (threading.Event): Optional event that drops the fetches not started yet once set.
+
+    Returns:
+        pd.DataFrame: The bars of every fetched ticker, with a categorical ticker column.
+    """
+    start_time = time.monotonic()
+    frames = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as executor:
+        # Run every fetch in a copy of the caller's context, so that it is recorded in the caller's run
+        futures = {executor.submit(contextvars.copy_context().run, fetch_intraday_data, ticker, interval, outputsize): ticker
+                   for ticker in tickers}
+        for future in as_completed(futures):
+            if cancel_event is not None and cancel_event.is_set():
+                dropped = sum(queued.cancel() for queued in futures)
+                if dropped:
+                    logging.warning(f"Fetch cancelled. {dropped} queued fetches dropped.")
+            if future.cancelled():
+                continue
+            try:
+                df = future.result()
+            except Exception as e:
+                logging.error(f"Fetching ticker {futures[future]} failed: {e}")
+                continue
+            if not df.empty:
+                frames.append(df)
+
+    if not frames:
+        return empty_intraday_frame()
+    # Concatenating categoricals with different categories would fall back to object strings
+    tickers_column = union_categoricals([df['ticker'] for df in frames])
+    all_bars = pd.concat([df.drop(columns='ticker') for df in frames], ignore_index=True)
+    all_bars.insert(1, 'ticker', tickers_column)
+
+    logging.info(f"Fetched {len(all_bars)} {interval} bars for {len(tickers)} tickers in {time.monotonic() - start_time:.1f} seconds "
+                 f"({all_bars.memory_usage(deep=True).sum() / len(all_bars):.0f} bytes per bar in memory).")
+    return all_bars
+
+def run_intraday_pipeline(tickers=None, interval=INTRADAY_INTERVAL, outputsize=INTRADAY_OUTPUTSIZE, db_engine=None,
+                          cancel_event=None):
+    """
+    Fetches the intraday bars of the tickers, merges them into intraday_bars and updates the rollups.
+
+    The run is recorded under the 'intraday' job in the run metrics.
+
+    Args:
+        tickers (list): The tickers to fetch. Defaults to the tickers of constants.py.
+        interval (str): The bar size. Defaults to INTRADAY_INTERVAL.
+        outputsize (str): 'compact' or 'full'. Defaults to INTRADAY_OUTPUTSIZE.
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object, or None to create it.
+        cancel_event (threading.Event): Optional event that stops the run at its next safe point.
+
+    Returns:
+        bool: True if the run succeeded (or there was nothing to load), False if the load failed.
+    """
+    if interval not in VALID_INTERVALS:
+        logging.error(f"Invalid intraday interval: {interval}. Must be one of {VALID_INTERVALS}.")
+        raise ValueError(f"Invalid intraday interval: {interval}. Must be one of {VALID_INTERVALS}.")
+
+    with instrumented_run(job='intraday'):
+        df = fetch_intraday_concurrently(tickers or TICKERS, interval, outputsize, cancel_event=cancel_event)
+        if df.empty:
+            logging.info("No intraday bars fetched.")
+            return True
+        if cancel_event is not None and cancel_event.is_set():
+            # The bars are fetched again by the next run
+            logging.warning("Intraday run cancelled before the merge. Nothing loaded.")
+            return True
+        return merge_intraday_bars(db_engine or init_db(), df) is not None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the intraday bars of a list of tickers and update their rollups.")
+    parser.add_argument('tickers', nargs='*', help="Ticker symbols. Defaults to the tickers of constants.py.")
+    parser.add_argument('--interval', default=INTRADAY_INTERVAL, choices=VALID_INTERVALS)
+    parser.add_argument('--full', action='store_true', help="Fetch the last 30 days instead of the latest 100 bars.")
+    args = parser.parse_args()
+
+    succeeded = run_intraday_pipeline(args.tickers or None, args.interval, 'full' if args.full else INTRADAY_OUTPUTSIZE)
+    sys.exit(0 if succeeded else 1)
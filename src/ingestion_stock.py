@@ -1,6 +1,16 @@
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from src.config.constants import TICKERS
+from src.rate_limiter import get_rate_limiter
+from src.monitoring.instrumentation import stage, increment, observe_api_latency
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+import threading
+import hashlib
+import json
+import random
 import time
 import os
 import logging
@@ -30,79 +40,253 @@ if not BASE_URL:
     logging.error("BASE_URL not found. Please make sure to set the ALPHA_VANTAGE_BASE_URL in your .env file.")
     raise ValueError("BASE_URL not found. Please make sure to set the ALPHA_VANTAGE_BASE_URL in your .env file.")
 
+# Concurrency and retry configuration
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", 4))
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", 5))
+API_BACKOFF_SECONDS = float(os.getenv("API_BACKOFF_SECONDS", 2))
+API_TIMEOUT_SECONDS = float(os.getenv("API_TIMEOUT_SECONDS", 30))
+
+# Use orjson to decode responses when it is installed, it is several times faster than the json module
+try:
+    import orjson
+    json_loads = orjson.loads
+
+    def canonical_json(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except ImportError:
+    json_loads = json.loads
+
+    def canonical_json(obj):
+        return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+
+# Columns of the DataFrame returned by `fetch_stock_data`
+STOCK_COLUMNS = ['Date', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+# Fields of a daily bar holding each price column
+PRICE_FIELDS = {'Open': '1. open', 'High': '2. high', 'Low': '3. low', 'Close': '4. close'}
+
+# HTTP status codes that signal throttling or a transient server problem
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Returns the shared keep-alive HTTP session, creating it on first use.
+
+    The connection pool is sized for FETCH_MAX_WORKERS so that concurrent fetches
+    reuse connections instead of opening a new one per request.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=FETCH_MAX_WORKERS, pool_maxsize=FETCH_MAX_WORKERS)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def is_throttled(data):
+    """
+    Checks whether an Alpha Vantage response body is a rate limit notice.
+
+    Alpha Vantage answers throttled calls with HTTP 200 and a 'Note' or 'Information'
+    message instead of the time series.
+    """
+    message = data.get('Note') or data.get('Information') or ''
+    return 'call frequency' in message or 'rate limit' in message
+
+
+def backoff_delay(attempt):
+    """
+    Returns the exponential backoff delay (with jitter) for a retry attempt.
+    """
+    return API_BACKOFF_SECONDS * (2 ** attempt) + random.uniform(0, API_BACKOFF_SECONDS)
+
+def empty_stock_frame():
+    """
+    Returns an empty DataFrame with the columns and dtypes of a parsed time series.
+    """
+    return pd.DataFrame({
+        'Date': np.array([], dtype='datetime64[ns]'),
+        'Ticker': np.array([], dtype=object),
+        'Open': np.array([], dtype=np.float64),
+        'High': np.array([], dtype=np.float64),
+        'Low': np.array([], dtype=np.float64),
+        'Close': np.array([], dtype=np.float64),
+        'Volume': np.array([], dtype=np.int64),
+    })
+
+def parse_time_series(time_series, ticker):
+    """
+    Parses an Alpha Vantage daily time series straight into typed columns.
+
+    Instead of building one dict per day, each field is gathered across all days and converted
+    into a typed array in a single C-level pass, and the date keys are parsed in one call.
+
+    Args:
+        time_series (dict): The 'Time Series (Daily)' object of the API response.
+        ticker (str): The stock ticker symbol.
+
+    Returns:
+        pd.DataFrame: Columns Date (datetime64[ns]), Ticker (object), Open/High/Low/Close (float64)
+            and Volume (int64), one row per day.
+    """
+    if not time_series:
+        return empty_stock_frame()
+
+    bars = list(time_series.values())
+    columns = {
+        'Date': np.array(list(time_series), dtype='datetime64[D]').astype('datetime64[ns]'),
+        'Ticker': np.full(len(bars), str(ticker), dtype=object),
+    }
+    for column, field in PRICE_FIELDS.items():
+        columns[column] = np.array(list(map(float, map(itemgetter(field), bars))), dtype=np.float64)
+    columns['Volume'] = np.array(list(map(int, map(itemgetter('5. volume'), bars))), dtype=np.int64)
+
+    return pd.DataFrame(columns)
+
+def response_fingerprint(time_series, outputsize):
+    """
+    Returns a hash of a daily time series that does not depend on the key order or formatting of the response.
+    """
+    digest = hashlib.blake2b(outputsize.encode(), digest_size=16)
+    digest.update(canonical_json(time_series))
+    return digest.hexdigest()
+
 # Function to fetch stock data for a specific ticker
-def fetch_stock_data(ticker):
+def fetch_stock_data(ticker, outputsize='compact', fingerprints=None):
     """
     Fetches daily stock data for a specific ticker from the Alpha Vantage API.
 
+    The call is recorded as the 'fetch' stage of the current run (see `src.monitoring.instrumentation`).
+
     Args:
         ticker (str): The stock ticker symbol.
+        outputsize (str): 'compact' for the last 100 data points or 'full' for the whole history.
+        fingerprints (ResponseFingerprints): Optional fingerprints of the last loaded responses (see
+            `src.db.response_fingerprints`). A response identical to the last one loaded is dropped
+            before it is parsed, and the ticker is added to `fingerprints.unchanged`.
 
     Returns:
-        list: A list of dictionaries containing stock data for each day.
+        pd.DataFrame: The daily bars of the ticker in STOCK_COLUMNS order (see `parse_time_series`).
+            Empty if no data could be fetched or the response is unchanged.
     """
+    with stage('fetch') as record:
+        df = request_stock_data(ticker, outputsize, fingerprints)
+        record.rows_out = len(df)
+        return df
 
-    logging.info(f"Fetching data for ticker: {ticker}")
+def call_api(params, ticker):
+    """
+    Calls the API and decodes its response, retrying throttled calls.
 
-    # Define the parameters for the API request
-    params = {
-        'function': 'TIME_SERIES_DAILY',
-        'symbol': ticker,
-        'apikey': API_KEY,
-        'outputsize': 'compact' # 'compact' returns 100 data points (last 100 days)
-    }
+    Records the latency of every API call, the time spent waiting for the rate limiter and the retries.
+
+    Args:
+        params (dict): The query parameters of the call, including the API key.
+        ticker (str): The stock ticker symbol, used in the logs.
+
+    Returns:
+        dict: The decoded response body, or None if the call failed (the error is logged and counted).
+
+    Raises:
+        Exception: If the API could not be reached.
+    """
+    session = get_http_session()
+    rate_limiter = get_rate_limiter()
 
     try:
-        response = requests.get(BASE_URL, params=params)
-        response.raise_for_status()  # Raise an excpeption for HTTP errors
-
-        data = response.json()
-
-        # Parse the data to get the daily time series
-        time_series = data.get('Time Series (Daily)', {})
-
-        if time_series:
-            
-            records = []
-            for date, stats in time_series.items():
-                record = {
-                    "Date": date,
-                    "Ticker": str(ticker),
-                    "Open": float(stats['1. open']),
-                    "High": float(stats['2. high']),
-                    "Low": float(stats['3. low']),
-                    "Close": float(stats['4. close']),
-                    "Volume": int(stats['5. volume'])
-                }
-                records.append(record)
-            
-            logging.info(f"Data for {ticker} fetched successfully.")
-            return records
-        
-        else:
-            logging.warning(f"No time series data found for ticker: {ticker}.")
-            return []
+        for attempt in range(API_MAX_RETRIES + 1):
+            wait_start = time.perf_counter()
+            rate_limiter.acquire()  # Wait for the API quota instead of sleeping a fixed interval
+            request_start = time.perf_counter()
+            increment('rate_limit_wait_seconds', request_start - wait_start)
+            increment('api_calls')
+            try:
+                response = session.get(BASE_URL, params=params, timeout=API_TIMEOUT_SECONDS)
+            finally:
+                observe_api_latency(time.perf_counter() - request_start)
+
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < API_MAX_RETRIES:
+                increment('api_retries')
+                delay = backoff_delay(attempt)
+                logging.warning(f"HTTP {response.status_code} for ticker {ticker}. Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+                continue
+            response.raise_for_status()  # Raise an excpeption for HTTP errors
+
+            data = json_loads(response.content)
+
+            if is_throttled(data):
+                if attempt < API_MAX_RETRIES:
+                    increment('api_retries')
+                    delay = backoff_delay(attempt)
+                    logging.warning(f"API rate limit hit for ticker {ticker}. Retrying in {delay:.1f} seconds...")
+                    time.sleep(delay)
+                    continue
+                logging.error(f"API rate limit still hit for ticker {ticker} after {API_MAX_RETRIES} retries.")
+                increment('api_failures')
+                return None
+            return data
 
     except requests.exceptions.HTTPError as e:
         logging.error(f"HTTP error for ticker {ticker}: {e}")
-        return []
+        increment('api_failures')
+        return None
 
-    except requests.exceptions.JSONDecodeError as e:
+    except (requests.exceptions.JSONDecodeError, json.JSONDecodeError) as e:
         logging.error(f"JSON decode error for ticker {ticker}: {e}")
-        return []
+        increment('api_failures')
+        return None
 
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching data for ticker {ticker}: {e}")
+        increment('api_failures')
         raise Exception(f"Error fetching data for ticker {ticker}: {e}")
 
+def request_stock_data(ticker, outputsize='compact', fingerprints=None):
+    """
+    Requests and parses the daily time series of a ticker, see `call_api`.
+    """
+
+    logging.info(f"Fetching {outputsize} data for ticker: {ticker}")
+
+    # Define the parameters for the API request
+    params = {
+        'function': 'TIME_SERIES_DAILY',
+        'symbol': ticker,
+        'apikey': API_KEY,
+        'outputsize': outputsize # 'compact' returns 100 data points (last 100 days), 'full' the whole history
+    }
+
+    data = call_api(params, ticker)
+    if data is None:
+        return empty_stock_frame()
+
+    # Parse the data to get the daily time series
+    time_series = data.get('Time Series (Daily)', {})
+
+    if time_series:
+        if fingerprints is not None and fingerprints.is_unchanged(
+                ticker, response_fingerprint(time_series, outputsize), max(time_series)):
+            logging.info(f"Data for {ticker} is unchanged since the last run. Skipping it.")
+            return empty_stock_frame()
+
+        df = parse_time_series(time_series, ticker)
+        logging.info(f"Data for {ticker} fetched successfully.")
+        return df
+
+    else:
+        logging.warning(f"No time series data found for ticker: {ticker}.")
+        return empty_stock_frame()
+
 if __name__ == "__main__":
-    
-    all_tickers = []
-
-    for ticker in TICKERS:
-        logging.info(f"Fetching data for {ticker}...")
-        records=fetch_stock_data(ticker)
-        all_tickers.extend(records)  # Collect data for all tickers
-        time.sleep(12)  # Sleep for 12 seconds to avoid hitting the API rate limit
-    
+    from src.fetch_engine import fetch_tickers_concurrently
+
+    all_tickers = fetch_tickers_concurrently(TICKERS)
+
     logging.info(f"Data fetching completed. Total records fetched: {len(all_tickers)}")
\ No newline at end of file
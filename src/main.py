@@ -1,16 +1,29 @@
-from src.ingestion_stock import fetch_stock_data
-from src.db.db_operations import init_db, insert_raw_data_with_cdc, aggregate_stock_data
+from src.fetch_engine import fetch_tickers_concurrently, iter_fetch_results
+from src.fetch_planner import plan_fetches, trim_to_new_rows
+from src.db.db_operations import init_db, get_latest_dates, insert_raw_data_with_cdc, insert_quarantine_rows, aggregate_stock_data
+from src.db.stock_metrics import refresh_stock_metrics
 from src.config.constants import TICKERS
-from src.validation.stock_data_validation import validate_stock_data
+from src.validation.stock_data_validation import split_valid_rows
+from src.aggregation.metrics_engine import compute_stock_metrics
+from src.storage.parquet_store import read_stock_data, write_stock_data, LOCAL_STORE_PATH
+from src.monitoring.instrumentation import instrumented_run, stage, increment, mark_run_failed, PIPELINE_PROFILE, PROFILE_MODES
+from src.db.ticker_queue import claim_tickers, complete_tickers, release_tickers, TICKER_SOURCE
+from src.db.response_fingerprints import load_response_fingerprints, save_response_fingerprints
 from datetime import datetime
 import pandas as pd
-import time
+import argparse
+import os
 import logging
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Streaming configuration
+PIPELINE_STREAMING = os.getenv("PIPELINE_STREAMING", "false").lower() == "true"
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 50))  # Tickers per micro-batch
+STREAM_MAX_PENDING = int(os.getenv("STREAM_MAX_PENDING", 8))  # Fetched tickers buffered while a batch loads
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -21,9 +34,268 @@ logging.basicConfig(
     ]
 )
 
-def fetch_and_process_data(debug=False):
+def build_stock_frame(frames):
+    """
+    Combines fetched stock data into a single DataFrame stamped with the current time.
+
+    Args:
+        frames (list): DataFrames as returned by `fetch_stock_data`.
+
+    Returns:
+        pd.DataFrame: The fetched rows with an added 'curr_timestamp' column.
+    """
+    df = pd.concat(frames, ignore_index=True)
+
+    # Add current_timestamp column ('Date' is already parsed to datetime by `fetch_stock_data`)
+    df['curr_timestamp'] = pd.Timestamp.now().to_datetime64()
+    df['curr_timestamp'] = df['curr_timestamp'].astype('datetime64[ns]')  # Explicitly cast to datetime64[ns]
+
+    # Keep every fetched row in the local store for debugging and replay
+    try:
+        with stage('store_write', rows_in=len(df)):
+            write_stock_data(df)
+    except Exception as e:
+        logging.warning(f"Could not write to the local store '{LOCAL_STORE_PATH}': {e}")
+
+    return df
+
+def validate_stock_rows(df):
+    """
+    Validates stock data row by row and logs the outcome, without touching the database.
+
+    Args:
+        df (pd.DataFrame): The stock data to validate.
+
+    Returns:
+        pd.DataFrame: The valid rows, or None if the schema is invalid.
+        pd.DataFrame: The rows failing a validation rule, with their failure reasons.
+    """
+    with stage('validate', rows_in=len(df)) as record:
+        df, rejected_df, errors = split_valid_rows(df)
+        record.rows_out = len(df)
+    increment('rows_quarantined', len(rejected_df))
+
+    if errors:
+        logging.error("Data validation failed with the following errors:")
+        for error in errors:
+            logging.error(f"- {error}")
+        mark_run_failed("Data validation failed")
+        return None, rejected_df  # Stop further processing if the schema is invalid
+
+    if not rejected_df.empty:
+        logging.warning(f"{len(rejected_df)} rows failed validation and are quarantined:")
+        for reasons, count in rejected_df['reasons'].value_counts().items():
+            logging.warning(f"- {count} rows: {reasons}")
+    return df, rejected_df
+
+def merge_stock_data(db_engine, df, log_changes=True):
+    """
+    Validates stock data and merges the valid rows into the database, without refreshing the aggregated metrics.
+
+    Rows failing a validation rule are written to the quarantine table instead of rejecting the batch.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        df (pd.DataFrame): The stock data to load.
+        log_changes (bool): Whether to log the changed keys in the change log (see `insert_raw_data_with_cdc`).
+
+    Returns:
+        dict: The change set of the merge, i.e. the first changed date per ticker whose rows were inserted
+            or updated (empty if nothing changed), or None if the schema is invalid or the merge failed.
+    """
+    df, rejected_df = validate_stock_rows(df)
+    if df is None:
+        return None
+    return merge_valid_rows(db_engine, df, rejected_df, log_changes)
+
+def merge_valid_rows(db_engine, df, rejected_df, log_changes=True):
+    """
+    Merges rows checked by `validate_stock_rows` into the database and quarantines the rejected ones.
+
+    Returns:
+        dict: The change set of the merge (see `merge_stock_data`), or None if the merge failed.
+    """
+    if not rejected_df.empty:
+        insert_quarantine_rows(db_engine, rejected_df)
+
+    if df.empty:
+        logging.warning("No valid rows to load.")
+        return {}
+
+    return insert_raw_data_with_cdc(db_engine, df, log_changes=log_changes)
+
+def load_stock_data(db_engine, df):
+    """
+    Validates stock data, merges the valid rows into the database and refreshes the aggregated and catalog metrics.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        df (pd.DataFrame): The stock data to load.
+
+    Returns:
+        bool: True if the data passed the schema validation and its valid rows were merged into the database.
+    """
+    df, rejected_df = validate_stock_rows(df)
+    if df is None:
+        return False
+    return load_valid_rows(db_engine, df, rejected_df)
+
+def load_valid_rows(db_engine, df, rejected_df):
+    """
+    Merges rows checked by `validate_stock_rows` into the database and refreshes their metrics.
+
+    Returns:
+        bool: True if the valid rows were merged into the database.
+    """
+    changes = merge_valid_rows(db_engine, df, rejected_df)
+    if changes is None:
+        return False
+
+    # Only recompute what the merge changed, and nothing at all if no row changed
+    if not aggregate_stock_data(db_engine, changes=changes):
+        logging.error("The aggregated metrics of the merged rows are stale until the next aggregation recomputes them.")
+    if not refresh_stock_metrics(db_engine, changes=changes):
+        logging.error("The catalog metrics of the merged rows are stale until the next refresh recomputes them.")
+    return True
+
+def plan_run(db_engine, tickers):
+    """
+    Decides what to fetch from the latest dates stored in the database.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object, or None to create it.
+        tickers (list): The tickers to consider.
+
+    Returns:
+        dict: Output size per ticker to fetch, as returned by `plan_fetches`.
+        dict: Latest stored date per ticker, or None if it could not be read.
+    """
+    try:
+        db_engine = db_engine or init_db()
+        latest_dates = get_latest_dates(db_engine, tickers=tickers)
+    except Exception as e:
+        logging.warning(f"Could not read the latest stored dates: {e}. Fetching compact data for all tickers.")
+        latest_dates = None
+
+    return plan_fetches(tickers, latest_dates), latest_dates
+
+def fetch_new_data(fetch_plan, latest_dates, cancel_event=None, fingerprints=None):
+    """
+    Fetches the planned tickers and keeps the rows that are not stored yet.
+
+    Args:
+        fetch_plan (dict): Output size per ticker, as returned by `plan_fetches`.
+        latest_dates (dict): Latest stored date per ticker, used to drop rows already stored.
+        cancel_event (threading.Event): Optional event that stops submitting new fetches once set.
+        fingerprints (ResponseFingerprints): Optional fingerprints used to drop the responses identical
+            to the last ones loaded (see `src.db.response_fingerprints`).
+
+    Returns:
+        pd.DataFrame: The new rows, stamped with the current time. None if there are none.
+    """
+    all_tickers = fetch_tickers_concurrently(list(fetch_plan), outputsizes=fetch_plan, cancel_event=cancel_event,
+                                             fingerprints=fingerprints)
+
+    if all_tickers.empty:
+        if fingerprints is not None and fingerprints.unchanged:
+            logging.info(f"The data of {len(fingerprints.unchanged)} tickers is unchanged since the last run.")
+        else:
+            logging.warning("No data to display.")
+        return None
+
+    df = build_stock_frame([all_tickers])
+
+    # Only keep the rows that are not stored yet (plus the latest stored bar)
+    df = trim_to_new_rows(df, latest_dates)
+    if df.empty:
+        logging.info("Fetched data contains no new rows.")
+        return None
+
+    # Display all columns in the DataFrame
+    pd.set_option('display.max_columns', None)
+    logging.info(df.head())
+    return df
+
+def save_loaded_fingerprints(db_engine, fingerprints, tickers=None):
+    """
+    Saves the response fingerprints of tickers whose data has been loaded (all of them by default).
+    """
+    if fingerprints is not None:
+        save_response_fingerprints(db_engine, fingerprints.take(tickers))
+
+def stream_and_process_data(db_engine, fetch_plan, latest_dates, batch_size=STREAM_BATCH_SIZE, cancel_event=None,
+                            fingerprints=None):
+    """
+    Fetches, validates and loads stock data in micro-batches of tickers.
+
+    Each batch is validated, merged and aggregated as soon as its tickers have been fetched,
+    so the first rows are committed early in the run and memory use is bounded by the batch
+    size instead of the whole ticker universe. Fetches are throttled by the consumer: while a
+    batch is being loaded, at most STREAM_MAX_PENDING completed fetches are buffered.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        fetch_plan (dict): Output size per ticker, as returned by `plan_fetches`.
+        latest_dates (dict): Latest stored date per ticker, used to drop rows already stored.
+        batch_size (int): The number of tickers per batch. Defaults to STREAM_BATCH_SIZE.
+        cancel_event (threading.Event): Optional event that stops the run after the current batch once set.
+        fingerprints (ResponseFingerprints): Optional fingerprints used to drop unchanged responses.
+    """
+    batch_tickers, batch_frames = [], []
+    loaded_batches = failed_batches = 0
+
+    def flush():
+        nonlocal loaded_batches, failed_batches
+        loaded = True
+        if batch_frames:
+            df = trim_to_new_rows(build_stock_frame(batch_frames), latest_dates)
+            if not df.empty:
+                loaded = load_stock_data(db_engine, df)
+                if loaded:
+                    loaded_batches += 1
+                    logging.info(f"Batch of {len(batch_tickers)} tickers loaded ({len(df)} rows).")
+                else:
+                    failed_batches += 1
+                    logging.error(f"Batch of tickers {batch_tickers} was not loaded.")
+        if loaded:
+            save_loaded_fingerprints(db_engine, fingerprints, batch_tickers)
+        batch_tickers.clear()
+        batch_frames.clear()
+
+    results = iter_fetch_results(list(fetch_plan), outputsizes=fetch_plan, max_pending=STREAM_MAX_PENDING,
+                                 cancel_event=cancel_event, fingerprints=fingerprints)
+    for ticker, ticker_df in results:
+        batch_tickers.append(ticker)
+        if not ticker_df.empty:
+            batch_frames.append(ticker_df)
+        if len(batch_tickers) >= batch_size:
+            flush()
+    flush()
+
+    logging.info(f"Streaming run finished: {loaded_batches} batches loaded, {failed_batches} rejected.")
+
+def fetch_and_process_data(debug=False, streaming=PIPELINE_STREAMING, db_engine=None, profile=PIPELINE_PROFILE, tickers=None,
+                           cancel_event=None):
     """
     Fetches stock data, validates it, and processes it into the database.
+
+    With `streaming`, live data is loaded in micro-batches as it arrives (see `stream_and_process_data`)
+    instead of after every ticker has been fetched. The wall time and row counts of each stage are
+    exported when the run ends (see `src.monitoring.instrumentation`).
+
+    Args:
+        debug (bool): Replay the data of the local store instead of calling the API.
+        streaming (bool): Load live data in micro-batches. Defaults to PIPELINE_STREAMING.
+        db_engine (sqlalchemy.engine.Engine): The engine to load into, e.g. the long-lived engine of
+            the scheduler. Defaults to the shared engine returned by `init_db`.
+        profile (str): Optional profiler for this run, 'cprofile' or 'tracemalloc'. Defaults to PIPELINE_PROFILE.
+        tickers (list): The tickers to process. Defaults to the tickers claimed from the shared registry
+            if TICKER_SOURCE is 'queue' (see `process_ticker_queue`), TICKERS otherwise.
+        cancel_event (threading.Event): Optional event set by the scheduler to stop the run early. It is
+            checked between fetches and before loading, never in the middle of a database transaction.
+
+    Returns:
+        RunMetrics: The metrics of the run.
     """
 
     # Print the timestamp when the task starts
@@ -32,70 +304,172 @@ def fetch_and_process_data(debug=False):
     print(f"Task started at: {current_time}")
     print(f"{'='*40}\n")
 
-    csv_file = 'stock_data.csv'
+    with instrumented_run(profile) as metrics:
+        if not debug and tickers is None and TICKER_SOURCE == 'queue':
+            process_ticker_queue(db_engine or init_db(), cancel_event)
+        else:
+            run_pipeline(debug, streaming, db_engine, tickers or TICKERS, cancel_event)
+    return metrics
+
+def process_ticker_batch(db_engine, tickers, cancel_event=None):
+    """
+    Fetches and loads a batch of tickers and reports the outcome of each one.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        tickers (list): The tickers of the batch.
+        cancel_event (threading.Event): Optional event that stops the batch once set.
+
+    Returns:
+        dict: Latest fetched bar date (None if nothing was fetched) per ticker processed successfully.
+        dict: Error message per failed ticker.
+        list: Tickers left unprocessed because the batch was cancelled.
+    """
+    fetch_plan, latest_dates = plan_run(db_engine, tickers)
+    succeeded = {ticker: None for ticker in tickers if ticker not in fetch_plan}  # Already up to date
+    if not fetch_plan:
+        return succeeded, {}, []
+
+    fingerprints = load_response_fingerprints(db_engine, list(fetch_plan))
+    all_tickers = fetch_tickers_concurrently(list(fetch_plan), outputsizes=fetch_plan, cancel_event=cancel_event,
+                                             fingerprints=fingerprints)
+    if cancel_event is not None and cancel_event.is_set():
+        return succeeded, {}, list(fetch_plan)
+
+    # Unchanged responses were dropped: their tickers are as up to date as the last time they were loaded
+    unchanged = fingerprints.unchanged if fingerprints is not None else set()
+    succeeded.update({ticker: fingerprints.last_bar_date(ticker) for ticker in unchanged})
+
+    last_bar_dates = all_tickers.groupby('Ticker')['Date'].max().dt.date.to_dict()
+    failed = {ticker: "No data fetched" for ticker in fetch_plan if ticker not in last_bar_dates and ticker not in unchanged}
+
+    df = trim_to_new_rows(build_stock_frame([all_tickers]), latest_dates) if not all_tickers.empty else all_tickers
+    if not df.empty and not load_stock_data(db_engine, df):
+        failed.update({ticker: "Load failed" for ticker in last_bar_dates})
+        return succeeded, failed, []
+
+    save_loaded_fingerprints(db_engine, fingerprints)
+    succeeded.update(last_bar_dates)
+    return succeeded, failed, []
+
+def process_ticker_queue(db_engine, cancel_event=None):
+    """
+    Claims batches of due tickers from the shared registry and processes them until none is due.
+
+    Several scheduler instances (each with its own API key and rate limit) can run this at the same
+    time: every batch is claimed by exactly one worker (see `claim_tickers`), so the ticker universe
+    is split between them and throughput grows with the number of workers.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object.
+        cancel_event (threading.Event): Optional event that stops the run after the current batch once set.
+    """
+    batches = 0
+    while cancel_event is None or not cancel_event.is_set():
+        tickers = claim_tickers(db_engine)
+        if not tickers:
+            break
+        batches += 1
+        logging.info(f"Claimed {len(tickers)} tickers: {', '.join(tickers)}")
 
-    if debug:
-        logging.info(f"Debugging mode enabled. Loading data from '{csv_file}'...")
         try:
-            # Load data from the CSV file
-            df = pd.read_csv(csv_file)
+            succeeded, failed, unprocessed = process_ticker_batch(db_engine, tickers, cancel_event)
+        except Exception as e:
+            logging.error(f"Batch failed: {e}")
+            mark_run_failed("Ticker batch failed")
+            succeeded, failed, unprocessed = {}, {ticker: str(e) for ticker in tickers}, []
+
+        complete_tickers(db_engine, succeeded, failed)
+        if unprocessed:
+            release_tickers(db_engine, unprocessed)
+        increment('tickers_succeeded', len(succeeded))
+        increment('tickers_failed', len(failed))
 
-            # Ensure 'Date' is in datetime format
-            df['Date'] = pd.to_datetime(df['Date'])
-            df['curr_timestamp'] = pd.to_datetime(df['curr_timestamp'])
+    logging.info(f"Ticker queue run finished after {batches} batches.")
 
-            logging.info(f"Data loaded successfully from '{csv_file}':")
+def run_pipeline(debug, streaming, db_engine, tickers, cancel_event=None):
+    """
+    Runs the steps of `fetch_and_process_data`.
+    """
+    csv_file = 'stock_data.csv'  # Former debug input, see `import_csv` in src/storage/parquet_store.py
+    metrics_csv_file = 'agg_stock_data.csv'
+    fingerprints = None
+
+    if debug:
+        logging.info(f"Debugging mode enabled. Loading data from the local store '{LOCAL_STORE_PATH}'...")
+        try:
+            # Replay the data of the configured tickers from the local columnar store
+            df = read_stock_data(tickers=tickers)
+            if df.empty:
+                logging.error(f"Error: no data for {tickers} in '{LOCAL_STORE_PATH}'. Run the pipeline once or "
+                              f"import a CSV file with 'python -m src.storage.parquet_store import-csv {csv_file}'.")
+                mark_run_failed("No data to replay")
+                return
+
+            logging.info(f"Data loaded successfully from '{LOCAL_STORE_PATH}':")
             logging.info(df.head())  # Print a sample of the data for verification
-        except FileNotFoundError:
-            logging.error(f"Error: '{csv_file}' not found. Please ensure the file exists.")
-            return
         except Exception as e:
-            logging.error(f"Error loading data from '{csv_file}': {e}")
+            logging.error(f"Error loading data from '{LOCAL_STORE_PATH}': {e}")
+            mark_run_failed("Local store read failed")
             return
 
     else:
-        all_tickers = []
-
-        for ticker in TICKERS:
-            records=fetch_stock_data(ticker)
-            all_tickers.extend(records)  # Collect data for all tickers
-            time.sleep(12)  # Sleep for 12 seconds to avoid hitting the API rate limit
+        # Plan the fetch from what is already stored in the database
+        fetch_plan, latest_dates = plan_run(db_engine, tickers)
+        if not fetch_plan:
+            logging.info("All tickers are up to date for the last trading session. Nothing to fetch.")
+            return
 
-        if all_tickers:
-            
-            df = pd.DataFrame(all_tickers)
+        # Responses identical to the last ones loaded are dropped before parsing
+        fingerprints = load_response_fingerprints(db_engine, list(fetch_plan))
 
-            # Convert 'Date' to datetime format &  Add current_timestamp column
-            df['Date'] = pd.to_datetime(df['Date'])
-            df['curr_timestamp'] = pd.Timestamp.now().to_datetime64()
-            df['curr_timestamp'] = df['curr_timestamp'].astype('datetime64[ns]')  # Explicitly cast to datetime64[ns]
+        if streaming:
+            try:
+                stream_and_process_data(db_engine or init_db(), fetch_plan, latest_dates, cancel_event=cancel_event,
+                                        fingerprints=fingerprints)
+            except Exception as e:
+                logging.error(f"Streaming run failed: {e}")
+                mark_run_failed("Streaming run failed")
+            return
 
-            # Display all columns in the DataFrame
-            pd.set_option('display.max_columns', None)
-            logging.info(df.head())
+        df = fetch_new_data(fetch_plan, latest_dates, cancel_event, fingerprints)  # Collect data for all tickers
+        if df is None:
+            # Nothing new to load: the fetched responses are fully processed
+            if fingerprints is not None:
+                save_loaded_fingerprints(db_engine, fingerprints)
+            return
 
-        else:
-            logging.warning("No data to display.")
+        if cancel_event is not None and cancel_event.is_set():
+            logging.warning("Run cancelled after fetching. Data not inserted.")
             return
-    
-    # Validate the data
-    is_valid, errors = validate_stock_data(df)
 
-    if not is_valid:
-        logging.error("Data validation failed with the following errors:")
-        for error in errors:
-            logging.error(f"- {error}")
-        return  # Stop further processing if validation fails
-    
+    # Validate before connecting, so that invalid data never reaches the database or the metrics
+    df, rejected_df = validate_stock_rows(df)
+    if df is None:
+        return
+
+    if debug:
+        # Compute the metrics of the valid rows in process so that they are available without a database
+        metrics_df = compute_stock_metrics(df)
+        metrics_df.to_csv(metrics_csv_file, index=False)
+        logging.info(f"Metrics computed in process and saved to '{metrics_csv_file}':")
+        logging.info(metrics_df.tail())
+
     # Initialize the database and create tables
     try:
-        db_engine = init_db()
-        insert_raw_data_with_cdc(db_engine, df)
-        aggregate_stock_data(db_engine)
-        logging.info("Data successfully processed and inserted into the database.")
+        db_engine = db_engine or init_db()
+        if load_valid_rows(db_engine, df, rejected_df):
+            logging.info("Data successfully processed and inserted into the database.")
+            save_loaded_fingerprints(db_engine, fingerprints)
     except Exception as e:
         logging.error("Database connection failed. Data not inserted.")
-
+        mark_run_failed("Database connection failed")
 
 if __name__ == "__main__":
-    fetch_and_process_data(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the stock data pipeline once.")
+    parser.add_argument('--live', action='store_true', help="Fetch from the API instead of replaying the local store.")
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=PIPELINE_PROFILE or None,
+                        help="Profile this run with cProfile or tracemalloc.")
+    args = parser.parse_args()
+
+    fetch_and_process_data(debug=not args.live, profile=args.profile)
\ No newline at end of file
@@ -0,0 +1,361 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from dotenv import load_dotenv
+import numpy as np
+import threading
+import json
+import time
+import uuid
+import os
+import logging
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Metrics export configuration
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")  # Run summaries and the Prometheus text file are written here
+PIPELINE_PROFILE = os.getenv("PIPELINE_PROFILE", "")  # cprofile, tracemalloc or empty to disable
+
+# Upper bounds (seconds) of the API latency histogram buckets
+API_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PROFILE_MODES = ['cprofile', 'tracemalloc']
+
+
+class RunMetrics:
+    """
+    Thread-safe collector of the metrics of one pipeline run.
+
+    Stages accumulate their wall time, number of calls and rows in/out, so a stage that runs once
+    per ticker or per batch (e.g. 'fetch') is reported as a total. Counters hold single numbers
+    such as API retries or rows changed by the merge. A step that fails without raising (e.g. a
+    merge that rolled back) records it with `fail`, and the run then ends as 'failed'.
+    """
+
+    def __init__(self, run_id=None, job='pipeline'):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.job = job
+        self.started_at = datetime.now()
+        self.finished_at = None
+        self.status = 'running'
+        self.stages = {}
+        self.counters = {}
+        self.api_latencies = []
+        self.failures = []
+        self._start_time = time.perf_counter()
+        self._duration = None
+        self._lock = threading.Lock()
+
+    def record_stage(self, name, seconds, rows_in=None, rows_out=None):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            stage['rows_in'] += rows_in or 0
+            stage['rows_out'] += rows_out or 0
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_api_latency(self, seconds):
+        with self._lock:
+            self.api_latencies.append(seconds)
+
+    def fail(self, reason):
+        with self._lock:
+            self.failures.append(reason)
+
+    def finish(self, status='success'):
+        self.status = status
+        self.finished_at = datetime.now()
+        self._duration = time.perf_counter() - self._start_time
+
+    def summary(self):
+        """
+        Returns the metrics of the run as a JSON-serializable dict.
+        """
+        with self._lock:
+            latencies = np.array(self.api_latencies, dtype=np.float64)
+            counts = np.searchsorted(np.sort(latencies), API_LATENCY_BUCKETS, side='right')
+            return {
+                'run_id': self.run_id,
+                'job': self.job,
+                'status': self.status,
+                'started_at': self.started_at.isoformat(),
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+                'duration_seconds': self._duration if self._duration is not None else time.perf_counter() - self._start_time,
+                'max_rss_bytes': max_rss_bytes(),
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+                'failures': list(self.failures),
+                'cache_hit_rates': cache_hit_rates(self.counters),
+                'api_latency': {
+                    'count': int(latencies.size),
+                    'sum': float(latencies.sum()),
+                    'p50': float(np.percentile(latencies, 50)) if latencies.size else None,
+                    'p95': float(np.percentile(latencies, 95)) if latencies.size else None,
+                    'max': float(latencies.max()) if latencies.size else None,
+                    'buckets': {str(bound): int(count) for bound, count in zip(API_LATENCY_BUCKETS, counts)},
+                },
+            }
+
+
+def cache_hit_rates(counters):
+    """
+    Returns the hit rate of every cache counted with a `<cache>_hits` and a `<cache>_misses` counter.
+
+    Caches that were not looked up during the run are left out.
+    """
+    rates = {}
+    for name, hits in counters.items():
+        if name.endswith('_hits'):
+            cache = name[:-len('_hits')]
+            lookups = hits + counters.get(f'{cache}_misses', 0)
+            if lookups:
+                rates[cache] = hits / lookups
+    return rates
+
+
+def max_rss_bytes():
+    """
+    Returns the peak resident set size of the process in bytes, or None if it is not available.
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Reported in KiB on Linux
+
+
+# Metrics of the run in progress. Each run (e.g. concurrent scheduler jobs) sets its own collector in
+# its context. Calls outside of a run are collected in the default one and never exported.
+_current_run = ContextVar('current_run', default=RunMetrics())
+
+
+def get_run_metrics():
+    """
+    Returns the metrics collector of the current run.
+    """
+    return _current_run.get()
+
+
+class StageRecord:
+    """
+    Rows counted by the code inside a `stage` block.
+    """
+
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Times a pipeline stage and records it in the current run.
+
+    The block can set `rows_out` (and `rows_in` if it is not known upfront) on the yielded record.
+    The stage is recorded even if the block raises.
+
+    Args:
+        name (str): The name of the stage, e.g. 'fetch' or 'merge'.
+        rows_in (int): The number of rows entering the stage.
+    """
+    record = StageRecord(rows_in)
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        get_run_metrics().record_stage(name, time.perf_counter() - start_time, record.rows_in, record.rows_out)
+
+
+def increment(name, value=1):
+    """
+    Adds `value` to a counter of the current run.
+    """
+    get_run_metrics().increment(name, value)
+
+
+def observe_api_latency(seconds):
+    """
+    Records the latency of one API call in the current run.
+    """
+    get_run_metrics().observe_api_latency(seconds)
+
+
+def mark_run_failed(reason):
+    """
+    Marks the current run as failed because of a step that reported its failure instead of raising.
+    """
+    get_run_metrics().fail(reason)
+
+
+def prometheus_text(summary):
+    """
+    Renders a run summary in the Prometheus text exposition format.
+
+    Args:
+        summary (dict): A run summary as returned by `RunMetrics.summary`.
+
+    Returns:
+        str: The metrics, one sample per line.
+    """
+    lines = []
+
+    def label_text(labels):
+        return ",".join(f'{key}="{label}"' for key, label in {'job': summary['job'], **labels}.items())
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP stock_pipeline_{name} {help_text}")
+        lines.append(f"# TYPE stock_pipeline_{name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"stock_pipeline_{name}{{{label_text(labels)}}} {value}")
+
+    metric('last_run_timestamp_seconds', 'gauge', "Time the last run finished.",
+           [({}, datetime.fromisoformat(summary['finished_at'] or summary['started_at']).timestamp())])
+    metric('last_run_success', 'gauge', "1 if the last run succeeded, 0 otherwise.",
+           [({}, int(summary['status'] == 'success'))])
+    metric('last_run_duration_seconds', 'gauge', "Wall time of the last run.", [({}, summary['duration_seconds'])])
+    if summary['max_rss_bytes'] is not None:
+        metric('max_rss_bytes', 'gauge', "Peak resident set size of the process.", [({}, summary['max_rss_bytes'])])
+
+    stages = summary['stages']
+    for field, help_text in [('seconds', "Wall time spent in the stage during the last run."),
+                             ('calls', "Number of times the stage ran during the last run."),
+                             ('rows_in', "Rows entering the stage during the last run."),
+                             ('rows_out', "Rows leaving the stage during the last run.")]:
+        metric(f'stage_{field}', 'gauge', help_text, [({'stage': name}, stage[field]) for name, stage in stages.items()])
+
+    for name, value in summary['counters'].items():
+        metric(name, 'gauge', f"Value of the '{name}' counter during the last run.", [({}, value)])
+
+    hit_rates = summary.get('cache_hit_rates', {})
+    if hit_rates:
+        metric('cache_hit_ratio', 'gauge', "Share of the cache lookups of the last run that were hits.",
+               [({'cache': cache}, rate) for cache, rate in hit_rates.items()])
+
+    latency = summary['api_latency']
+    samples = [({'le': bound}, count) for bound, count in latency['buckets'].items()] + [({'le': '+Inf'}, latency['count'])]
+    lines.append("# HELP stock_pipeline_api_latency_seconds Latency of the API calls of the last run.")
+    lines.append("# TYPE stock_pipeline_api_latency_seconds histogram")
+    for labels, value in samples:
+        lines.append(f"stock_pipeline_api_latency_seconds_bucket{{{label_text(labels)}}} {value}")
+    lines.append(f"stock_pipeline_api_latency_seconds_sum{{{label_text({})}}} {latency['sum']}")
+    lines.append(f"stock_pipeline_api_latency_seconds_count{{{label_text({})}}} {latency['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def export_run_metrics(summary, metrics_dir=METRICS_DIR):
+    """
+    Writes a run summary as JSON and as a Prometheus text file.
+
+    `run_summary.json` and `stock_pipeline.prom` hold the last run (the .prom file can be read by the
+    node_exporter textfile collector), and `run_history.jsonl` gets one line per run. Jobs other than
+    'pipeline' (see `src/scheduler/scheduler.py`) write their last run to `run_summary_<job>.json`
+    and `stock_pipeline_<job>.prom`.
+
+    Args:
+        summary (dict): A run summary as returned by `RunMetrics.summary`.
+        metrics_dir (str): The output directory. Defaults to METRICS_DIR.
+    """
+    suffix = "" if summary['job'] == 'pipeline' else f"_{summary['job']}"
+    os.makedirs(metrics_dir, exist_ok=True)
+    write_atomically(os.path.join(metrics_dir, f"run_summary{suffix}.json"), json.dumps(summary, indent=2))
+    write_atomically(os.path.join(metrics_dir, f"stock_pipeline{suffix}.prom"), prometheus_text(summary))
+    with open(os.path.join(metrics_dir, 'run_history.jsonl'), 'a') as f:
+        f.write(json.dumps(summary) + "\n")
+
+
+@contextmanager
+def profile_run(mode, output_prefix):
+    """
+    Profiles the enclosed block with cProfile or tracemalloc.
+
+    'cprofile' dumps the stats to `<output_prefix>.prof` (open them with `pstats` or snakeviz).
+    'tracemalloc' writes the peak traced memory and the top allocation sites to
+    `<output_prefix>.tracemalloc.txt`.
+
+    Args:
+        mode (str): 'cprofile', 'tracemalloc', or an empty value to disable profiling.
+        output_prefix (str): The path of the output files, without extension.
+    """
+    if not mode:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Invalid profile mode: {mode}. Must be one of {PROFILE_MODES}.")
+
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{output_prefix}.prof")
+            logging.info(f"cProfile stats written to '{output_prefix}.prof'.")
+    else:
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(f"{output_prefix}.tracemalloc.txt", 'w') as f:
+                f.write(f"Peak traced memory: {peak / 2**20:.1f} MiB\n\n")
+                for stat in snapshot.statistics('lineno')[:25]:
+                    f.write(f"{stat}\n")
+            get_run_metrics().increment('tracemalloc_peak_bytes', peak)
+            logging.info(f"tracemalloc report written to '{output_prefix}.tracemalloc.txt'.")
+
+
+@contextmanager
+def instrumented_run(profile=PIPELINE_PROFILE, metrics_dir=METRICS_DIR, job='pipeline'):
+    """
+    Collects the metrics of one pipeline run and exports them when it ends.
+
+    The run ends as 'failed' if an exception escapes it or a step marked it with `mark_run_failed`.
+
+    Args:
+        profile (str): Optional profiler for the run, 'cprofile' or 'tracemalloc'. Defaults to PIPELINE_PROFILE.
+        metrics_dir (str): The output directory. Defaults to METRICS_DIR.
+        job (str): The name of the scheduler job running, added to the exported metrics.
+
+    Yields:
+        RunMetrics: The metrics collector of the run.
+    """
+    metrics = RunMetrics(job=job)
+    token = _current_run.set(metrics)
+    status = 'failed'
+    try:
+        if profile:
+            os.makedirs(metrics_dir, exist_ok=True)
+        with profile_run(profile, os.path.join(metrics_dir, f"profile_{metrics.run_id}")):
+            yield metrics
+        status = 'failed' if metrics.failures else 'success'
+    finally:
+        metrics.finish(status)
+        summary = metrics.summary()
+        try:
+            export_run_metrics(summary, metrics_dir)
+        except OSError as e:
+            logging.error(f"Could not export the run metrics to '{metrics_dir}': {e}")
+        _current_run.reset(token)
+        logging.info(f"Run {metrics.run_id} of job '{job}' finished ({status}) in {summary['duration_seconds']:.2f} seconds: "
+                     + ", ".join(f"{name} {stage['seconds']:.2f}s" for name, stage in summary['stages'].items())
+                     + "".join(f", {cache} hit rate {rate:.0%}" for cache, rate in summary['cache_hit_rates'].items()))
@@ -0,0 +1,112 @@
+import threading
+import time
+import os
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# API quota configuration (defaults match the Alpha Vantage free tier: 5 calls per minute)
+API_CALLS_PER_MINUTE = float(os.getenv("API_CALLS_PER_MINUTE", 5))
+API_CALLS_PER_DAY = float(os.getenv("API_CALLS_PER_DAY", 0))  # 0 disables the daily cap
+API_BURST = float(os.getenv("API_BURST", 1))  # Calls allowed back to back before throttling kicks in
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens refill continuously at `rate` tokens per second up to `capacity`.
+    Each call to `acquire` consumes one token, blocking until one is available.
+    """
+
+    def __init__(self, rate, capacity, name="bucket"):
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def try_acquire(self):
+        """
+        Consumes a token if one is available.
+
+        Returns:
+            float: 0 if a token was consumed, otherwise the number of seconds until one is available.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Blocks until a token is available and consumes it.
+        """
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Combines a per-minute and an optional per-day token bucket.
+
+    A call is only allowed once both buckets have a token available, so the per-minute
+    bucket smooths the request rate while the per-day bucket enforces the daily quota.
+
+    The buckets live in memory and start full, so the per-day bucket only counts the calls of
+    the current process: a restarted process gets the whole daily quota again, whatever the
+    previous ones already used that day.
+    """
+
+    def __init__(self, calls_per_minute=API_CALLS_PER_MINUTE, calls_per_day=API_CALLS_PER_DAY, burst=API_BURST):
+        self.buckets = [TokenBucket(calls_per_minute / 60.0, max(1, burst), name="per-minute")]
+        if calls_per_day:
+            self.buckets.append(TokenBucket(calls_per_day / 86400.0, calls_per_day, name="per-day"))
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed by every bucket.
+
+        Buckets are acquired one after the other under a single lock, so concurrent callers are
+        served in order. The per-minute token is taken first and held while the call waits for
+        the per-day bucket, which can take hours once the daily quota is used up; every other
+        caller waits on the lock meanwhile.
+        """
+        with self._lock:
+            for bucket in self.buckets:
+                wait = bucket.try_acquire()
+                if wait > 60:
+                    logging.warning(f"API {bucket.name} quota exhausted. Waiting {wait:.0f} seconds for the next call.")
+                if wait:
+                    time.sleep(wait)
+                    bucket.acquire()
+
+
+# Shared limiter used by every fetch in the process
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide rate limiter, creating it on first use.
+    """
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
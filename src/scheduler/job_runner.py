@@ -0,0 +1,106 @@
+import threading
+import random
+import logging
+
+# Policies for a job triggered while its previous run is still in progress
+OVERLAP_POLICIES = ['skip', 'coalesce']
+
+
+class ScheduledJob:
+    """
+    A job that the scheduler runs on a worker pool instead of its own thread.
+
+    A trigger never blocks the scheduler loop. If the previous run is still in progress, the
+    trigger is dropped ('skip') or remembered so that exactly one more run starts as soon as the
+    current one ends ('coalesce'), so runs never pile up back to back.
+
+    Each run gets a `threading.Event` that the job function must check at safe points (between
+    API calls, before opening a transaction) and return when it is set. The event is set when the
+    run exceeds its timeout or when the scheduler shuts down; Python threads cannot be killed, so
+    the timeout is cooperative.
+    """
+
+    def __init__(self, name, func, executor, timeout=0, jitter=0, overlap='skip'):
+        """
+        Args:
+            name (str): The name of the job, used in the logs.
+            func (callable): The job function. It receives the cancel event of the run.
+            executor (concurrent.futures.Executor): The worker pool running the job.
+            timeout (float): Seconds after which a run is asked to stop (0 disables it).
+            jitter (float): Maximum random delay in seconds before a run starts, to spread the load.
+            overlap (str): 'skip' or 'coalesce', see above.
+        """
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError(f"Invalid overlap policy for job '{name}': {overlap}. Must be one of {OVERLAP_POLICIES}.")
+        self.name = name
+        self.func = func
+        self.executor = executor
+        self.timeout = timeout
+        self.jitter = jitter
+        self.overlap = overlap
+        self.skipped_runs = 0
+        self._running = False
+        self._pending = False
+        self._cancel_event = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def trigger(self):
+        """
+        Submits a run of the job to the worker pool unless a run is already in progress.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            if self._running:
+                self.skipped_runs += 1
+                if self.overlap == 'coalesce':
+                    self._pending = True
+                    logging.warning(f"Job '{self.name}' is still running. The next run starts when it ends.")
+                else:
+                    logging.warning(f"Job '{self.name}' is still running. Skipping this run.")
+                return
+            self._running = True
+            self._cancel_event = threading.Event()
+            cancel_event = self._cancel_event
+        self.executor.submit(self._run, cancel_event)
+
+    def _run(self, cancel_event):
+        timer = None
+        try:
+            # Spread the start of the jobs; the delay is cut short by a shutdown
+            if self.jitter and cancel_event.wait(random.uniform(0, self.jitter)):
+                return
+
+            if self.timeout:
+                timer = threading.Timer(self.timeout, self._time_out, args=(cancel_event,))
+                timer.daemon = True
+                timer.start()
+
+            logging.info(f"Job '{self.name}' started.")
+            self.func(cancel_event)
+            logging.info(f"Job '{self.name}' finished{' (cancelled)' if cancel_event.is_set() else ''}.")
+        except Exception as e:
+            logging.error(f"Job '{self.name}' failed: {e}")
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self._lock:
+                self._running = False
+                rerun, self._pending = self._pending and not self._closed, False
+            if rerun:
+                self.trigger()
+
+    def _time_out(self, cancel_event):
+        logging.error(f"Job '{self.name}' exceeded its timeout of {self.timeout} seconds. Asking it to stop.")
+        cancel_event.set()
+
+    def close(self):
+        """
+        Stops accepting triggers and asks the run in progress, if any, to stop.
+        """
+        with self._lock:
+            self._closed = True
+            self._pending = False
+            if self._cancel_event is not None:
+                self._cancel_event.set()
@@ -1,9 +1,21 @@
 import schedule
-import time
 import os
+import queue
+import signal
+import threading
 import logging
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from src.main import fetch_and_process_data
+from src.main import fetch_and_process_data, plan_run, fetch_new_data, merge_stock_data
+from src.ingestion_intraday import run_intraday_pipeline
+from src.config.constants import TICKERS
+from src.db.db_operations import init_db, get_db_engine, aggregate_stock_data
+from src.db.stock_metrics import refresh_stock_metrics
+from src.db.ticker_queue import TICKER_SOURCE
+from src.db.response_fingerprints import load_response_fingerprints, save_response_fingerprints
+from src.monitoring.instrumentation import instrumented_run
+from src.scheduler.job_runner import ScheduledJob
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,37 +30,220 @@ logging.basicConfig(
     ]
 )
 
+# Worker pool running the scheduled jobs
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", 3))
+
+VALID_UNITS = ["seconds", "minutes", "hours", "days"]
+
+
+def job_setting(job_name, setting, default):
+    """
+    Reads a job setting from `<JOB>_<SETTING>`, falling back to `JOB_<SETTING>` and then `default`.
+    """
+    return os.getenv(f"{job_name.upper()}_{setting}", os.getenv(f"JOB_{setting}", default))
+
+
+def parse_schedule(value):
+    """
+    Parses a schedule such as '15 minutes' into an interval and a unit.
+    """
+    try:
+        interval, unit = value.split()
+        interval, unit = int(interval), unit.lower()
+    except ValueError:
+        raise ValueError(f"Invalid schedule: '{value}'. Expected '<interval> <unit>', e.g. '15 minutes'.")
+    if unit not in VALID_UNITS:
+        logging.error(f"Invalid schedule unit: {unit}. Must be one of {VALID_UNITS}.")
+        raise ValueError(f"Invalid schedule unit: {unit}. Must be one of {VALID_UNITS}.")
+    return interval, unit
+
+
+class StagedPipeline:
+    """
+    The pipeline split into fetch, merge and aggregation jobs that run on their own schedules.
+
+    Fetched rows are handed to the merge job through an in-process queue, and the change sets of
+    the merges are accumulated until the next aggregation run.
+    """
+
+    def __init__(self, db_engine, tickers=None):
+        self.db_engine = db_engine
+        self.tickers = tickers or TICKERS
+        self.fetched = queue.Queue()
+        self._pending_aggregation = {}  # Ticker -> earliest changed date not aggregated yet
+        self._lock = threading.Lock()
+
+    def fetch(self, cancel_event):
+        """
+        Fetches the new rows of every ticker and queues them for the merge job.
+        """
+        with instrumented_run(job='fetch'):
+            fetch_plan, latest_dates = plan_run(self.db_engine, self.tickers)
+            if not fetch_plan:
+                logging.info("All tickers are up to date for the last trading session. Nothing to fetch.")
+                return
+            fingerprints = load_response_fingerprints(self.db_engine, list(fetch_plan))
+            df = fetch_new_data(fetch_plan, latest_dates, cancel_event, fingerprints)
+            entries = fingerprints.take() if fingerprints is not None else {}
+            if df is not None:
+                # The fingerprints are saved by the merge job once the rows are loaded
+                self.fetched.put((df, entries))
+                logging.info(f"{len(df)} fetched rows queued for the merge job.")
+            else:
+                save_response_fingerprints(self.db_engine, entries)
+
+    def merge(self, cancel_event):
+        """
+        Validates and merges every queued batch of fetched rows.
+        """
+        frames, fingerprints = [], {}
+        while True:
+            try:
+                df, entries = self.fetched.get_nowait()
+            except queue.Empty:
+                break
+            frames.append(df)
+            fingerprints.update(entries)
+        if not frames:
+            logging.info("No fetched rows to merge.")
+            return
+
+        with instrumented_run(job='merge'):
+            # A ticker fetched again before the previous batch was merged appears twice: keep the latest fetch
+            df = pd.concat(frames, ignore_index=True).drop_duplicates(['Date', 'Ticker'], keep='last', ignore_index=True)
+            changes = merge_stock_data(self.db_engine, df)
+            if changes is None:
+                return
+            save_response_fingerprints(self.db_engine, fingerprints)
+            with self._lock:
+                for ticker, since_date in changes.items():
+                    self._pending_aggregation[ticker] = min(since_date, self._pending_aggregation.get(ticker, since_date))
+
+    def aggregate(self, cancel_event):
+        """
+        Refreshes the aggregated and catalog metrics of the rows changed by the merges since the last aggregation.
+        """
+        with self._lock:
+            pending, self._pending_aggregation = self._pending_aggregation, {}
+        if not pending:
+            logging.info("No merged rows to aggregate.")
+            return
+
+        with instrumented_run(job='aggregation'):
+            if not (aggregate_stock_data(self.db_engine, changes=pending)
+                    and refresh_stock_metrics(self.db_engine, changes=pending)):
+                # Keep the tickers for the next run
+                with self._lock:
+                    for ticker, since_date in pending.items():
+                        self._pending_aggregation[ticker] = min(since_date, self._pending_aggregation.get(ticker, since_date))
+
+
+def schedule_job(job, interval, unit):
+    getattr(schedule.every(interval), unit).do(job.trigger)
+    logging.info(f"Job '{job.name}' scheduled every {interval} {unit} (timeout {job.timeout or 'none'}, "
+                 f"jitter {job.jitter}s, overlap '{job.overlap}').")
+
+
+def make_job(name, func, executor):
+    return ScheduledJob(
+        name, func, executor,
+        timeout=float(job_setting(name, "TIMEOUT_SECONDS", 0)),
+        jitter=float(job_setting(name, "JITTER_SECONDS", 0)),
+        overlap=job_setting(name, "OVERLAP", "skip").lower(),
+    )
+
+
 def start_scheduler():
     """
     Starts the scheduler based on environment variables.
+
+    By default the whole pipeline runs as one job every SCHEDULE_INTERVAL SCHEDULE_UNIT. If
+    FETCH_SCHEDULE is set (e.g. '15 minutes'), fetch, merge and aggregation run as separate jobs
+    instead, on FETCH_SCHEDULE, MERGE_SCHEDULE and AGGREGATION_SCHEDULE (each defaulting to the
+    previous one). If INTRADAY_SCHEDULE is set, the intraday bars are loaded by an extra job on
+    that schedule.
+
+    Jobs run on a pool of SCHEDULER_MAX_WORKERS threads, so a long run never blocks the loop. A job
+    triggered while it is still running is skipped or coalesced (`<JOB>_OVERLAP` or JOB_OVERLAP),
+    and each job can have a timeout (`<JOB>_TIMEOUT_SECONDS`) and a random start delay
+    (`<JOB>_JITTER_SECONDS`). On SIGTERM or SIGINT, no new run starts, the runs in progress are
+    asked to stop at their next safe point and the scheduler waits for them before exiting.
     """
     # Fetch the scheduling interval and unit from environment variables
     schedule_interval = int(os.getenv("SCHEDULE_INTERVAL", 24))  # Default to 24
     schedule_unit = os.getenv("SCHEDULE_UNIT", "hours").lower()  # Default to "hours"
+    fetch_schedule = os.getenv("FETCH_SCHEDULE")
 
     # Validate the schedule unit
-    valid_units = ["seconds", "minutes", "hours", "days"]
-    if schedule_unit not in valid_units:
-        logging.error(f"Invalid SCHEDULE_UNIT: {schedule_unit}. Must be one of {valid_units}.")
-        raise ValueError(f"Invalid SCHEDULE_UNIT: {schedule_unit}. Must be one of {valid_units}.")
-
-    # Dynamically schedule the task based on the interval and unit
-    if schedule_unit == "seconds":
-        schedule.every(schedule_interval).seconds.do(fetch_and_process_data, debug=False)
-    elif schedule_unit == "minutes":
-        schedule.every(schedule_interval).minutes.do(fetch_and_process_data, debug=False)
-    elif schedule_unit == "hours":
-        schedule.every(schedule_interval).hours.do(fetch_and_process_data, debug=False)
-    elif schedule_unit == "days":
-        schedule.every(schedule_interval).days.do(fetch_and_process_data, debug=False)
-
-    logging.info(f"Scheduler started. Running every {schedule_interval} {schedule_unit}.")
-
-    # Run the task immediately on startup
-    logging.info("Running the task immediately on startup...")
-    fetch_and_process_data(debug=False)
+    if schedule_unit not in VALID_UNITS:
+        logging.error(f"Invalid SCHEDULE_UNIT: {schedule_unit}. Must be one of {VALID_UNITS}.")
+        raise ValueError(f"Invalid SCHEDULE_UNIT: {schedule_unit}. Must be one of {VALID_UNITS}.")
+
+    # Create the engine once: every run reuses the same connection pool. The tables are created by the
+    # first run that uses them, so a database unreachable at startup only fails the runs until it is back.
+    db_engine = get_db_engine()
+    try:
+        init_db()
+    except Exception as e:
+        logging.error(f"Database connection failed at startup: {e}. Every run retries it.")
+
+    executor = ThreadPoolExecutor(max_workers=SCHEDULER_MAX_WORKERS, thread_name_prefix="job")
+    shutdown_event = threading.Event()
+
+    def request_shutdown(signum, frame):
+        logging.info(f"Received signal {signum}. Shutting down the scheduler...")
+        shutdown_event.set()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    if fetch_schedule and TICKER_SOURCE == 'queue':
+        logging.error("FETCH_SCHEDULE cannot be used with TICKER_SOURCE=queue.")
+        raise ValueError("FETCH_SCHEDULE cannot be used with TICKER_SOURCE=queue: claimed tickers are processed as one job.")
+
+    if fetch_schedule:
+        merge_schedule = os.getenv("MERGE_SCHEDULE", fetch_schedule)
+        aggregation_schedule = os.getenv("AGGREGATION_SCHEDULE", merge_schedule)
+        pipeline = StagedPipeline(db_engine)
+        jobs = [
+            (make_job("fetch", pipeline.fetch, executor), parse_schedule(fetch_schedule)),
+            (make_job("merge", pipeline.merge, executor), parse_schedule(merge_schedule)),
+            (make_job("aggregation", pipeline.aggregate, executor), parse_schedule(aggregation_schedule)),
+        ]
+    else:
+        def run_pipeline_job(cancel_event):
+            fetch_and_process_data(debug=False, db_engine=db_engine, cancel_event=cancel_event)
+
+        jobs = [(make_job("pipeline", run_pipeline_job, executor), (schedule_interval, schedule_unit))]
+
+    intraday_schedule = os.getenv("INTRADAY_SCHEDULE")
+    if intraday_schedule:
+        def run_intraday_job(cancel_event):
+            run_intraday_pipeline(db_engine=db_engine, cancel_event=cancel_event)
+
+        jobs.append((make_job("intraday", run_intraday_job, executor), parse_schedule(intraday_schedule)))
+
+    for job, (interval, unit) in jobs:
+        schedule_job(job, interval, unit)
+
+    logging.info("Scheduler started.")
+
+    # Run the jobs immediately on startup
+    logging.info("Running the jobs immediately on startup...")
+    for job, _ in jobs:
+        job.trigger()
 
     # Keep the script running to execute scheduled jobs
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
\ No newline at end of file
+    try:
+        while not shutdown_event.is_set():
+            schedule.run_pending()
+            shutdown_event.wait(1)
+    finally:
+        # Stop the runs in progress at their next safe point. Their transactions either commit or
+        # roll back, and the TEMP staging tables are dropped with them.
+        for job, _ in jobs:
+            job.close()
+        schedule.clear()
+        executor.shutdown(wait=True)
+        db_engine.dispose()
+        logging.info("Scheduler stopped.")
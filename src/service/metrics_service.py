@@ -0,0 +1,384 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from collections import OrderedDict
+from datetime import date
+from sqlalchemy import text
+from dotenv import load_dotenv
+from src.db.db_operations import init_db, AGG_COLUMNS
+from src.db.schema import ensure_refresh_log
+from src.monitoring.instrumentation import cache_hit_rates
+import argparse
+import threading
+import json
+import math
+import time
+import os
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler("metrics_service.log", mode="a")
+    ]
+)
+
+# Read service configuration
+SERVICE_CACHE_SIZE = int(os.getenv("SERVICE_CACHE_SIZE", 1024))  # Cached query results kept in memory
+SERVICE_CACHE_TTL_SECONDS = float(os.getenv("SERVICE_CACHE_TTL_SECONDS", 300))  # Longest time a result is served from memory
+SERVICE_POLL_SECONDS = float(os.getenv("SERVICE_POLL_SECONDS", 5))  # Interval between checks of the refresh log
+SERVICE_REFRESH_GAP_SECONDS = float(os.getenv("SERVICE_REFRESH_GAP_SECONDS", 3600))  # Longest wait for a skipped refresh id to commit
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", 8080))
+
+
+class MetricsCache:
+    """
+    Thread-safe LRU cache of query results with a time to live.
+
+    Every entry records the tickers it was read from (None for a result that depends on every
+    ticker), so that a refresh of the aggregated table only evicts the results it made stale.
+    """
+
+    def __init__(self, max_size=SERVICE_CACHE_SIZE, ttl=SERVICE_CACHE_TTL_SECONDS):
+        """
+        Args:
+            max_size (int): The maximum number of entries. The least recently used one is evicted first.
+            ttl (float): Seconds after which an entry expires (0 disables the expiry).
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.counters = {'service_cache_hits': 0, 'service_cache_misses': 0}
+        self.generation = 0  # Incremented by every invalidation
+        self._entries = OrderedDict()  # Key -> (expiry time, tickers, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value of `key`, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (not self.ttl or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.counters['service_cache_hits'] += 1
+                return entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self.counters['service_cache_misses'] += 1
+            return None
+
+    def put(self, key, value, tickers=None, generation=None):
+        """
+        Caches a value read from `tickers` (every ticker by default).
+
+        A value read before an invalidation may predate the refresh that caused it, so it is not
+        cached if the `generation` the read started at is not the current one anymore.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, None if tickers is None else frozenset(tickers), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tickers=None):
+        """
+        Evicts the entries read from any of `tickers`, and the ones that depend on every ticker.
+
+        Args:
+            tickers (list): The refreshed tickers. Defaults to every ticker, which clears the cache.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        with self._lock:
+            if tickers is None:
+                stale = list(self._entries)
+            else:
+                tickers = set(tickers)
+                stale = [key for key, (_, depends_on, _) in self._entries.items()
+                         if depends_on is None or not depends_on.isdisjoint(tickers)]
+            for key in stale:
+                del self._entries[key]
+            self.generation += 1
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                **self.counters,
+                'hit_rate': cache_hit_rates(self.counters).get('service_cache'),
+            }
+
+
+def row_to_dict(row):
+    """
+    Converts a row of the aggregated table to a JSON-friendly dict, with NaN metrics as None.
+    """
+    return {column: None if isinstance(value, float) and math.isnan(value) else value
+            for column, value in row._mapping.items()}
+
+
+class MetricsService:
+    """
+    Read API of the aggregated metrics, served from memory when possible.
+
+    Query results are cached in a `MetricsCache`. The cache is invalidated from the refresh log
+    of the aggregated table, which every committed aggregation appends the tickers it refreshed
+    to: before answering, the service reads the entries added since its last check (at most every
+    SERVICE_POLL_SECONDS) and evicts the results of exactly those tickers. Refresh ids are taken
+    when an aggregation inserts its entry, not when it commits, so an id skipped by a check may
+    still show up later: skipped ids are checked again until they appear or SERVICE_REFRESH_GAP_SECONDS
+    have passed (the id of a rolled back aggregation never does). An aggregation
+    rewrites the table in a single transaction, so every query sees the last committed version
+    of the metrics, including while a full rebuild is running.
+    """
+
+    def __init__(self, db_engine=None, table_name='agg_stock_data', cache=None, poll_seconds=SERVICE_POLL_SECONDS):
+        """
+        Args:
+            db_engine (sqlalchemy.engine.Engine): The SQLAlchemy database engine object, or None to create it.
+            table_name (str): The name of the aggregated table.
+            cache (MetricsCache): The result cache. Defaults to a new cache of the configured size and TTL.
+            poll_seconds (float): Seconds between two checks of the refresh log.
+        """
+        self.db_engine = db_engine or init_db()
+        self.table_name = table_name
+        self.refresh_table_name = f"{table_name}_refreshes"
+        self.cache = cache or MetricsCache()
+        self.poll_seconds = poll_seconds
+        self._last_refresh_id = None
+        self._missing_refresh_ids = {}  # Skipped refresh id -> time it was first missed
+        self._next_poll = 0
+        self._poll_lock = threading.Lock()
+
+    def poll_refreshes(self, force=False):
+        """
+        Evicts the cached results of the tickers refreshed since the last check of the refresh log.
+
+        Args:
+            force (bool): Check the refresh log even if the last check is more recent than `poll_seconds`.
+        """
+        if not force and time.monotonic() < self._next_poll:
+            return
+        with self._poll_lock:
+            if not force and time.monotonic() < self._next_poll:
+                return
+            try:
+                with self.db_engine.connect() as conn:
+                    ensure_refresh_log(conn, self.refresh_table_name)
+                    conn.commit()
+                    if self._last_refresh_id is None:
+                        # Nothing is cached yet: start from the latest refresh
+                        self._last_refresh_id = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {self.refresh_table_name}")).scalar()
+                        refreshes = []
+                    else:
+                        refreshes = conn.execute(text(f"""
+                            SELECT id, tickers FROM {self.refresh_table_name}
+                            WHERE id > :last_id OR id = ANY(CAST(:missing_ids AS BIGINT[]))
+                            ORDER BY id
+                        """), {'last_id': self._last_refresh_id, 'missing_ids': list(self._missing_refresh_ids)}).all()
+            except Exception as e:
+                # Keep serving the cache; it expires with the TTL if the database stays unreachable
+                logging.warning(f"Could not read the refresh log of '{self.table_name}': {e}")
+                return
+            now = time.monotonic()
+            for refresh_id, tickers in refreshes:
+                evicted = self.cache.invalidate(tickers)
+                if refresh_id > self._last_refresh_id:
+                    # The ids in between belong to aggregations that have not committed yet, or rolled back
+                    for missing_id in range(self._last_refresh_id + 1, refresh_id):
+                        self._missing_refresh_ids[missing_id] = now
+                    self._last_refresh_id = refresh_id
+                self._missing_refresh_ids.pop(refresh_id, None)
+                logging.info(f"Refresh {refresh_id} of '{self.table_name}' "
+                             f"({'every ticker' if tickers is None else f'{len(tickers)} tickers'}): {evicted} cached results evicted.")
+            self._missing_refresh_ids = {missing_id: missed_at for missing_id, missed_at in self._missing_refresh_ids.items()
+                                         if now - missed_at < SERVICE_REFRESH_GAP_SECONDS}
+            self._next_poll = time.monotonic() + self.poll_seconds
+
+    def latest_metrics(self, tickers=None):
+        """
+        Returns the metrics of the latest date of every ticker.
+
+        Args:
+            tickers (list): The tickers to return. Defaults to every ticker of the table.
+
+        Returns:
+            dict: The row of the latest date per ticker, as a dict of column values. Tickers
+                without aggregated metrics are left out.
+        """
+        self.poll_refreshes()
+        if tickers is None:
+            key = ('latest',)
+            rows = self.cache.get(key)
+            if rows is None:
+                generation = self.cache.generation
+                rows = self._read_latest()
+                self.cache.put(key, rows, generation=generation)
+            return dict(rows)
+
+        latest, missing = {}, []
+        for ticker in dict.fromkeys(tickers):
+            row = self.cache.get(('latest', ticker))
+            if row is None:
+                missing.append(ticker)
+            elif row:
+                latest[ticker] = row
+        if missing:
+            generation = self.cache.generation
+            rows = self._read_latest(missing)
+            for ticker in missing:
+                # An empty dict caches that the ticker has no metrics
+                self.cache.put(('latest', ticker), rows.get(ticker, {}), tickers=[ticker], generation=generation)
+            latest.update(rows)
+        return latest
+
+    def metrics_between(self, ticker, start_date=None, end_date=None):
+        """
+        Returns the metrics of a ticker between two dates, in date order.
+
+        Args:
+            ticker (str): The stock ticker symbol.
+            start_date (datetime.date): The first date to return. Defaults to the first stored date.
+            end_date (datetime.date): The last date to return. Defaults to the latest stored date.
+
+        Returns:
+            list: The rows of the ticker, as dicts of column values.
+        """
+        self.poll_refreshes()
+        key = ('between', ticker, start_date, end_date)
+        rows = self.cache.get(key)
+        if rows is None:
+            generation = self.cache.generation
+            filters, params = ["ticker = :ticker"], {'ticker': ticker}
+            if start_date is not None:
+                filters.append("date >= :start_date")
+                params['start_date'] = start_date
+            if end_date is not None:
+                filters.append("date <= :end_date")
+                params['end_date'] = end_date
+            with self.db_engine.connect() as conn:
+                result = conn.execute(text(f"""
+                    SELECT {', '.join(AGG_COLUMNS)} FROM {self.table_name} WHERE {' AND '.join(filters)} ORDER BY date
+                """), params)
+                rows = [row_to_dict(row) for row in result]
+            self.cache.put(key, rows, tickers=[ticker], generation=generation)
+        return list(rows)
+
+    def _read_latest(self, tickers=None):
+        """
+        Reads the row of the latest date of `tickers` (every ticker by default) from the database.
+        """
+        with self.db_engine.connect() as conn:
+            if tickers is None:
+                # Walk the distinct tickers through the primary key instead of sorting the whole table
+                result = conn.execute(text(f"""
+                    WITH RECURSIVE tickers AS (
+                        SELECT MIN(ticker) AS ticker FROM {self.table_name}
+                        UNION ALL
+                        SELECT (SELECT MIN(ticker) FROM {self.table_name} WHERE ticker > t.ticker)
+                        FROM tickers t
+                        WHERE t.ticker IS NOT NULL
+                    )
+                    SELECT l.*
+                    FROM tickers t
+                    CROSS JOIN LATERAL (
+                        SELECT {', '.join(AGG_COLUMNS)} FROM {self.table_name} a
+                        WHERE a.ticker = t.ticker
+                        ORDER BY a.date DESC
+                        LIMIT 1
+                    ) l
+                """))
+            else:
+                result = conn.execute(text(f"""
+                    SELECT l.*
+                    FROM unnest(CAST(:tickers AS TEXT[])) AS t(ticker)
+                    CROSS JOIN LATERAL (
+                        SELECT {', '.join(AGG_COLUMNS)} FROM {self.table_name} a
+                        WHERE a.ticker = t.ticker
+                        ORDER BY a.date DESC
+                        LIMIT 1
+                    ) l
+                """), {'tickers': list(tickers)})
+            return {row.ticker: row_to_dict(row) for row in result}
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON endpoints of the read service:
+        GET /latest?tickers=AAPL,MSFT   latest metrics per ticker (every ticker without `tickers`)
+        GET /metrics/<ticker>?start=YYYY-MM-DD&end=YYYY-MM-DD   metrics of a ticker between two dates
+        GET /stats   cache size and hit rate
+    """
+
+    service = None  # Set by `serve`
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == '/latest':
+                tickers = [ticker for value in query.get('tickers', []) for ticker in value.split(',') if ticker] or None
+                self.send_json(200, self.service.latest_metrics(tickers))
+            elif url.path.startswith('/metrics/') and len(url.path) > len('/metrics/'):
+                start_date, end_date = (date.fromisoformat(query[name][0]) if name in query else None for name in ('start', 'end'))
+                self.send_json(200, self.service.metrics_between(unquote(url.path[len('/metrics/'):]), start_date, end_date))
+            elif url.path == '/stats':
+                self.send_json(200, self.service.cache.stats())
+            else:
+                self.send_json(404, {'error': f"Unknown path: {url.path}"})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            logging.error(f"Error serving {self.path}: {e}")
+            self.send_json(500, {'error': "Internal error"})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+
+def serve(service=None, host=SERVICE_HOST, port=SERVICE_PORT):
+    """
+    Serves the read API over HTTP until interrupted.
+
+    Args:
+        service (MetricsService): The service to expose. Defaults to a service on the configured database.
+        host (str): The address to listen on. Defaults to SERVICE_HOST.
+        port (int): The port to listen on. Defaults to SERVICE_PORT.
+    """
+    MetricsRequestHandler.service = service or MetricsService()
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    logging.info(f"Metrics service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info("Metrics service stopped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the aggregated metrics over HTTP.")
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+
+    serve(host=args.host, port=args.port)
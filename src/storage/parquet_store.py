@@ -0,0 +1,121 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Root directory of the local columnar store
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "data/stock_store")
+
+# Column order of the DataFrames produced by the ingestion step
+STORE_COLUMNS = ['Date', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Volume', 'curr_timestamp']
+
+
+def partition_path(root, ticker, year):
+    """
+    Returns the path of the Parquet file holding one ticker's bars of one year.
+    """
+    return os.path.join(root, f"Ticker={ticker}", f"year={year}", "data.parquet")
+
+
+def write_stock_data(df, root=LOCAL_STORE_PATH):
+    """
+    Writes fetched stock data into the local store, partitioned by ticker and year.
+
+    Each touched partition is merged with its existing file: rows are keyed by date and the
+    newly fetched row wins. Files are replaced atomically, so readers never see a partial file.
+
+    Args:
+        df (pd.DataFrame): Stock data with the STORE_COLUMNS columns.
+        root (str): The root directory of the store. Defaults to LOCAL_STORE_PATH.
+
+    Returns:
+        int: The number of partitions written.
+    """
+    if df.empty:
+        return 0
+
+    years = df['Date'].dt.year
+    written = 0
+    for (ticker, year), partition_df in df.groupby([df['Ticker'], years], sort=False):
+        path = partition_path(root, ticker, year)
+        partition_df = partition_df.drop(columns=['Ticker'])
+
+        if os.path.exists(path):
+            existing_df = pq.read_table(path, memory_map=True, partitioning=None).to_pandas()
+            partition_df = pd.concat([existing_df, partition_df], ignore_index=True)
+        partition_df = partition_df.drop_duplicates(subset=['Date'], keep='last').sort_values('Date')
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        pq.write_table(pa.Table.from_pandas(partition_df, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+        written += 1
+
+    logging.info(f"Wrote {len(df)} rows to {written} partitions of the local store '{root}'.")
+    return written
+
+
+def read_stock_data(root=LOCAL_STORE_PATH, tickers=None, start_date=None, end_date=None, columns=None):
+    """
+    Reads stock data from the local store.
+
+    Files are memory-mapped, only the requested columns are decoded, and the ticker and date
+    predicates are pushed down: whole ticker/year partitions are pruned from the directory
+    layout and row groups are skipped using the Parquet statistics.
+
+    Args:
+        root (str): The root directory of the store. Defaults to LOCAL_STORE_PATH.
+        tickers (list): Optional tickers to read.
+        start_date (str | datetime): Optional earliest date to read (inclusive).
+        end_date (str | datetime): Optional latest date to read (inclusive).
+        columns (list): Optional subset of STORE_COLUMNS to read.
+
+    Returns:
+        pd.DataFrame: The stored rows sorted by ticker and date, with the columns in STORE_COLUMNS order.
+            Empty if the store does not exist yet.
+    """
+    columns = [col for col in STORE_COLUMNS if columns is None or col in columns]
+    if not os.path.isdir(root):
+        logging.warning(f"Local store '{root}' does not exist yet.")
+        return pd.DataFrame(columns=columns)
+
+    filters = []
+    if tickers is not None:
+        filters.append(('Ticker', 'in', list(tickers)))
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        filters += [('year', '>=', start_date.year), ('Date', '>=', start_date)]
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+        filters += [('year', '<=', end_date.year), ('Date', '<=', end_date)]
+
+    table = pq.read_table(root, columns=columns, filters=filters or None, memory_map=True, partitioning='hive')
+    df = table.to_pandas()
+    if 'Ticker' in df.columns:
+        df['Ticker'] = df['Ticker'].astype(object)
+    sort_columns = [col for col in ['Ticker', 'Date'] if col in df.columns]
+    if sort_columns:
+        df = df.sort_values(sort_columns, kind='stable')
+    return df.reset_index(drop=True)[columns]
+
+
+def import_csv(csv_file, root=LOCAL_STORE_PATH):
+    """
+    Imports a CSV file in the former `stock_data.csv` format into the local store.
+    """
+    df = pd.read_csv(csv_file, parse_dates=['Date', 'curr_timestamp'])
+    return write_stock_data(df[STORE_COLUMNS], root)
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.storage.parquet_store import-csv stock_data.csv
+    if len(sys.argv) != 3 or sys.argv[1] != 'import-csv':
+        print("Usage: python -m src.storage.parquet_store import-csv <csv_file>")
+        sys.exit(1)
+    import_csv(sys.argv[2])
@@ -1,51 +1,162 @@
+import numpy as np
 import pandas as pd
 
-def validate_stock_data(df):
+# Define the required columns and their expected data types
+REQUIRED_COLUMNS = {
+    'Date': 'datetime64[ns]',
+    'Ticker': 'object',
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'Volume': 'int64',
+    'curr_timestamp': 'datetime64[ns]'
+}
+
+NUMERIC_COLUMNS = [col for col, dtype in REQUIRED_COLUMNS.items() if dtype in ['float64', 'int64']]
+
+# Row-level rules, as (bit flag, reason) pairs
+RULE_MISSING_VALUES = 1
+RULE_NEGATIVE_VALUES = 2
+RULE_OHLC_INCONSISTENT = 4
+RULE_DUPLICATE_KEY = 8
+ROW_RULES = [
+    (RULE_MISSING_VALUES, "missing values"),
+    (RULE_NEGATIVE_VALUES, "negative values"),
+    (RULE_OHLC_INCONSISTENT, "open/close outside the low-high range"),
+    (RULE_DUPLICATE_KEY, "duplicate (date, ticker)"),
+]
+
+
+def validate_schema(df):
     """
-    Validates the stock data DataFrame.
+    Checks that the DataFrame has the required columns with the expected data types.
+
+    An int64 column read as float64 because some of its values are missing is accepted:
+    those rows are caught by the row-level rules instead.
 
     Args:
         df (pd.DataFrame): The DataFrame to validate.
 
     Returns:
-        bool: True if the data is valid, False otherwise.
-        list: A list of validation error messages.
+        list: A list of validation error messages, empty if the schema is valid.
     """
     errors = []
 
-    # Define the required columns and their expected data types
-    required_columns = {
-        'Date': 'datetime64[ns]',
-        'Ticker': 'object',
-        'Open': 'float64',
-        'High': 'float64',
-        'Low': 'float64',
-        'Close': 'float64',
-        'Volume': 'int64',
-        'curr_timestamp': 'datetime64[ns]'
-    }
-
     # Check if all required columns exist
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
     if missing_columns:
         errors.append(f"Missing required columns: {', '.join(missing_columns)}")
 
-    # Check for missing values
-    if df.isnull().values.any():
-        errors.append("Data contains missing values.")
-
-    # Check if numeric columns are greater than or equal to 0
-    numeric_columns =  [col for col, dtype in required_columns.items() if dtype in ['float64', 'int64']]
-    for col in numeric_columns:
-        if col in df.columns and (df[col] < 0).any():
-            errors.append(f"Column '{col}' contains negative values.")
-
     # Check data types of each column
-    for col, expected_dtype in required_columns.items():
+    for col, expected_dtype in REQUIRED_COLUMNS.items():
         if col in df.columns:
             actual_dtype = str(df[col].dtype)
+            if actual_dtype == 'float64' and expected_dtype == 'int64' and df[col].isnull().any():
+                continue
             if actual_dtype != expected_dtype:
                 errors.append(f"Column '{col}' has incorrect data type. Expected: {expected_dtype}, Found: {actual_dtype}")
 
+    return errors
+
+
+def evaluate_row_rules(df):
+    """
+    Evaluates every row-level rule as a NumPy mask in a single pass over the data.
+
+    Args:
+        df (pd.DataFrame): A DataFrame with a valid schema (see `validate_schema`).
+
+    Returns:
+        np.ndarray: One uint8 per row with the bit flags of the rules the row fails (0 if valid).
+    """
+    codes = np.zeros(len(df), dtype=np.uint8)
+
+    # Tickers are factorized once: missing tickers get code -1 and the codes feed the duplicate check
+    ticker_codes, _ = pd.factorize(df['Ticker'])
+    missing = np.logical_or.reduce(
+        [ticker_codes == -1] + [df[col].isnull().to_numpy() for col in REQUIRED_COLUMNS if col != 'Ticker']
+    )
+    codes[missing] |= RULE_MISSING_VALUES
+
+    numeric = df[NUMERIC_COLUMNS].to_numpy(dtype=np.float64)
+    codes[(numeric < 0).any(axis=1)] |= RULE_NEGATIVE_VALUES
+
+    open_, high, low, close = (df[col].to_numpy(dtype=np.float64) for col in ['Open', 'High', 'Low', 'Close'])
+    consistent = (low <= open_) & (open_ <= high) & (low <= close) & (close <= high)
+    codes[~consistent & ~missing] |= RULE_OHLC_INCONSISTENT
+
+    # Pack (ticker, day) into one int64 key so that duplicates are found with an integer hash
+    days = df['Date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    keys = pd.Series((ticker_codes.astype(np.int64) << 32) | (days & 0xFFFFFFFF))
+    codes[keys.duplicated(keep=False).to_numpy()] |= RULE_DUPLICATE_KEY
+    return codes
+
+
+def describe_failures(codes):
+    """
+    Translates rule bit flags into human-readable failure reasons.
+
+    Args:
+        codes (np.ndarray): Bit flags as returned by `evaluate_row_rules`.
+
+    Returns:
+        np.ndarray: One '; '-separated string of reasons per code.
+    """
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    reasons = np.array(['; '.join(reason for flag, reason in ROW_RULES if code & flag) for code in unique_codes], dtype=object)
+    return reasons[inverse]
+
+
+def split_valid_rows(df):
+    """
+    Validates stock data row by row and separates the valid rows from the rejected ones.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to validate.
+
+    Returns:
+        pd.DataFrame: The valid rows, with the expected data types.
+        pd.DataFrame: The rejected rows, with a 'reasons' column listing the rules each one fails.
+            Empty if the schema is invalid, as no row can be evaluated.
+        list: Schema validation error messages. If not empty, no row is valid.
+    """
+    errors = validate_schema(df)
+    if errors:
+        return df.iloc[0:0], df.iloc[0:0].assign(reasons=pd.Series(dtype=object)), errors
+
+    codes = evaluate_row_rules(df)
+    rejected = codes != 0
+    if not rejected.any():
+        return df, df.iloc[0:0].assign(reasons=pd.Series(dtype=object)), errors
+
+    valid_df = df[~rejected]
+    if str(valid_df['Volume'].dtype) != 'int64':
+        valid_df = valid_df.astype({'Volume': 'int64'})  # Volume was float64 only because of missing values
+    rejected_df = df[rejected].assign(reasons=describe_failures(codes[rejected]))
+    return valid_df.reset_index(drop=True), rejected_df.reset_index(drop=True), errors
+
+
+def validate_stock_data(df):
+    """
+    Validates the stock data DataFrame.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to validate.
+
+    Returns:
+        bool: True if the data is valid, False otherwise.
+        list: A list of validation error messages.
+    """
+    errors = validate_schema(df)
+    if errors:
+        return False, errors
+
+    codes = evaluate_row_rules(df)
+    for flag, reason in ROW_RULES:
+        failed_rows = np.count_nonzero(codes & flag)
+        if failed_rows:
+            errors.append(f"{failed_rows} rows fail the rule: {reason}.")
+
     # Return validation result
-    return len(errors) == 0, errors
\ No newline at end of file
+    return len(errors) == 0, errors
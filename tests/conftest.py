@@ -0,0 +1,5 @@
+import os
+
+# The ingestion modules refuse to load without the API settings. The tests never call the API.
+os.environ.setdefault("ALPHA_VANTAGE_API_KEY", "test")
+os.environ.setdefault("ALPHA_VANTAGE_BASE_URL", "http://127.0.0.1:9/query")
@@ -0,0 +1,55 @@
+from datetime import date, datetime
+import pandas as pd
+from src.fetch_planner import (last_trading_session, next_session_close, plan_fetches, trim_to_new_rows,
+                               MARKET_TIMEZONE, COMPACT_MAX_SESSIONS)
+import numpy as np
+
+# Wednesday 2025-04-02, before and after the close in New York
+BEFORE_CLOSE = datetime(2025, 4, 2, 10, 0, tzinfo=MARKET_TIMEZONE)
+AFTER_CLOSE = datetime(2025, 4, 2, 17, 0, tzinfo=MARKET_TIMEZONE)
+SATURDAY = datetime(2025, 4, 5, 12, 0, tzinfo=MARKET_TIMEZONE)
+
+
+def test_last_trading_session():
+    assert last_trading_session(BEFORE_CLOSE) == date(2025, 4, 1)
+    assert last_trading_session(AFTER_CLOSE) == date(2025, 4, 2)
+    assert last_trading_session(SATURDAY) == date(2025, 4, 4)
+    assert last_trading_session(datetime(2025, 4, 7, 9, 0, tzinfo=MARKET_TIMEZONE)) == date(2025, 4, 4)
+
+
+def test_next_session_close():
+    assert next_session_close(BEFORE_CLOSE) == datetime(2025, 4, 2, 16, 0, tzinfo=MARKET_TIMEZONE)
+    assert next_session_close(AFTER_CLOSE) == datetime(2025, 4, 3, 16, 0, tzinfo=MARKET_TIMEZONE)
+    assert next_session_close(SATURDAY) == datetime(2025, 4, 7, 16, 0, tzinfo=MARKET_TIMEZONE)
+    # Friday after the close rolls over the weekend
+    assert next_session_close(datetime(2025, 4, 4, 16, 0, tzinfo=MARKET_TIMEZONE)) == \
+        datetime(2025, 4, 7, 16, 0, tzinfo=MARKET_TIMEZONE)
+
+
+def test_plan_fetches():
+    stale = date.fromisoformat(str(np.busday_offset('2025-04-02', -(COMPACT_MAX_SESSIONS + 1))))
+    latest_dates = {
+        'CURRENT': date(2025, 4, 2),
+        'BEHIND': date(2025, 3, 28),
+        'STALE': stale,
+    }
+    plan = plan_fetches(['CURRENT', 'BEHIND', 'STALE', 'NEW'], latest_dates, now=AFTER_CLOSE)
+    assert plan == {'BEHIND': 'compact', 'STALE': 'full', 'NEW': 'full'}
+
+
+def test_plan_fetches_before_the_close_waits_for_the_session():
+    plan = plan_fetches(['AAPL'], {'AAPL': date(2025, 4, 1)}, now=BEFORE_CLOSE)
+    assert plan == {}
+
+
+def test_plan_fetches_without_stored_state_fetches_compact():
+    assert plan_fetches(['AAPL', 'MSFT'], None, now=AFTER_CLOSE) == {'AAPL': 'compact', 'MSFT': 'compact'}
+
+
+def test_trim_to_new_rows_keeps_the_latest_stored_date():
+    df = pd.DataFrame({
+        'Date': pd.to_datetime(['2025-03-31', '2025-04-01', '2025-04-02', '2025-04-01']),
+        'Ticker': ['AAPL', 'AAPL', 'AAPL', 'NEW'],
+    })
+    trimmed = trim_to_new_rows(df, {'AAPL': date(2025, 4, 1)})
+    assert list(zip(trimmed['Ticker'], trimmed['Date'].dt.day)) == [('AAPL', 1), ('AAPL', 2), ('NEW', 1)]
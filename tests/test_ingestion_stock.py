@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from src.ingestion_stock import parse_time_series
+
+
+def make_bar(open_, high, low, close, volume):
+    return {'1. open': open_, '2. high': high, '3. low': low, '4. close': close, '5. volume': volume}
+
+
+def test_parse_time_series_types_every_column():
+    time_series = {
+        '2025-04-02': make_bar('223.8900', '225.1900', '221.0200', '223.8900', '35905904'),
+        '2025-04-01': make_bar('219.8050', '223.6800', '218.9000', '223.1900', '36412740'),
+    }
+    df = parse_time_series(time_series, 'AAPL')
+
+    assert list(df.columns) == ['Date', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Volume']
+    assert df['Date'].dtype == 'datetime64[ns]'
+    assert df['Ticker'].dtype == object
+    assert (df[['Open', 'High', 'Low', 'Close']].dtypes == np.float64).all()
+    assert df['Volume'].dtype == np.int64
+    assert df['Date'].tolist() == [pd.Timestamp('2025-04-02'), pd.Timestamp('2025-04-01')]
+    assert df['Ticker'].tolist() == ['AAPL', 'AAPL']
+    assert df.iloc[1][['Open', 'High', 'Low', 'Close', 'Volume']].tolist() == [219.805, 223.68, 218.9, 223.19, 36412740]
+
+
+def test_parse_time_series_of_an_empty_series_keeps_the_dtypes():
+    df = parse_time_series({}, 'AAPL')
+    assert df.empty
+    assert df.dtypes.to_dict() == parse_time_series({'2025-04-02': make_bar('1', '1', '1', '1', '1')}, 'AAPL').dtypes.to_dict()
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from src.ingestion_intraday import parse_intraday_series, compact_prices, empty_intraday_frame, INTRADAY_COLUMNS
+from src.db.intraday_operations import bar_months, INTRADAY_STAGING_COLUMNS, INTRADAY_PRICE_FORMAT
+from src.db.db_operations import copy_dataframe_to_table
+
+
+def make_bar(price, volume=100):
+    return {'1. open': price, '2. high': price, '3. low': price, '4. close': price, '5. volume': str(volume)}
+
+
+class FakeConnection:
+    """
+    Stands in for the SQLAlchemy connection of `copy_dataframe_to_table` and keeps the CSV it is sent.
+    """
+
+    def __init__(self):
+        self.connection = self
+        self.copied = []
+
+    def cursor(self):
+        return self
+
+    def copy_expert(self, sql, buffer):
+        self.copied.append(buffer.read())
+
+    def close(self):
+        pass
+
+
+def test_compact_prices_downcasts_prices_quoted_with_4_decimals():
+    prices = compact_prices({'open': np.array([123.4567, 99.99]), 'close': np.array([0.0001, np.nan])})
+    assert all(values.dtype == np.float32 for values in prices.values())
+
+
+def test_compact_prices_keeps_float64_if_any_price_would_lose_a_decimal():
+    prices = {'open': np.array([123.4567]), 'close': np.array([654321.1234])}
+    compacted = compact_prices(prices)
+    assert all(values.dtype == np.float64 for values in compacted.values())
+    assert compacted['close'][0] == 654321.1234
+
+
+def test_parse_intraday_series():
+    time_series = {
+        '2025-04-02 10:05:00': make_bar('223.8900', 1200),
+        '2025-04-02 10:00:00': make_bar('223.5000', 3400),
+    }
+    df = parse_intraday_series(time_series, 'AAPL', time_zone='US/Eastern')
+
+    assert list(df.columns) == INTRADAY_COLUMNS
+    assert df['ts'].tolist() == [int(pd.Timestamp('2025-04-02 14:05:00Z').timestamp()),
+                                 int(pd.Timestamp('2025-04-02 14:00:00Z').timestamp())]
+    assert isinstance(df['ticker'].dtype, pd.CategoricalDtype)
+    assert df['ticker'].tolist() == ['AAPL', 'AAPL']
+    assert df['close'].dtype == np.float32
+    assert df['volume'].tolist() == [1200, 3400]
+
+
+def test_parse_intraday_series_drops_bars_at_an_ambiguous_local_time():
+    time_series = {
+        '2025-11-02 01:30:00': make_bar('1.0000'),  # Repeated when the clocks go back
+        '2025-11-02 03:00:00': make_bar('2.0000'),
+    }
+    df = parse_intraday_series(time_series, 'AAPL', time_zone='US/Eastern')
+    assert df['close'].tolist() == [2.0]
+
+
+def test_parse_intraday_series_of_an_empty_series():
+    df = parse_intraday_series({}, 'AAPL')
+    assert df.empty
+    assert df.dtypes.to_dict() == empty_intraday_frame().dtypes.to_dict()
+
+
+def test_bar_months():
+    ts = pd.to_datetime(['2025-03-31 23:59:59', '2025-04-01 00:00:00', '2025-04-15 12:00:00', '2024-12-31 00:00:00'])
+    ts = ts.as_unit('s').asi8
+    assert bar_months(pd.DataFrame({'ts': ts})) == [(2024, 12), (2025, 3), (2025, 4)]
+
+
+def test_prices_load_the_same_whether_or_not_the_batch_was_upcast():
+    float32_bars = parse_intraday_series({'2025-04-02 10:00:00': make_bar('123.4567')}, 'AAPL')
+    float64_bars = parse_intraday_series({'2025-04-02 10:00:00': make_bar('654321.1234')}, 'MSFT')
+    mixed_batch = pd.concat([float32_bars.astype({'ticker': object}), float64_bars.astype({'ticker': object})],
+                            ignore_index=True)
+    assert mixed_batch['close'].dtype == np.float64
+
+    copied = []
+    for bars in [float32_bars, mixed_batch]:
+        conn = FakeConnection()
+        copy_dataframe_to_table(conn, bars, 'staging', INTRADAY_STAGING_COLUMNS, float_format=INTRADAY_PRICE_FORMAT)
+        copied.append(conn.copied[0].splitlines()[0])
+    assert copied[0] == copied[1]
+    assert copied[0].split(',')[2:6] == ['123.4567'] * 4
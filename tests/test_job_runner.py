@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from src.scheduler.job_runner import ScheduledJob
+
+
+class BlockingJob:
+    """
+    Job function that counts its runs and blocks each one until `release` is set.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def __call__(self, cancel_event):
+        self.runs += 1
+        self.started.release()
+        while not self.release.wait(0.01):
+            if cancel_event.is_set():
+                return
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def test_trigger_during_a_run_is_skipped(executor):
+    func = BlockingJob()
+    job = ScheduledJob('test', func, executor, overlap='skip')
+    job.trigger()
+    assert func.started.acquire(timeout=5)
+    job.trigger()
+    job.trigger()
+    func.release.set()
+    executor.shutdown(wait=True)
+    assert func.runs == 1
+    assert job.skipped_runs == 2
+
+
+def test_triggers_during_a_run_coalesce_into_one_more_run(executor):
+    func = BlockingJob()
+    job = ScheduledJob('test', func, executor, overlap='coalesce')
+    job.trigger()
+    assert func.started.acquire(timeout=5)
+    job.trigger()
+    job.trigger()
+    func.release.set()
+    assert func.started.acquire(timeout=5)
+    job.close()
+    executor.shutdown(wait=True)
+    assert func.runs == 2
+    assert job.skipped_runs == 2
+
+
+def test_timeout_sets_the_cancel_event(executor):
+    cancelled = threading.Event()
+
+    def func(cancel_event):
+        if cancel_event.wait(5):
+            cancelled.set()
+
+    ScheduledJob('test', func, executor, timeout=0.05).trigger()
+    assert cancelled.wait(5)
+
+
+def test_close_cancels_the_run_and_drops_later_triggers(executor):
+    func = BlockingJob()
+    job = ScheduledJob('test', func, executor)
+    job.trigger()
+    assert func.started.acquire(timeout=5)
+    job.close()
+    job.trigger()
+    executor.shutdown(wait=True)
+    assert func.runs == 1
+    assert job.skipped_runs == 0
+
+
+def test_invalid_overlap_policy(executor):
+    with pytest.raises(ValueError, match='overlap policy'):
+        ScheduledJob('test', BlockingJob(), executor, overlap='queue')
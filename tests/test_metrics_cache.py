@@ -0,0 +1,56 @@
+import pytest
+from src.service.metrics_service import MetricsCache
+
+
+def test_get_and_put():
+    cache = MetricsCache(max_size=10, ttl=0)
+    assert cache.get('a') is None
+    cache.put('a', 1, tickers=['AAPL'])
+    assert cache.get('a') == 1
+    assert cache.stats() == {'size': 1, 'service_cache_hits': 1, 'service_cache_misses': 1, 'hit_rate': 0.5}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MetricsCache(max_size=2, ttl=0)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('src.service.metrics_service.time.monotonic', lambda: now[0])
+    cache = MetricsCache(max_size=10, ttl=5)
+    cache.put('a', 1)
+    now[0] += 4
+    assert cache.get('a') == 1
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_invalidate_evicts_only_the_refreshed_tickers():
+    cache = MetricsCache(max_size=10, ttl=0)
+    cache.put('aapl', 1, tickers=['AAPL'])
+    cache.put('msft', 2, tickers=['MSFT'])
+    cache.put('latest', 3)  # Depends on every ticker
+    assert cache.invalidate(['AAPL']) == 2
+    assert cache.get('aapl') is None
+    assert cache.get('latest') is None
+    assert cache.get('msft') == 2
+    assert cache.invalidate() == 1
+    assert cache.get('msft') is None
+
+
+def test_read_started_before_an_invalidation_is_not_cached():
+    cache = MetricsCache(max_size=10, ttl=0)
+    generation = cache.generation
+    cache.invalidate(['AAPL'])
+    cache.put('aapl', 'stale', tickers=['AAPL'], generation=generation)
+    assert cache.get('aapl') is None
+    cache.put('aapl', 'fresh', tickers=['AAPL'], generation=cache.generation)
+    assert cache.get('aapl') == 'fresh'
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.aggregation.metrics_engine import (compute_stock_metrics, compute_catalog_metrics, select_catalog,
+                                            METRIC_CATALOG, METRIC_COLUMNS, CATALOG_COLUMNS)
+
+
+def make_raw_frame(n_tickers=3, n_days=260, seed=7):
+    """
+    Random-walk daily bars of a few tickers, shuffled so that the engine has to sort them.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(n_tickers):
+        close = 100 * np.cumprod(1 + rng.normal(0, 0.02, n_days))
+        open_ = close * (1 + rng.normal(0, 0.005, n_days))
+        frames.append(pd.DataFrame({
+            'Date': pd.bdate_range('2024-01-01', periods=n_days),
+            'Ticker': f"T{i}",
+            'Open': open_,
+            'High': np.maximum(open_, close) * 1.01,
+            'Low': np.minimum(open_, close) * 0.99,
+            'Close': close,
+            'Volume': rng.integers(1_000, 1_000_000, n_days),
+            'curr_timestamp': pd.Timestamp('2025-01-01'),
+        }))
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def sorted_lower(df):
+    return df.rename(columns=str.lower).sort_values(['ticker', 'date'], ignore_index=True)
+
+
+def test_compute_stock_metrics_matches_pandas_rolling():
+    raw = sorted_lower(make_raw_frame())
+    metrics = compute_stock_metrics(raw)
+
+    by_ticker = raw.groupby('ticker')
+    daily_return = by_ticker['close'].pct_change()
+    avg_daily_price = raw[['open', 'high', 'low', 'close']].sum(axis=1) / 4
+
+    def rolling(values, window, statistic):
+        # Mirrors the SQL window: the mean needs one value, the sample standard deviation two
+        grouped = values.groupby(raw['ticker'])
+        if statistic == 'mean':
+            return grouped.transform(lambda s: s.rolling(window, min_periods=1).mean())
+        return grouped.transform(lambda s: s.rolling(window, min_periods=2).std())
+
+    expected = {
+        'avg_daily_price': avg_daily_price,
+        'daily_return': daily_return,
+        'avg_return_7d': rolling(daily_return, 7, 'mean'),
+        'avg_return_10d': rolling(daily_return, 10, 'mean'),
+        'price_volatility_7d': rolling(avg_daily_price, 7, 'std'),
+        'return_volatility_7d': rolling(daily_return, 7, 'std'),
+        'return_volatility_10d': rolling(daily_return, 10, 'std'),
+    }
+    assert list(metrics.columns) == ['curr_timestamp', 'date', 'ticker'] + METRIC_COLUMNS
+    assert (metrics['ticker'].to_numpy() == raw['ticker'].to_numpy()).all()
+    for column, values in expected.items():
+        np.testing.assert_allclose(metrics[column].to_numpy(), values.to_numpy(), rtol=1e-9, atol=1e-12, err_msg=column)
+
+
+def test_compute_stock_metrics_restarts_windows_at_each_ticker():
+    metrics = compute_stock_metrics(make_raw_frame())
+    first_rows = metrics.groupby('ticker').head(1)
+    assert first_rows['daily_return'].isna().all()
+    assert first_rows['return_volatility_7d'].isna().all()
+
+
+def test_compute_stock_metrics_of_empty_frame():
+    metrics = compute_stock_metrics(make_raw_frame().iloc[0:0])
+    assert metrics.empty
+    assert list(metrics.columns) == ['curr_timestamp', 'date', 'ticker'] + METRIC_COLUMNS
+
+
+def test_compute_catalog_metrics_matches_pandas():
+    raw = sorted_lower(make_raw_frame())
+    metrics = compute_catalog_metrics(raw)
+    assert list(metrics.columns) == CATALOG_COLUMNS
+    wide = metrics.pivot(index=['ticker', 'date'], columns='metric', values='value')
+
+    by_ticker = raw.groupby('ticker')
+    daily_return = by_ticker['close'].pct_change()
+    previous_close = by_ticker['close'].shift()
+    true_range = np.fmax(raw['high'] - raw['low'],
+                         np.fmax((raw['high'] - previous_close).abs(), (raw['low'] - previous_close).abs()))
+    volume = raw['volume'].astype(np.float64)
+
+    def grouped(values):
+        return values.groupby(raw['ticker'])
+
+    volume_mean = grouped(volume).transform(lambda s: s.rolling(20).mean())
+    volume_std = grouped(volume).transform(lambda s: s.rolling(20).std())
+    expected = {
+        'sma_200': grouped(raw['close']).transform(lambda s: s.rolling(200).mean()),
+        'ema_20': grouped(raw['close']).transform(lambda s: s.ewm(span=20, adjust=False, min_periods=20).mean()),
+        'return_volatility_20d': grouped(daily_return).transform(lambda s: s.rolling(20).std()),
+        'ewma_volatility_20d': np.sqrt(grouped(daily_return ** 2).transform(
+            lambda s: s.ewm(span=20, adjust=False, min_periods=20).mean())),
+        'atr_14': grouped(true_range).transform(lambda s: s.ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()),
+        'volume_zscore_20': (volume - volume_mean) / volume_std,
+    }
+    index = pd.MultiIndex.from_frame(raw[['ticker', 'date']])
+    for name, values in expected.items():
+        actual = wide[name].reindex(index).to_numpy()
+        np.testing.assert_allclose(actual, values.to_numpy(), rtol=1e-9, atol=1e-12, err_msg=name)
+
+
+def test_compute_catalog_metrics_skips_incomplete_windows():
+    metrics = compute_catalog_metrics(make_raw_frame(n_tickers=2, n_days=250), select_catalog('sma_200'))
+    assert (metrics.groupby('ticker').size() == 250 - 199).all()
+    assert not metrics['value'].isna().any()
+
+
+def test_compute_catalog_metrics_of_a_subset_matches_the_whole_catalog():
+    raw = make_raw_frame()
+    subset = compute_catalog_metrics(raw, select_catalog(['atr_14', 'sma_20']))
+    whole = compute_catalog_metrics(raw)
+    expected = whole[whole['metric'].isin(['sma_20', 'atr_14'])].sort_values(['metric', 'ticker', 'date'], ignore_index=True)
+    pd.testing.assert_frame_equal(subset.sort_values(['metric', 'ticker', 'date'], ignore_index=True), expected)
+
+
+def test_select_catalog():
+    assert select_catalog() == METRIC_CATALOG
+    assert select_catalog('all') == METRIC_CATALOG
+    assert [entry[0] for entry in select_catalog('volume_zscore_20, sma_20')] == ['sma_20', 'volume_zscore_20']
+    with pytest.raises(ValueError, match='bogus'):
+        select_catalog('sma_20,bogus')
+    with pytest.raises(ValueError, match='Invalid catalog entry'):
+        select_catalog(catalog=[('sma_5', 'close', 5, 'median')])
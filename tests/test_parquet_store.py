@@ -0,0 +1,55 @@
+import os
+import pandas as pd
+from src.storage.parquet_store import write_stock_data, read_stock_data, partition_path, STORE_COLUMNS
+
+
+def make_frame(ticker, dates, close=100.0):
+    dates = pd.to_datetime(dates)
+    return pd.DataFrame({
+        'Date': dates,
+        'Ticker': ticker,
+        'Open': close,
+        'High': close + 1,
+        'Low': close - 1,
+        'Close': close,
+        'Volume': 1000,
+        'curr_timestamp': pd.Timestamp('2025-01-01'),
+    })[STORE_COLUMNS]
+
+
+def test_round_trip_partitions_by_ticker_and_year(tmp_path):
+    df = pd.concat([make_frame('AAPL', ['2024-12-31', '2025-01-02']), make_frame('MSFT', ['2025-01-02'])],
+                   ignore_index=True)
+    assert write_stock_data(df, root=tmp_path) == 3
+    assert os.path.exists(partition_path(tmp_path, 'AAPL', 2024))
+    assert os.path.exists(partition_path(tmp_path, 'AAPL', 2025))
+
+    stored = read_stock_data(root=tmp_path)
+    assert list(stored.columns) == STORE_COLUMNS
+    pd.testing.assert_frame_equal(stored, df, check_dtype=False)
+
+
+def test_rewritten_rows_replace_the_stored_ones(tmp_path):
+    write_stock_data(make_frame('AAPL', ['2025-01-02', '2025-01-03'], close=100.0), root=tmp_path)
+    write_stock_data(make_frame('AAPL', ['2025-01-03', '2025-01-06'], close=200.0), root=tmp_path)
+
+    stored = read_stock_data(root=tmp_path)
+    assert stored['Date'].dt.day.tolist() == [2, 3, 6]
+    assert stored['Close'].tolist() == [100.0, 200.0, 200.0]
+
+
+def test_read_filters_tickers_dates_and_columns(tmp_path):
+    df = pd.concat([make_frame('AAPL', ['2024-12-31', '2025-01-02', '2025-01-03']), make_frame('MSFT', ['2025-01-02'])],
+                   ignore_index=True)
+    write_stock_data(df, root=tmp_path)
+
+    stored = read_stock_data(root=tmp_path, tickers=['AAPL'], start_date='2025-01-01', end_date='2025-01-02',
+                             columns=['Date', 'Ticker', 'Close'])
+    assert list(stored.columns) == ['Date', 'Ticker', 'Close']
+    assert list(zip(stored['Ticker'], stored['Date'].dt.day)) == [('AAPL', 2)]
+
+
+def test_read_of_a_missing_store_is_empty(tmp_path):
+    stored = read_stock_data(root=tmp_path / 'missing')
+    assert stored.empty
+    assert list(stored.columns) == STORE_COLUMNS
@@ -0,0 +1,72 @@
+import pytest
+import src.rate_limiter as rate_limiter
+from src.rate_limiter import TokenBucket, RateLimiter
+
+
+class FakeClock:
+    """
+    Stands in for `time.monotonic` and `time.sleep`: sleeping only advances the clock.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(rate_limiter.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_bucket_starts_full_and_then_waits_for_a_refill(clock):
+    bucket = TokenBucket(rate=0.5, capacity=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(2.0)
+    clock.now += 1.5
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0
+
+
+def test_bucket_refills_up_to_its_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    for _ in range(3):
+        bucket.try_acquire()
+    clock.now += 3600
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire() > 0
+
+
+def test_acquire_sleeps_until_a_token_is_available(clock):
+    bucket = TokenBucket(rate=0.2, capacity=1)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(5.0)]
+
+
+def test_rate_limiter_paces_calls_per_minute(clock):
+    limiter = RateLimiter(calls_per_minute=30, calls_per_day=0, burst=1)
+    start = clock.now
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.now - start == pytest.approx(4.0)
+
+
+def test_rate_limiter_waits_for_the_daily_quota(clock):
+    limiter = RateLimiter(calls_per_minute=600, calls_per_day=2, burst=10)
+    limiter.acquire()
+    limiter.acquire()
+    start = clock.now
+    limiter.acquire()
+    assert clock.now - start == pytest.approx(86400 / 2)
@@ -0,0 +1,55 @@
+from datetime import date
+import pytest
+import src.monitoring.instrumentation as instrumentation
+from src.monitoring.instrumentation import RunMetrics, cache_hit_rates
+from src.db.response_fingerprints import ResponseFingerprints
+from src.ingestion_stock import response_fingerprint
+
+
+@pytest.fixture
+def run_metrics():
+    metrics = RunMetrics()
+    token = instrumentation._current_run.set(metrics)
+    yield metrics
+    instrumentation._current_run.reset(token)
+
+
+def test_response_fingerprint_ignores_the_key_order():
+    first = {'2025-04-02': {'1. open': '1.0', '4. close': '2.0'}, '2025-04-01': {'1. open': '3.0', '4. close': '4.0'}}
+    second = {'2025-04-01': {'4. close': '4.0', '1. open': '3.0'}, '2025-04-02': {'4. close': '2.0', '1. open': '1.0'}}
+    assert response_fingerprint(first, 'compact') == response_fingerprint(second, 'compact')
+
+
+def test_response_fingerprint_depends_on_the_values_and_the_output_size():
+    time_series = {'2025-04-02': {'1. open': '1.0'}}
+    fingerprint = response_fingerprint(time_series, 'compact')
+    assert response_fingerprint({'2025-04-02': {'1. open': '1.5'}}, 'compact') != fingerprint
+    assert response_fingerprint(time_series, 'full') != fingerprint
+
+
+def test_unchanged_response_is_dropped(run_metrics):
+    fingerprints = ResponseFingerprints({'AAPL': ('abc', date(2025, 4, 1))})
+    assert fingerprints.is_unchanged('AAPL', 'abc', '2025-04-01')
+    assert fingerprints.unchanged == {'AAPL'}
+    assert fingerprints.take() == {}
+    assert run_metrics.counters == {'response_cache_hits': 1}
+
+
+def test_changed_responses_are_pending_until_taken(run_metrics):
+    fingerprints = ResponseFingerprints({'AAPL': ('abc', date(2025, 4, 1))})
+    assert not fingerprints.is_unchanged('AAPL', 'def', '2025-04-02')
+    assert not fingerprints.is_unchanged('MSFT', 'ghi', '2025-04-02')
+    assert fingerprints.last_bar_date('AAPL') == date(2025, 4, 1)
+    assert fingerprints.last_bar_date('MSFT') is None
+
+    assert fingerprints.take(['MSFT', 'NVDA']) == {'MSFT': ('ghi', '2025-04-02')}
+    assert fingerprints.take() == {'AAPL': ('def', '2025-04-02')}
+    assert fingerprints.take() == {}
+    assert run_metrics.counters == {'response_cache_misses': 2}
+
+
+def test_cache_hit_rates():
+    counters = {'response_cache_hits': 3, 'response_cache_misses': 1, 'service_cache_hits': 0,
+                'service_cache_misses': 0, 'rows_changed': 10, 'plan_misses': 2}
+    assert cache_hit_rates(counters) == {'response_cache': 0.75}
+    assert cache_hit_rates({'service_cache_hits': 2}) == {'service_cache': 1.0}
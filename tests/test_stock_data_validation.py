@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+from src.validation.stock_data_validation import split_valid_rows
+
+
+def make_frame(rows):
+    df = pd.DataFrame(rows, columns=['Date', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['Ticker'] = df['Ticker'].astype(object)
+    df['curr_timestamp'] = pd.Timestamp('2025-01-01')
+    df['curr_timestamp'] = df['curr_timestamp'].astype('datetime64[ns]')
+    return df
+
+
+def test_split_valid_rows_keeps_valid_rows():
+    df = make_frame([
+        ('2025-01-02', 'AAPL', 10.0, 11.0, 9.0, 10.5, 100),
+        ('2025-01-03', 'AAPL', 10.5, 12.0, 10.0, 11.0, 200),
+    ])
+    valid_df, rejected_df, errors = split_valid_rows(df)
+    assert errors == []
+    assert len(valid_df) == 2
+    assert rejected_df.empty
+    assert 'reasons' in rejected_df.columns
+
+
+def test_split_valid_rows_quarantines_each_failing_rule():
+    df = make_frame([
+        ('2025-01-02', 'AAPL', 10.0, 11.0, 9.0, 10.5, 100),  # Valid
+        ('2025-01-03', 'AAPL', np.nan, 11.0, 9.0, 10.5, 100),  # Missing value
+        ('2025-01-06', 'AAPL', 10.0, 11.0, 9.0, 10.5, -5),  # Negative volume
+        ('2025-01-07', 'AAPL', 12.0, 11.0, 9.0, 10.5, 100),  # Open above the high
+        ('2025-01-08', 'MSFT', 10.0, 11.0, 9.0, 10.5, 100),  # Duplicate key
+        ('2025-01-08', 'MSFT', 10.0, 11.0, 9.0, 10.6, 100),
+    ])
+    valid_df, rejected_df, errors = split_valid_rows(df)
+    assert errors == []
+    assert valid_df['Date'].tolist() == [pd.Timestamp('2025-01-02')]
+    assert str(valid_df['Open'].dtype) == 'float64'
+    assert rejected_df['reasons'].tolist() == [
+        'missing values',
+        'negative values',
+        'open/close outside the low-high range',
+        'duplicate (date, ticker)',
+        'duplicate (date, ticker)',
+    ]
+
+
+def test_split_valid_rows_restores_integer_volume():
+    df = make_frame([
+        ('2025-01-02', 'AAPL', 10.0, 11.0, 9.0, 10.5, 100),
+        ('2025-01-03', 'AAPL', 10.0, 11.0, 9.0, 10.5, None),
+    ])
+    assert str(df['Volume'].dtype) == 'float64'
+    valid_df, rejected_df, errors = split_valid_rows(df)
+    assert errors == []
+    assert str(valid_df['Volume'].dtype) == 'int64'
+    assert rejected_df['reasons'].tolist() == ['missing values']
+
+
+def test_split_valid_rows_rejects_an_invalid_schema():
+    df = make_frame([('2025-01-02', 'AAPL', 10.0, 11.0, 9.0, 10.5, 100)]).drop(columns=['Close'])
+    valid_df, rejected_df, errors = split_valid_rows(df)
+    assert valid_df.empty
+    assert rejected_df.empty
+    assert errors == ['Missing required columns: Close']